@@ -1,35 +1,162 @@
 # 启梦教育平台主应用 - 修复版本
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, abort, send_file
 from flask_sqlalchemy import SQLAlchemy
+from markupsafe import Markup, escape
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from werkzeug.utils import send_file as send_file_offload
+from werkzeug.datastructures import MultiDict
 from werkzeug.utils import secure_filename
-from datetime import datetime, date
+import click
+from collections import Counter
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from datetime import datetime, date, timedelta
 import os
+import io
 import json
-import random
+import base64
+import secrets
+import hashlib
+import hmac
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import quote
 
-# 应用配置
+from cache import DataCache, ResponseCache, TTLCache, to_record
+from images import ImageError, ImagePipeline
+from instrumentation import QueryInstrumentation, query_limit
+from database import configure_database, database_url, init_engine
+from metrics import Metrics
+from material_store import MaterialStore, OffsetMismatch, UploadError, UploadNotFound
+from migrations import run_migrations
+from profiler import RequestProfiler
+import search
+import stats
+from student_import import ImportFileError, ImportJob, ImportQueueFull, StudentImporter
+from speech_jobs import QueueFull, RandomScorer, SpeechJobQueue
+from speech_scoring import ToneScorer, ffmpeg_available
+
+# 应用配置（可通过环境变量或 .env 文件覆盖，见 .env.example）
+load_dotenv()
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-here-2025'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///qimeng_education.db'
+# 会话签名密钥，生产环境必须通过环境变量设置；只有本地开发（python app.py 或 FLASK_DEBUG=1）时使用临时密钥
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', '')
+if not app.config['SECRET_KEY']:
+    if __name__ != '__main__' and not app.debug:
+        raise RuntimeError('未设置 SECRET_KEY 环境变量（见 .env.example）')
+    app.config['SECRET_KEY'] = os.environ['SECRET_KEY'] = secrets.token_hex(32)
+    # 写回环境变量，调试重载和 spawn 启动的子进程（导入 __main__ 模块）沿用同一密钥
+    print("警告: 未设置 SECRET_KEY，使用临时密钥，重启后已登录的会话失效")
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 2048))
+app.config['PAGE_CACHE_BACKEND'] = os.environ.get('PAGE_CACHE_BACKEND', 'memory')  # memory / filesystem / none
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 300))
+if os.environ.get('PAGE_CACHE_DIR'):
+    app.config['PAGE_CACHE_DIR'] = os.environ['PAGE_CACHE_DIR']
+app.config['DATA_CACHE_BACKEND'] = os.environ.get('DATA_CACHE_BACKEND', 'memory')  # memory / filesystem / none
+app.config['DATA_CACHE_TTL'] = int(os.environ.get('DATA_CACHE_TTL', 3600))
+if os.environ.get('DATA_CACHE_DIR'):
+    app.config['DATA_CACHE_DIR'] = os.environ['DATA_CACHE_DIR']
+app.config['SPEECH_WORKERS'] = int(os.environ.get('SPEECH_WORKERS', 2))
+app.config['SPEECH_QUEUE_SIZE'] = int(os.environ.get('SPEECH_QUEUE_SIZE', 32))
+app.config['SPEECH_SCORER'] = os.environ.get('SPEECH_SCORER', 'tone')  # tone: 本地声调评分 / random: 模拟评分
+# 口语评测任务状态目录，多进程部署时所有进程需为同一目录
+app.config['SPEECH_JOB_DIR'] = os.environ.get('SPEECH_JOB_DIR') or os.path.join(app.instance_path, 'speech_jobs')
+# 评测录音保存在static之外，只能通过 speech_audio 授权访问
+app.config['SPEECH_UPLOAD_FOLDER'] = os.environ.get('SPEECH_UPLOAD_FOLDER') or os.path.join(app.instance_path, 'speech')
+app.config['MATERIAL_MAX_SIZE'] = int(os.environ.get('MATERIAL_MAX_SIZE', 500 * 1024 * 1024))
+app.config['MATERIAL_CHUNK_SIZE'] = int(os.environ.get('MATERIAL_CHUNK_SIZE', 4 * 1024 * 1024))
+# 资料文件存储目录（不在static下，只能通过 material_file 授权下载）
+app.config['MATERIAL_DIR'] = os.environ.get('MATERIAL_DIR') or os.path.join(app.instance_path, 'materials')
+app.config['MATERIAL_PARTIAL_DIR'] = os.environ.get('MATERIAL_PARTIAL_DIR') or os.path.join(app.instance_path, 'material_uploads')
+# 资料下载交给前端服务器发送：空值由应用直接发送 / x-sendfile（Apache、lighttpd）/ x-accel（Nginx）
+app.config['MATERIAL_SENDFILE'] = os.environ.get('MATERIAL_SENDFILE', '')
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))  # 生成图片多尺寸版本的进程数
+app.config['MATERIAL_ACCEL_PREFIX'] = os.environ.get('MATERIAL_ACCEL_PREFIX', '/_protected_materials/')
+# 学生批量导入：计算密码哈希的进程数（0为CPU核数）、每批行数、密码哈希算法（留空使用默认算法）
+# 设置为较快的算法（如 pbkdf2:sha256:50000）时，学生首次登录后改用默认算法
+app.config['IMPORT_WORKERS'] = int(os.environ.get('IMPORT_WORKERS', 0))
+app.config['IMPORT_CHUNK_SIZE'] = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))
+app.config['IMPORT_PASSWORD_METHOD'] = os.environ.get('IMPORT_PASSWORD_METHOD', '')
+# 请求计时：Server-Timing头，慢请求/慢查询（毫秒）和同一SQL重复执行次数（疑似N+1）的警告阈值
+app.config['SQL_INSTRUMENTATION'] = os.environ.get('SQL_INSTRUMENTATION', '1') == '1'
+# Server-Timing 默认只发给管理员（调试模式下发给所有请求），设置为1对所有请求发送
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '0') == '1'
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 500))
+app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 100))
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+# 运行指标：多进程部署时各进程写入的共享目录（留空为单进程）、写入间隔（秒），/metrics 的抓取令牌（留空时只有管理员可以访问）
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', '')
+app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+# 请求分析：结果目录（默认 instance/profiles）、保留个数、随机分析比例（0为只按需分析）、方式 cprofile / sampler
+if os.environ.get('PROFILE_DIR'):
+    app.config['PROFILE_DIR'] = os.environ['PROFILE_DIR']
+app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 100))
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_MODE'] = os.environ.get('PROFILE_MODE', 'cprofile')
+configure_database(app)
 
 # 初始化扩展
 db = SQLAlchemy(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
+page_cache = ResponseCache(app)
+data_cache = DataCache(app)
+
+def profile_allowed():
+    """只有管理员可以通过请求头或参数触发请求分析、查看 Server-Timing"""
+    return current_user.is_authenticated and current_user.role == 'admin'
+
+with app.app_context():
+    init_engine(db.engine, app.config)
+    query_instrumentation = QueryInstrumentation(app, db.engine, allow_timing=profile_allowed)
+metrics = Metrics(app)
+
+def describe_profiled_request():
+    """分析记录中附加用户名和本次请求的查询数"""
+    info = {'user': current_user.username if current_user.is_authenticated else None}
+    timings = query_instrumentation.current()
+    if timings is not None:
+        info.update(queries=timings.queries, db_ms=round(timings.db_time * 1000, 1))
+    return info
+
+request_profiler = RequestProfiler(app, allow=profile_allowed, describe=describe_profiled_request)
 
 # 确保上传目录存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs('static/uploads/materials', exist_ok=True)
 os.makedirs('static/uploads/avatars', exist_ok=True)
+os.makedirs(app.config['SPEECH_UPLOAD_FOLDER'], exist_ok=True)
+image_pipeline = ImagePipeline(
+    'static/uploads/images',
+    '/static/uploads/images',
+    workers=app.config['IMAGE_WORKERS']
+)
+material_store = MaterialStore(
+    app.config['MATERIAL_DIR'],
+    app.config['MATERIAL_PARTIAL_DIR'],
+    max_size=app.config['MATERIAL_MAX_SIZE']
+)
 
 # 数据模型
 class User(UserMixin, db.Model):
+    __table_args__ = (
+        db.Index('ix_user_created', 'created_at'),
+        db.Index('ix_user_role_created', 'role', 'created_at'),
+        db.Index('ix_user_role_username', 'role', 'username'),
+        db.Index('ix_user_status_created', 'status', 'created_at'),
+        db.Index('ix_user_feed_token', 'feed_token', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -37,12 +164,31 @@ class User(UserMixin, db.Model):
     role = db.Column(db.String(20), nullable=False, default='student')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     avatar = db.Column(db.String(200), default='default-avatar.png')
+    status = db.Column(db.String(20), default='active')  # active, inactive
+    feed_token = db.Column(db.String(64))  # 课程表日历订阅令牌，首次使用时生成，可重置
+    
+    @db.orm.validates('email')
+    def normalize_email(self, key, email):
+        # 邮箱不区分大小写，统一保存为小写，查重时可以直接使用唯一索引
+        return email.strip().lower() if email else email
     
     # 关系定义
     student_profile = db.relationship('StudentProfile', backref='user', uselist=False, cascade='all, delete-orphan')
     teacher_profile = db.relationship('TeacherProfile', backref='user', uselist=False, cascade='all, delete-orphan')
+    
+    @property
+    def is_active(self):
+        # 被禁用的账户不能登录（Flask-Login）
+        return self.status != 'inactive'
+
+# 用户名按原样保存，查重不区分大小写（批量导入）时使用此索引
+db.Index('ix_user_username_lower', db.func.lower(User.username))
 
 class StudentProfile(db.Model):
+    __table_args__ = (
+        db.Index('ix_student_profile_user', 'user_id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     full_name = db.Column(db.String(100), nullable=False)
@@ -58,6 +204,10 @@ class StudentProfile(db.Model):
     speech_records = db.relationship('SpeechPracticeRecord', backref='student', lazy='dynamic', cascade='all, delete-orphan')
 
 class TeacherProfile(db.Model):
+    __table_args__ = (
+        db.Index('ix_teacher_profile_user', 'user_id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     full_name = db.Column(db.String(100), nullable=False)
@@ -71,6 +221,10 @@ class TeacherProfile(db.Model):
     courses = db.relationship('Course', backref='teacher', lazy='dynamic', cascade='all, delete-orphan')
 
 class Course(db.Model):
+    __table_args__ = (
+        db.Index('ix_course_teacher_status', 'teacher_id', 'status'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -87,8 +241,14 @@ class Course(db.Model):
     enrollments = db.relationship('CourseEnrollment', backref='course', lazy='dynamic', cascade='all, delete-orphan')
     materials = db.relationship('CourseMaterial', backref='course', lazy='dynamic', cascade='all, delete-orphan')
     lessons = db.relationship('Lesson', backref='course', lazy='dynamic', cascade='all, delete-orphan')
+    leave_requests = db.relationship('LeaveRequest', backref='course', lazy='dynamic', cascade='all, delete-orphan')
 
 class CourseEnrollment(db.Model):
+    __table_args__ = (
+        db.Index('ix_course_enrollment_student_status', 'student_id', 'status'),
+        db.Index('ix_course_enrollment_course_status', 'course_id', 'status'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student_profile.id'), nullable=False)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
@@ -97,6 +257,10 @@ class CourseEnrollment(db.Model):
     progress = db.Column(db.Integer, default=0)
 
 class Lesson(db.Model):
+    __table_args__ = (
+        db.Index('ix_lesson_course_date_status', 'course_id', 'lesson_date', 'status'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
     title = db.Column(db.String(100), nullable=False)
@@ -108,16 +272,29 @@ class Lesson(db.Model):
     status = db.Column(db.String(20), default='scheduled')
 
 class CourseMaterial(db.Model):
+    __table_args__ = (
+        db.Index('ix_course_material_course_upload', 'course_id', 'upload_date'),
+        db.Index('ix_course_material_content_hash', 'content_hash'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
-    file_path = db.Column(db.String(200), nullable=False)
+    file_path = db.Column(db.String(200), nullable=False)  # 资料存储中的文件名，旧数据为 /static/ 下的路径
     file_type = db.Column(db.String(20), nullable=False)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     is_public = db.Column(db.Boolean, default=True)
+    content_hash = db.Column(db.String(64))  # 上传文件的SHA-256，多条资料可引用同一文件
+    file_size = db.Column(db.Integer)
+    original_filename = db.Column(db.String(200))
 
 class LeaveRequest(db.Model):
+    __table_args__ = (
+        db.Index('ix_leave_request_student_status', 'student_id', 'status'),
+        db.Index('ix_leave_request_course_status', 'course_id', 'status'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student_profile.id'), nullable=False)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
@@ -129,6 +306,10 @@ class LeaveRequest(db.Model):
     processed_date = db.Column(db.DateTime)
 
 class SpeechPracticeRecord(db.Model):
+    __table_args__ = (
+        db.Index('ix_speech_record_student_date', 'student_id', 'practice_date'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student_profile.id'), nullable=False)
     topic = db.Column(db.String(100), nullable=False)
@@ -172,9 +353,164 @@ class CampProgram(db.Model):
     status = db.Column(db.String(20), default='active')
     featured_image = db.Column(db.String(200))
 
+# 登录用户缓存：用户及其学生/教师资料一次查询加载，缓存分离后的副本。
+# 缓存项带有共享的用户版本号（数据缓存的版本目录，多进程共享），任何用户资料提交后递增，
+# 其他进程中旧版本的缓存项随即失效，禁用账户、修改角色立即生效
+user_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+USER_MODELS = (User, StudentProfile, TeacherProfile)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    version = data_cache.versions.get('user')
+    item = user_cache.get(user_id)
+    if item is None or item[0] != version:
+        cached = db.session.get(User, user_id, options=[
+            db.joinedload(User.student_profile),
+            db.joinedload(User.teacher_profile)
+        ])
+        if cached is None:
+            return None
+        # 从当前会话移出，缓存中的对象不会被任何请求修改
+        db.session.expunge(cached)
+        user_cache.set(user_id, (version, cached))
+    else:
+        cached = item[1]
+    if not cached.is_active:
+        # 账户被禁用后，已登录的会话也随之失效
+        return None
+    # 不查库地合并到当前请求的会话中
+    return db.session.merge(cached, load=False)
+
+@db.event.listens_for(db.orm.Session, 'after_flush')
+def mark_users_changed(session, flush_context):
+    user_ids = session.info.setdefault('changed_users', set())
+    for target in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(target, USER_MODELS):
+            user_ids.add(target.id if isinstance(target, User) else target.user_id)
+
+@db.event.listens_for(db.orm.Session, 'after_commit')
+def invalidate_cached_users(session):
+    # 提交后才失效：提交前其他请求可能重新加载到旧数据并再次缓存
+    user_ids = session.info.pop('changed_users', None)
+    if user_ids:
+        for user_id in user_ids:
+            user_cache.delete(user_id)
+        data_cache.bump('user')
+
+# 参考数据缓存失效：记录本次事务修改过的表，提交后递增数据缓存版本并清空公开页面缓存
+CACHED_MODELS = (Course, StudyAbroadCase, CampProgram, TeacherProfile)
+
+def mark_table_changed(mapper, connection, target):
+    session = db.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_tables', set()).add(mapper.persist_selectable.name)
+
+for model in CACHED_MODELS:
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        db.event.listen(model, event_name, mark_table_changed)
+
+@db.event.listens_for(db.orm.Session, 'after_commit')
+def invalidate_reference_caches(session):
+    changed_tables = session.info.pop('changed_tables', None)
+    if changed_tables:
+        for table_name in changed_tables:
+            data_cache.bump(table_name)
+        page_cache.clear()
+
+@db.event.listens_for(db.orm.Session, 'after_rollback')
+def discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
+    session.info.pop('changed_users', None)
+
+# 全文搜索索引同步：在同一事务中更新索引（仅SQLite，索引表由迁移创建）
+SEARCH_MODELS = {Course: 'course', CourseMaterial: 'material', StudyAbroadCase: 'case', CampProgram: 'camp'}
+_search_index_ready = threading.Event()
+
+def search_index_ready(connection):
+    if not _search_index_ready.is_set() and search.supported(connection) and search.exists(connection):
+        _search_index_ready.set()
+    return _search_index_ready.is_set()
+
+def update_search_index(mapper, connection, target):
+    if search_index_ready(connection):
+        values = {attr.key: getattr(target, attr.key) for attr in mapper.column_attrs}
+        search.upsert(connection, SEARCH_MODELS[mapper.class_], values)
+
+def remove_from_search_index(mapper, connection, target):
+    if search_index_ready(connection):
+        search.delete(connection, SEARCH_MODELS[mapper.class_], target.id)
+
+for model in SEARCH_MODELS:
+    db.event.listen(model, 'after_insert', update_search_index)
+    db.event.listen(model, 'after_update', update_search_index)
+    db.event.listen(model, 'after_delete', remove_from_search_index)
+
+# 统计数据同步：ORM事件记录每行对统计的变化量，flush后在同一事务中累加（统计表由迁移创建）
+STATS_MODELS = (User, Course, CourseEnrollment, LeaveRequest, SpeechPracticeRecord)
+_stats_ready = threading.Event()
+
+def stats_ready(connection):
+    if not _stats_ready.is_set() and db.inspect(connection).has_table(stats.stat_counter.name):
+        _stats_ready.set()
+    return _stats_ready.is_set()
+
+def stat_values(mapper, target, previous=False):
+    columns = stats.RULES[mapper.persist_selectable.name][0]
+    if not previous:
+        return {column: getattr(target, column) for column in columns}
+    state = db.inspect(target)
+    values = {}
+    for column in columns:
+        history = state.attrs[column].history
+        values[column] = history.deleted[0] if history.deleted else getattr(target, column)
+    return values
+
+def record_stat_deltas(mapper, target, old, new):
+    session = db.object_session(target)
+    if session is None:
+        return
+    counters, daily = stats.deltas(mapper.persist_selectable.name, old, new)
+    pending = session.info.setdefault('stat_deltas', (Counter(), Counter()))
+    pending[0].update(counters)
+    pending[1].update(daily)
+
+def stats_after_insert(mapper, connection, target):
+    record_stat_deltas(mapper, target, None, stat_values(mapper, target))
+
+def stats_after_update(mapper, connection, target):
+    state = db.inspect(target)
+    columns = stats.RULES[mapper.persist_selectable.name][0]
+    if any(state.attrs[column].history.deleted for column in columns):
+        record_stat_deltas(mapper, target, stat_values(mapper, target, previous=True), stat_values(mapper, target))
+
+def stats_after_delete(mapper, connection, target):
+    record_stat_deltas(mapper, target, stat_values(mapper, target, previous=True), None)
+
+def load_previous_value(target, value, oldvalue, initiator):
+    # 仅为启用 active_history：对象过期后直接赋值时也先加载旧值，after_update 才能从历史中取到
+    pass
+
+for model in STATS_MODELS:
+    for column in stats.RULES[model.__table__.name][0]:
+        db.event.listen(getattr(model, column), 'set', load_previous_value, active_history=True)
+    db.event.listen(model, 'after_insert', stats_after_insert)
+    db.event.listen(model, 'after_update', stats_after_update)
+    db.event.listen(model, 'after_delete', stats_after_delete)
+
+@db.event.listens_for(db.orm.Session, 'before_flush')
+def reset_stat_deltas(session, flush_context, instances):
+    # 上一次flush失败时留下的变化量作废
+    session.info.pop('stat_deltas', None)
+
+@db.event.listens_for(db.orm.Session, 'after_flush')
+def apply_stat_deltas(session, flush_context):
+    pending = session.info.pop('stat_deltas', None)
+    if pending is None:
+        return
+    connection = session.connection()
+    if stats_ready(connection):
+        stats.apply(connection, *pending)
 
 # 多语言支持
 def get_language():
@@ -272,13 +608,649 @@ def course_color_filter(level):
     }
     return colors.get(level, '#6c757d')  # 默认灰色
 
+@app.template_filter('lesson_end')
+def lesson_end_filter(lesson):
+    """课程结束时间"""
+    return lesson.lesson_date + timedelta(minutes=lesson.duration or 0)
+
+@app.template_filter('responsive_img')
+def responsive_img_filter(url, alt='', sizes='100vw', default=None, **attrs):
+    """输出带 srcset 的 <picture>，浏览器按显示宽度选择 WebP/JPEG 版本
+
+    用法：{{ user.avatar|responsive_img('头像', sizes='150px', default='...', class_='rounded-circle') }}
+    不是上传处理过的图片时使用 default（没有则用原地址）。
+    """
+    variants = image_pipeline.variants(url)
+    if image_pipeline.parse_url(url) is None:
+        url = default or url
+    attributes = ''.join(
+        f' {escape(name.rstrip("_").replace("_", "-"))}="{escape(value)}"' for name, value in attrs.items()
+    )
+    if not variants:
+        return Markup(f'<img src="{escape(url)}" alt="{escape(alt)}"{attributes}>')
+    return Markup(
+        f'<picture>'
+        f'<source type="image/webp" srcset="{escape(image_pipeline.srcset(url, "webp"))}" sizes="{escape(sizes)}">'
+        f'<img src="{escape(variants["card"]["jpg"])}" srcset="{escape(image_pipeline.srcset(url, "jpg"))}" '
+        f'sizes="{escape(sizes)}" alt="{escape(alt)}" loading="lazy" decoding="async"{attributes}>'
+        f'</picture>'
+    )
+
+# 数据服务
+@data_cache.memoize('course')
+def get_active_courses(limit=None):
+    """在售课程（缓存的轻量记录）"""
+    query = Course.query.filter_by(status='active').order_by(Course.id)
+    if limit:
+        query = query.limit(limit)
+    return [to_record(course) for course in query.all()]
+
+@data_cache.memoize('teacher_profile')
+def get_teacher_profiles():
+    return [to_record(profile) for profile in TeacherProfile.query.order_by(TeacherProfile.id).all()]
+
+@data_cache.memoize('study_abroad_case')
+def get_study_abroad_cases(featured_only=False, limit=None):
+    query = StudyAbroadCase.query
+    if featured_only:
+        query = query.filter_by(is_featured=True)
+    query = query.order_by(StudyAbroadCase.created_date.desc())
+    if limit:
+        query = query.limit(limit)
+    return [to_record(case) for case in query.all()]
+
+@data_cache.memoize('camp_program')
+def get_active_camp_programs(limit=None):
+    query = CampProgram.query.filter_by(status='active').order_by(CampProgram.id)
+    if limit:
+        query = query.limit(limit)
+    return [to_record(program) for program in query.all()]
+
+def encode_cursor(*values):
+    """把排序键编码为分页游标（keyset分页）"""
+    raw = json.dumps([v.isoformat() if isinstance(v, (datetime, date)) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """解析分页游标，格式错误时抛出ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except Exception:
+        raise ValueError('无效的分页游标')
+    if not isinstance(values, list):
+        raise ValueError('无效的分页游标')
+    return values
+
+def json_response_with_etag(payload):
+    """返回带ETag的JSON响应，内容未变时自动返回304"""
+    response = jsonify(payload)
+    response.set_etag(hashlib.md5(response.get_data()).hexdigest())
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+def get_student_dashboard_data(student_id, lesson_limit=5):
+    """学生仪表盘视图数据
+
+    查询次数固定（选课+课程+教师、每门课前N节待上课程、待审批请假数），
+    与选课数量无关。
+    """
+    enrollments = CourseEnrollment.query.options(
+        db.joinedload(CourseEnrollment.course).joinedload(Course.teacher)
+    ).filter(
+        CourseEnrollment.student_id == student_id,
+        CourseEnrollment.status == 'active'
+    ).all()
+    
+    upcoming_lessons = []
+    course_ids = [enrollment.course_id for enrollment in enrollments]
+    if course_ids:
+        # 按课程分组取最近的N节课（窗口函数），课程对象已在会话中，lesson.course不会再查库
+        row_num = db.func.row_number().over(
+            partition_by=Lesson.course_id,
+            order_by=(Lesson.lesson_date, Lesson.id)
+        ).label('row_num')
+        ranked = db.session.query(Lesson.id.label('lesson_id'), row_num).filter(
+            Lesson.course_id.in_(course_ids),
+            Lesson.lesson_date >= datetime.now(),
+            Lesson.status == 'scheduled'
+        ).subquery()
+        upcoming_lessons = Lesson.query.join(
+            ranked, Lesson.id == ranked.c.lesson_id
+        ).filter(ranked.c.row_num <= lesson_limit).order_by(Lesson.lesson_date).all()
+    
+    pending_requests = LeaveRequest.query.filter_by(
+        student_id=student_id,
+        status='pending'
+    ).count()
+    
+    return {
+        'enrollments': enrollments,
+        'upcoming_lessons': upcoming_lessons,
+        'pending_requests': pending_requests
+    }
+
+def student_materials_query(student_id, file_type=None, course_id=None):
+    """学生可见资料：一次连接查询覆盖所有在读课程"""
+    query = CourseMaterial.query.join(
+        CourseEnrollment, CourseEnrollment.course_id == CourseMaterial.course_id
+    ).filter(
+        CourseEnrollment.student_id == student_id,
+        CourseEnrollment.status == 'active',
+        CourseMaterial.is_public == True
+    )
+    if file_type:
+        query = query.filter(CourseMaterial.file_type == file_type)
+    if course_id:
+        query = query.filter(CourseMaterial.course_id == course_id)
+    return query
+
+def get_student_materials_page(student_id, file_type=None, course_id=None,
+                               cursor=None, per_page=20, oldest_first=False):
+    """按(upload_date, id)做keyset分页，返回(资料列表, 下一页游标)"""
+    query = student_materials_query(student_id, file_type, course_id).options(
+        db.joinedload(CourseMaterial.course)
+    )
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            last_date, last_id = datetime.fromisoformat(values[0]), int(values[1])
+        except (IndexError, TypeError, ValueError):
+            raise ValueError('无效的分页游标')
+        if oldest_first:
+            query = query.filter(db.or_(
+                CourseMaterial.upload_date > last_date,
+                db.and_(CourseMaterial.upload_date == last_date, CourseMaterial.id > last_id)
+            ))
+        else:
+            query = query.filter(db.or_(
+                CourseMaterial.upload_date < last_date,
+                db.and_(CourseMaterial.upload_date == last_date, CourseMaterial.id < last_id)
+            ))
+    if oldest_first:
+        query = query.order_by(CourseMaterial.upload_date.asc(), CourseMaterial.id.asc())
+    else:
+        query = query.order_by(CourseMaterial.upload_date.desc(), CourseMaterial.id.desc())
+    
+    materials = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(materials) > per_page:
+        materials = materials[:per_page]
+        last = materials[-1]
+        next_cursor = encode_cursor(last.upload_date, last.id)
+    return materials, next_cursor
+
+def get_student_material_stats(student_id):
+    """按文件类型统计资料数量（一次GROUP BY）"""
+    rows = student_materials_query(student_id).with_entities(
+        CourseMaterial.file_type, db.func.count(CourseMaterial.id)
+    ).group_by(CourseMaterial.file_type).all()
+    stats = {file_type: count for file_type, count in rows}
+    stats['total'] = sum(stats.values())
+    return stats
+
+def material_to_dict(material):
+    return {
+        'id': material.id,
+        'course_id': material.course_id,
+        'course_name': material.course.name,
+        'title': material.title,
+        'description': material.description,
+        'file_type': material.file_type,
+        'file_url': url_for('material_file', material_id=material.id),
+        'download_url': url_for('material_file', material_id=material.id, download=1),
+        'file_size': material.file_size,
+        'upload_date': material.upload_date.isoformat() if material.upload_date else None
+    }
+
+MATERIAL_FILE_TYPES = {
+    '.pdf': 'pdf',
+    '.doc': 'doc', '.docx': 'doc',
+    '.ppt': 'ppt', '.pptx': 'ppt',
+    '.xls': 'excel', '.xlsx': 'excel',
+    '.mp3': 'audio', '.wav': 'audio', '.m4a': 'audio',
+    '.mp4': 'video', '.mov': 'video', '.webm': 'video',
+    '.jpg': 'image', '.jpeg': 'image', '.png': 'image',
+    '.txt': 'text', '.zip': 'zip'
+}
+
+def material_extension(filename):
+    """资料文件的扩展名（小写），不支持的类型返回None"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    return extension if extension in MATERIAL_FILE_TYPES else None
+
+def can_manage_course(course):
+    """当前用户是否可以管理课程（管理员或任课老师）"""
+    if current_user.role == 'admin':
+        return True
+    return (current_user.role == 'teacher' and current_user.teacher_profile is not None
+            and course.teacher_id == current_user.teacher_profile.id)
+
+def create_material(course_id, title, description, filename, digest, path, size):
+    """为已存储的文件创建资料记录"""
+    extension = os.path.splitext(filename)[1].lower()
+    material = CourseMaterial(
+        course_id=course_id,
+        title=title,
+        description=description,
+        file_path=material_store.blob_name(path),
+        file_type=MATERIAL_FILE_TYPES[extension],
+        content_hash=digest,
+        file_size=size,
+        original_filename=filename
+    )
+    db.session.add(material)
+    db.session.commit()
+    return material
+
+def enrolled_lessons_query(student_id):
+    """学生所有在读课程的课节（一次连接查询）"""
+    return Lesson.query.join(
+        CourseEnrollment, CourseEnrollment.course_id == Lesson.course_id
+    ).filter(
+        CourseEnrollment.student_id == student_id,
+        CourseEnrollment.status == 'active'
+    )
+
+def get_student_schedule(student_id, start, end):
+    """查询[start, end)时间窗口内的课节"""
+    return enrolled_lessons_query(student_id).options(
+        db.joinedload(Lesson.course).joinedload(Course.teacher)
+    ).filter(
+        Lesson.lesson_date >= start,
+        Lesson.lesson_date < end
+    ).order_by(Lesson.lesson_date, Lesson.id).all()
+
+def get_schedule_stats(student_id, start, end, now=None):
+    """时间窗口内的课程统计，由SQL聚合完成"""
+    now = now or datetime.now()
+    past = Lesson.lesson_date < now
+    total, attended, minutes = enrolled_lessons_query(student_id).filter(
+        Lesson.lesson_date >= start,
+        Lesson.lesson_date < end
+    ).with_entities(
+        db.func.count(Lesson.id),
+        db.func.sum(db.case((past, 1), else_=0)),
+        db.func.sum(db.case((past, Lesson.duration), else_=0))
+    ).one()
+    total = total or 0
+    attended = int(attended or 0)
+    return {
+        'total_classes': total,
+        'attended_classes': attended,
+        'upcoming_classes': total - attended,
+        'study_hours': round((minutes or 0) / 60, 1)
+    }
+
+def get_next_lesson(student_id, now=None):
+    """下一节待上的课"""
+    return enrolled_lessons_query(student_id).options(
+        db.joinedload(Lesson.course)
+    ).filter(
+        Lesson.lesson_date >= (now or datetime.now()),
+        Lesson.status == 'scheduled'
+    ).order_by(Lesson.lesson_date, Lesson.id).first()
+
+def lesson_to_event(lesson):
+    return {
+        'id': lesson.id,
+        'title': lesson.title,
+        'start': lesson.lesson_date.isoformat(),
+        'end': lesson_end_filter(lesson).isoformat(),
+        'status': lesson.status,
+        'classroom': lesson.classroom,
+        'online_link': lesson.online_link,
+        'course_id': lesson.course_id,
+        'course_name': lesson.course.name,
+        'course_level': lesson.course.level,
+        'color': course_color_filter(lesson.course.level),
+        'teacher': lesson.course.teacher.full_name
+    }
+
+def schedule_feed_token(user_id, rotate=False):
+    """课程表日历订阅令牌（日历客户端无法携带登录会话），首次使用时生成，rotate 时换新令牌使旧链接失效"""
+    user = db.session.get(User, user_id)
+    if rotate or not user.feed_token:
+        user.feed_token = secrets.token_urlsafe(32)
+        db.session.commit()
+    return user.feed_token
+
+def ics_escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def ics_fold(line, limit=75):
+    """按RFC 5545把超过75字节的内容行折行（续行以空格开头），不拆开多字节字符"""
+    if len(line.encode('utf-8')) <= limit:
+        return line
+    parts = []
+    current, size = '', 0
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > limit:
+            parts.append(current)
+            # 续行开头的空格占一个字节
+            current, size = ' ', 1
+        current += char
+        size += char_size
+    parts.append(current)
+    return '\r\n'.join(parts)
+
+def render_schedule_ics(lessons):
+    """生成iCalendar文本"""
+    fmt = '%Y%m%dT%H%M%S'
+    generated = datetime.utcnow().strftime(fmt) + 'Z'
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Qimeng Education//Schedule//ZH',
+        'CALSCALE:GREGORIAN',
+        'X-WR-CALNAME:启梦教育课程表'
+    ]
+    for lesson in lessons:
+        lines.extend([
+            'BEGIN:VEVENT',
+            f'UID:lesson-{lesson.id}@qimeng.edu',
+            f'DTSTAMP:{generated}',
+            f'DTSTART:{lesson.lesson_date.strftime(fmt)}',
+            f'DTEND:{lesson_end_filter(lesson).strftime(fmt)}',
+            f'SUMMARY:{ics_escape(lesson.course.name + " - " + lesson.title)}',
+            f'LOCATION:{ics_escape(lesson.classroom or lesson.online_link or "在线课程")}',
+            f'DESCRIPTION:{ics_escape(lesson.description)}',
+            'STATUS:CANCELLED' if lesson.status == 'cancelled' else 'STATUS:CONFIRMED',
+            'END:VEVENT'
+        ])
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(ics_fold(line) for line in lines) + '\r\n'
+
+def parse_date_arg(value, default):
+    """解析日期/时间查询参数（支持ISO格式），格式错误时抛出ValueError"""
+    if not value:
+        return default
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'无效的日期: {value}')
+    return parsed.replace(tzinfo=None)
+
+def get_teacher_classes(teacher_id):
+    """教师班级列表，在读人数由一次GROUP BY统计"""
+    rows = db.session.query(Course, db.func.count(CourseEnrollment.id)).outerjoin(
+        CourseEnrollment, db.and_(
+            CourseEnrollment.course_id == Course.id,
+            CourseEnrollment.status == 'active'
+        )
+    ).filter(Course.teacher_id == teacher_id).group_by(Course.id).order_by(Course.id).all()
+    
+    return [{
+        'id': course.id,
+        'name': f"{course.name}班",
+        'course': course,
+        'student_count': student_count,
+        'capacity': course.max_students,
+        'start_date': course.start_date,
+        'end_date': course.end_date
+    } for course, student_count in rows]
+
+def get_class_roster_page(course_id, status=None, cursor=None, per_page=50):
+    """班级学生名单：一次连接查询取出展示字段，按(enrollment_date, id)做keyset分页"""
+    query = db.session.query(
+        CourseEnrollment.id,
+        CourseEnrollment.enrollment_date,
+        CourseEnrollment.status,
+        StudentProfile.full_name,
+        User.username,
+        User.email
+    ).join(
+        StudentProfile, StudentProfile.id == CourseEnrollment.student_id
+    ).join(
+        User, User.id == StudentProfile.user_id
+    ).filter(CourseEnrollment.course_id == course_id)
+    if status:
+        query = query.filter(CourseEnrollment.status == status)
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            last_date, last_id = datetime.fromisoformat(values[0]), int(values[1])
+        except (IndexError, TypeError, ValueError):
+            raise ValueError('无效的分页游标')
+        query = query.filter(db.or_(
+            CourseEnrollment.enrollment_date > last_date,
+            db.and_(CourseEnrollment.enrollment_date == last_date, CourseEnrollment.id > last_id)
+        ))
+    
+    rows = query.order_by(CourseEnrollment.enrollment_date, CourseEnrollment.id).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].enrollment_date, rows[-1].id)
+    
+    students = [{
+        'enrollment_id': row.id,
+        'full_name': row.full_name,
+        'username': row.username,
+        'email': row.email,
+        'joined_at': row.enrollment_date.isoformat() if row.enrollment_date else None,
+        'status': row.status
+    } for row in rows]
+    return students, next_cursor
+
+LEAVE_ACTIONS = {'approve': 'approved', 'reject': 'rejected'}
+MAX_BULK_LEAVE_REQUESTS = 500
+
+def leave_request_to_dict(leave_request):
+    return {
+        'id': leave_request.id,
+        'course_id': leave_request.course_id,
+        'lesson_date': leave_request.lesson_date.isoformat(),
+        'reason': leave_request.reason,
+        'status': leave_request.status,
+        'request_date': leave_request.request_date.isoformat() if leave_request.request_date else None,
+        'teacher_comment': leave_request.teacher_comment,
+        'processed_date': leave_request.processed_date.isoformat() if leave_request.processed_date else None
+    }
+
+def process_leave_requests(request_ids, action, teacher_id=None, comment=None):
+    """集合式审批：一条 UPDATE 只修改其中待审批、且属于该教师课程的申请（teacher_id为空时不限课程）
+    
+    返回实际修改的ID列表，由调用方提交事务。批量更新不经过ORM事件，统计数据在这里同步。
+    """
+    status = LEAVE_ACTIONS[action]
+    conditions = [LeaveRequest.id.in_(request_ids), LeaveRequest.status == 'pending']
+    if teacher_id is not None:
+        conditions.append(LeaveRequest.course_id.in_(
+            db.select(Course.id).where(Course.teacher_id == teacher_id)
+        ))
+    values = {'status': status, 'processed_date': datetime.utcnow()}
+    if comment:
+        values['teacher_comment'] = comment
+    
+    statement = db.update(LeaveRequest).values(values).execution_options(synchronize_session=False)
+    if db.session.get_bind().dialect.update_returning:
+        updated_ids = list(db.session.scalars(statement.where(*conditions).returning(LeaveRequest.id)))
+    else:
+        # 不支持 UPDATE ... RETURNING（MySQL）时先锁定符合条件的行
+        updated_ids = list(db.session.scalars(db.select(LeaveRequest.id).where(*conditions).with_for_update()))
+        if updated_ids:
+            db.session.execute(statement.where(LeaveRequest.id.in_(updated_ids)))
+    
+    if updated_ids:
+        counters, daily = stats.deltas('leave_request', {'status': 'pending', 'request_date': None},
+                                       {'status': status, 'request_date': None})
+        stats.apply(db.session.connection(), {name: value * len(updated_ids) for name, value in counters.items()}, daily)
+    return sorted(updated_ids)
+
+LEAVE_STATUSES = ('pending', 'approved', 'rejected')
+
+def leave_queue_query(teacher_id=None):
+    """审批列表查询：一次连接查询取出学生姓名、用户名和课程名（teacher_id为空时不限课程）"""
+    query = db.session.query(
+        LeaveRequest.id,
+        LeaveRequest.course_id,
+        LeaveRequest.lesson_date,
+        LeaveRequest.request_date,
+        LeaveRequest.reason,
+        LeaveRequest.status,
+        LeaveRequest.teacher_comment,
+        LeaveRequest.processed_date,
+        StudentProfile.full_name.label('student_name'),
+        User.username,
+        Course.name.label('course_name')
+    ).join(
+        Course, Course.id == LeaveRequest.course_id
+    ).join(
+        StudentProfile, StudentProfile.id == LeaveRequest.student_id
+    ).join(
+        User, User.id == StudentProfile.user_id
+    )
+    if teacher_id is not None:
+        query = query.filter(Course.teacher_id == teacher_id)
+    return query
+
+def get_leave_queue_page(teacher_id=None, status=None, cursor=None, per_page=50):
+    """审批列表：待审批排在最前，再按申请时间倒序，按 (是否已处理, request_date, id) 做keyset分页"""
+    processed = db.case((LeaveRequest.status == 'pending', 0), else_=1)
+    query = leave_queue_query(teacher_id)
+    if status:
+        query = query.filter(LeaveRequest.status == status)
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            last_rank, last_date, last_id = int(values[0]), datetime.fromisoformat(values[1]), int(values[2])
+        except (IndexError, TypeError, ValueError):
+            raise ValueError('无效的分页游标')
+        query = query.filter(db.or_(
+            processed > last_rank,
+            db.and_(processed == last_rank, db.or_(
+                LeaveRequest.request_date < last_date,
+                db.and_(LeaveRequest.request_date == last_date, LeaveRequest.id < last_id)
+            ))
+        ))
+    
+    rows = query.order_by(processed, LeaveRequest.request_date.desc(), LeaveRequest.id.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(int(last.status != 'pending'), last.request_date, last.id)
+    
+    return [{
+        'id': row.id,
+        'course_id': row.course_id,
+        'course_name': row.course_name,
+        'student_name': row.student_name,
+        'username': row.username,
+        'lesson_date': row.lesson_date.isoformat(),
+        'request_date': row.request_date.isoformat() if row.request_date else None,
+        'reason': row.reason,
+        'status': row.status,
+        'teacher_comment': row.teacher_comment,
+        'processed_date': row.processed_date.isoformat() if row.processed_date else None
+    } for row in rows], next_cursor
+
+def get_leave_status_counts(teacher_id=None):
+    """各状态申请数（一次GROUP BY）"""
+    query = db.session.query(LeaveRequest.status, db.func.count(LeaveRequest.id))
+    if teacher_id is not None:
+        query = query.join(Course, Course.id == LeaveRequest.course_id).filter(Course.teacher_id == teacher_id)
+    counts = dict.fromkeys(LEAVE_STATUSES, 0)
+    counts.update(query.group_by(LeaveRequest.status).all())
+    counts['total'] = sum(counts[status] for status in LEAVE_STATUSES)
+    return counts
+
+USER_ROLES = ('student', 'teacher', 'admin')
+USER_STATUSES = ('active', 'inactive')
+# 排序参数 -> (排序列, 游标值解析)，前缀 - 表示倒序
+USER_SORTS = {
+    'created_at': (User.created_at, datetime.fromisoformat),
+    'username': (User.username, str),
+}
+
+def user_list_query():
+    """用户列表查询：一次连接查询取出展示字段，姓名来自学生或教师资料"""
+    return db.session.query(
+        User.id,
+        User.username,
+        User.email,
+        User.role,
+        User.status,
+        User.avatar,
+        User.created_at,
+        db.func.coalesce(StudentProfile.full_name, TeacherProfile.full_name).label('full_name')
+    ).outerjoin(
+        StudentProfile, db.and_(StudentProfile.user_id == User.id, User.role == 'student')
+    ).outerjoin(
+        TeacherProfile, db.and_(TeacherProfile.user_id == User.id, User.role == 'teacher')
+    )
+
+def user_row_to_dict(row):
+    avatar = row.avatar if image_pipeline.parse_url(row.avatar) else None
+    thumb = image_pipeline.variants(avatar).get('thumb') if avatar else None
+    return {
+        'id': row.id,
+        'username': row.username,
+        'email': row.email,
+        'full_name': row.full_name,
+        'role': row.role,
+        'status': row.status or 'active',
+        'avatar': thumb['webp'] if thumb else avatar,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    }
+
+def contains_pattern(value):
+    """LIKE 模糊匹配的模式（配合 escape='\\\\'），用户输入中的 % 和 _ 按普通字符匹配"""
+    return '%' + value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def get_users_page(role=None, status=None, q=None, sort='-created_at', cursor=None, per_page=50):
+    """用户列表：按 (排序列, id) 做keyset分页，每页只读取 per_page+1 行"""
+    descending = sort.startswith('-')
+    if sort.lstrip('-') not in USER_SORTS:
+        raise ValueError(f'无效的排序: {sort}')
+    column, parse_value = USER_SORTS[sort.lstrip('-')]
+    
+    query = user_list_query()
+    if role:
+        query = query.filter(User.role == role)
+    if status:
+        query = query.filter(User.status == status)
+    if q:
+        pattern = contains_pattern(q)
+        query = query.filter(db.or_(
+            User.username.ilike(pattern, escape='\\'),
+            User.email.ilike(pattern, escape='\\'),
+            StudentProfile.full_name.ilike(pattern, escape='\\'),
+            TeacherProfile.full_name.ilike(pattern, escape='\\')
+        ))
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            last_value, last_id = parse_value(values[0]), int(values[1])
+        except (IndexError, TypeError, ValueError):
+            raise ValueError('无效的分页游标')
+        if descending:
+            query = query.filter(db.or_(column < last_value, db.and_(column == last_value, User.id < last_id)))
+        else:
+            query = query.filter(db.or_(column > last_value, db.and_(column == last_value, User.id > last_id)))
+    
+    order = (column.desc(), User.id.desc()) if descending else (column, User.id)
+    rows = query.order_by(*order).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(getattr(rows[-1], column.key), rows[-1].id)
+    return [user_row_to_dict(row) for row in rows], next_cursor
+
+def public_page_cache_key():
+    """公开页面缓存键：路径 + 语言 + 登录状态"""
+    viewer = current_user.get_id() if current_user.is_authenticated else 'anon'
+    return f"page:{request.full_path}|{get_language()}|{viewer}"
+
 # 路由定义
 @app.route('/')
+@page_cache.cached(public_page_cache_key)
 def index():
     try:
-        featured_courses = Course.query.filter_by(status='active').limit(3).all()
-        featured_cases = StudyAbroadCase.query.filter_by(is_featured=True).limit(3).all()
-        camp_programs = CampProgram.query.filter_by(status='active').limit(3).all()
+        featured_courses = get_active_courses(limit=3)
+        featured_cases = get_study_abroad_cases(featured_only=True, limit=3)
+        camp_programs = get_active_camp_programs(limit=3)
     except Exception as e:
         print(f"首页数据加载错误: {e}")
         featured_courses = []
@@ -296,6 +1268,18 @@ def set_language_route(language):
         set_language(language)
     return redirect(request.referrer or url_for('index'))
 
+def upgrade_imported_password(user, password):
+    """批量导入时使用了较快的哈希算法的密码，首次登录时改用默认算法"""
+    method = app.config['IMPORT_PASSWORD_METHOD']
+    if not method or not user.password_hash.startswith(method + '$'):
+        return
+    try:
+        user.password_hash = generate_password_hash(password)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"更新密码哈希错误: {e}")
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -304,7 +1288,10 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and check_password_hash(user.password_hash, password):
-            login_user(user)
+            if not login_user(user):
+                flash('账户已被禁用，请联系管理员！', 'error')
+                return render_template('auth/login.html')
+            upgrade_imported_password(user, password)
             flash('登录成功！', 'success')
             
             if user.role == 'student':
@@ -318,6 +1305,18 @@ def login():
     
     return render_template('auth/login.html')
 
+def username_taken(username):
+    """用户名查重不区分大小写（与批量导入一致，使用 lower(username) 索引）"""
+    return db.session.query(User.query.filter(
+        db.func.lower(User.username) == username.strip().lower()).exists()).scalar()
+
+def email_taken(email, exclude=None):
+    """邮箱查重不区分大小写：保存时统一为小写，比较前同样转为小写"""
+    query = User.query.filter(User.email == email.strip().lower())
+    if exclude is not None:
+        query = query.filter(User.id != exclude.id)
+    return db.session.query(query.exists()).scalar()
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -326,11 +1325,11 @@ def register():
         password = request.form['password']
         role = request.form.get('role', 'student')
         
-        if User.query.filter_by(username=username).first():
+        if username_taken(username):
             flash('用户名已存在！', 'error')
             return render_template('auth/register.html')
         
-        if User.query.filter_by(email=email).first():
+        if email_taken(email):
             flash('邮箱已被注册！', 'error')
             return render_template('auth/register.html')
         
@@ -375,23 +1374,21 @@ def logout():
 
 # 课程相关路由
 @app.route('/courses')
+@page_cache.cached(public_page_cache_key)
 def courses():
     try:
-        courses = Course.query.filter_by(status='active').all()
+        courses = get_active_courses()
     except Exception as e:
         print(f"课程页面错误: {e}")
         courses = []
     return render_template('courses/index.html', courses=courses)
 
 @app.route('/chinese_courses')
+@page_cache.cached(public_page_cache_key)
 def chinese_courses():
     try:
-        courses = Course.query.filter_by(status='active').all()
-        # 获取教师信息
-        teachers = []
-        teacher_profiles = TeacherProfile.query.all()
-        for profile in teacher_profiles:
-            teachers.append(profile)
+        courses = get_active_courses()
+        teachers = get_teacher_profiles()
     except Exception as e:
         print(f"中文课程页面错误: {e}")
         courses = []
@@ -400,18 +1397,20 @@ def chinese_courses():
 
 # 留学服务路由
 @app.route('/study_abroad')
+@page_cache.cached(public_page_cache_key)
 def study_abroad():
     try:
-        cases = StudyAbroadCase.query.order_by(StudyAbroadCase.created_date.desc()).all()
+        cases = get_study_abroad_cases()
     except Exception as e:
         print(f"留学页面错误: {e}")
         cases = []
     return render_template('study_abroad/index.html', cases=cases)
 
 @app.route('/study_abroad/cases')
+@page_cache.cached(public_page_cache_key)
 def study_abroad_cases():
     try:
-        cases = StudyAbroadCase.query.order_by(StudyAbroadCase.created_date.desc()).all()
+        cases = get_study_abroad_cases()
     except Exception as e:
         print(f"留学案例页面错误: {e}")
         cases = []
@@ -419,9 +1418,10 @@ def study_abroad_cases():
 
 # 研学旅行路由
 @app.route('/camp')
+@page_cache.cached(public_page_cache_key)
 def camp():
     try:
-        programs = CampProgram.query.filter_by(status='active').all()
+        programs = get_active_camp_programs()
     except Exception as e:
         print(f"研学页面错误: {e}")
         programs = []
@@ -430,6 +1430,7 @@ def camp():
 # 学生系统路由
 @app.route('/student/dashboard')
 @login_required
+@query_limit(6)
 def student_dashboard():
     if current_user.role != 'student':
         flash('权限不足！', 'error')
@@ -440,37 +1441,16 @@ def student_dashboard():
             flash('学生资料不完整，请联系管理员！', 'error')
             return redirect(url_for('index'))
             
-        enrollments = CourseEnrollment.query.filter_by(
-            student_id=current_user.student_profile.id,
-            status='active'
-        ).all()
-        
-        upcoming_lessons = []
-        for enrollment in enrollments:
-            lessons = Lesson.query.filter(
-                Lesson.course_id == enrollment.course_id,
-                Lesson.lesson_date >= datetime.now(),
-                Lesson.status == 'scheduled'
-            ).order_by(Lesson.lesson_date).limit(5).all()
-            upcoming_lessons.extend(lessons)
-        
-        pending_requests = LeaveRequest.query.filter_by(
-            student_id=current_user.student_profile.id,
-            status='pending'
-        ).count()
+        dashboard = get_student_dashboard_data(current_user.student_profile.id)
     except Exception as e:
         print(f"学生仪表盘错误: {e}")
-        enrollments = []
-        upcoming_lessons = []
-        pending_requests = 0
+        dashboard = {'enrollments': [], 'upcoming_lessons': [], 'pending_requests': 0}
     
-    return render_template('student/dashboard.html',
-                         enrollments=enrollments,
-                         upcoming_lessons=upcoming_lessons,
-                         pending_requests=pending_requests)
+    return render_template('student/dashboard.html', **dashboard)
 
 @app.route('/student/materials')
 @login_required
+@query_limit(6)
 def student_materials():
     if current_user.role != 'student':
         flash('权限不足！', 'error')
@@ -481,26 +1461,28 @@ def student_materials():
             flash('学生资料不完整，请联系管理员！', 'error')
             return redirect(url_for('index'))
             
-        enrollments = CourseEnrollment.query.filter_by(
-            student_id=current_user.student_profile.id,
-            status='active'
-        ).all()
-        
-        materials = []
-        for enrollment in enrollments:
-            course_materials = CourseMaterial.query.filter_by(
-                course_id=enrollment.course_id,
-                is_public=True
-            ).all()
-            materials.extend(course_materials)
+        student_id = current_user.student_profile.id
+        enrollments = CourseEnrollment.query.options(
+            db.joinedload(CourseEnrollment.course)
+        ).filter_by(student_id=student_id, status='active').all()
+        materials, next_cursor = get_student_materials_page(student_id)
+        material_stats = get_student_material_stats(student_id)
     except Exception as e:
         print(f"学习资料页面错误: {e}")
+        enrollments = []
         materials = []
+        next_cursor = None
+        material_stats = {'total': 0}
     
-    return render_template('student/materials.html', materials=materials)
+    return render_template('student/materials.html',
+                         enrollments=enrollments,
+                         materials=materials,
+                         next_cursor=next_cursor,
+                         material_stats=material_stats)
 
 @app.route('/student/schedule')
 @login_required
+@query_limit(6)
 def student_schedule():
     if current_user.role != 'student':
         flash('权限不足！', 'error')
@@ -511,60 +1493,27 @@ def student_schedule():
             flash('学生资料不完整，请联系管理员！', 'error')
             return redirect(url_for('index'))
             
-        enrollments = CourseEnrollment.query.filter_by(
-            student_id=current_user.student_profile.id,
-            status='active'
-        ).all()
-        
-        lessons = []
-        for enrollment in enrollments:
-            course_lessons = Lesson.query.filter_by(
-                course_id=enrollment.course_id
-            ).order_by(Lesson.lesson_date).all()
-            lessons.extend(course_lessons)
-            
-        # 添加模板中需要的变量
-        next_class = None
-        today_classes = []
-        schedules = lessons  # 使用lessons作为schedules
-        
-        # 创建周统计数据
-        week_stats = {
-            'total_classes': len(lessons),
-            'attended_classes': 0,
-            'upcoming_classes': 0,
-            'study_hours': 0
-        }
-        
-        # 计算已上课和待上课的数量
+        student_id = current_user.student_profile.id
         now = datetime.now()
-        for lesson in lessons:
-            if lesson.lesson_date < now:
-                week_stats['attended_classes'] += 1
-                week_stats['study_hours'] += lesson.duration / 60  # 转换为小时
-            else:
-                week_stats['upcoming_classes'] += 1
-                # 找出下一节课
-                if next_class is None or (lesson.lesson_date > now and lesson.lesson_date < next_class.lesson_date):
-                    next_class = lesson
-                    
-            # 如果是今天的课，添加到today_classes
-            if lesson.lesson_date.date() == now.date():
-                today_classes.append(lesson)
-                
+        week_start = datetime.combine(now.date() - timedelta(days=now.weekday()), datetime.min.time())
+        week_end = week_start + timedelta(days=7)
+        
+        lessons = get_student_schedule(student_id, week_start, week_end)
+        week_stats = get_schedule_stats(student_id, week_start, week_end, now)
+        next_class = get_next_lesson(student_id, now)
+        today_classes = [lesson for lesson in lessons if lesson.lesson_date.date() == now.date()]
     except Exception as e:
         print(f"课程表页面错误: {e}")
         lessons = []
         next_class = None
         today_classes = []
-        schedules = []
         week_stats = {'total_classes': 0, 'attended_classes': 0, 'upcoming_classes': 0, 'study_hours': 0}
     
     return render_template('student/schedule.html', 
                           lessons=lessons,
                           next_class=next_class,
                           today_classes=today_classes,
-                          schedules=schedules,
+                          schedules=lessons,
                           week_stats=week_stats)
 
 @app.route('/student/leave_request', methods=['GET', 'POST'])
@@ -600,17 +1549,25 @@ def student_leave_request():
             status='active'
         ).all()
         
-        leave_requests = LeaveRequest.query.filter_by(
+        leave_requests = LeaveRequest.query.options(db.joinedload(LeaveRequest.course)).filter_by(
             student_id=current_user.student_profile.id
         ).order_by(LeaveRequest.request_date.desc()).all()
+        
+        upcoming_lessons = enrolled_lessons_query(current_user.student_profile.id).options(
+            db.joinedload(Lesson.course)
+        ).filter(
+            Lesson.lesson_date >= datetime.now(), Lesson.status == 'scheduled'
+        ).order_by(Lesson.lesson_date).limit(50).all()
     except Exception as e:
         print(f"请假页面错误: {e}")
         enrollments = []
         leave_requests = []
+        upcoming_lessons = []
     
     return render_template('student/leave_request.html', 
                          enrollments=enrollments, 
-                         leave_requests=leave_requests)
+                         leave_requests=leave_requests,
+                         upcoming_lessons=upcoming_lessons)
 
 @app.route('/student/speech_practice')
 @login_required
@@ -687,6 +1644,7 @@ def teacher_dashboard():
 
 @app.route('/teacher/classes')
 @login_required
+@query_limit(4)
 def teacher_classes():
     if current_user.role != 'teacher':
         flash('权限不足！', 'error')
@@ -697,27 +1655,7 @@ def teacher_classes():
             flash('教师资料不完整，请联系管理员！', 'error')
             return redirect(url_for('index'))
             
-        courses = Course.query.filter_by(
-            teacher_id=current_user.teacher_profile.id
-        ).all()
-        
-        classes = []
-        for course in courses:
-            enrollments = CourseEnrollment.query.filter_by(
-                course_id=course.id,
-                status='active'
-            ).all()
-            
-            class_info = {
-                'id': course.id,
-                'name': f"{course.name}班",
-                'course': course,
-                'students': [enrollment.student for enrollment in enrollments],
-                'capacity': course.max_students,
-                'start_date': course.start_date,
-                'end_date': course.end_date
-            }
-            classes.append(class_info)
+        classes = get_teacher_classes(current_user.teacher_profile.id)
     except Exception as e:
         print(f"教师班级页面错误: {e}")
         classes = []
@@ -726,106 +1664,370 @@ def teacher_classes():
 
 @app.route('/teacher/leave_approval')
 @login_required
+@query_limit(4)
 def teacher_leave_approval():
     if current_user.role != 'teacher':
         flash('权限不足！', 'error')
         return redirect(url_for('index'))
     
+    if not current_user.teacher_profile:
+        flash('教师资料不完整，请联系管理员！', 'error')
+        return redirect(url_for('index'))
+    
+    # 列表由页面通过 /api/leave-requests 分页加载，这里只统计各状态数量
     try:
-        if not current_user.teacher_profile:
-            flash('教师资料不完整，请联系管理员！', 'error')
-            return redirect(url_for('index'))
-            
-        leave_requests = LeaveRequest.query.join(Course).filter(
-            Course.teacher_id == current_user.teacher_profile.id
-        ).order_by(LeaveRequest.request_date.desc()).all()
+        counts = get_leave_status_counts(current_user.teacher_profile.id)
     except Exception as e:
         print(f"请假审批页面错误: {e}")
-        leave_requests = []
+        counts = dict.fromkeys(LEAVE_STATUSES + ('total',), 0)
     
-    return render_template('teacher/leave_approval.html', 
-                         leave_requests=leave_requests)
+    return render_template('teacher/leave_approval.html', counts=counts)
 
-@app.route('/teacher/approve_leave/<int:request_id>')
+# 修改状态的路由只接受POST，链接或预加载不会触发审批
+@app.route('/teacher/approve_leave/<int:request_id>', methods=['POST'])
 @login_required
 def approve_leave(request_id):
-    if current_user.role != 'teacher':
-        flash('权限不足！', 'error')
-        return redirect(url_for('index'))
-    
-    try:
-        leave_request = LeaveRequest.query.get_or_404(request_id)
-        leave_request.status = 'approved'
-        leave_request.processed_date = datetime.utcnow()
-        db.session.commit()
-        flash('请假申请已批准！', 'success')
-    except Exception as e:
-        print(f"批准请假错误: {e}")
-        flash('操作失败！', 'error')
-    
-    return redirect(url_for('teacher_leave_approval'))
+    return process_leave_request_page(request_id, 'approve')
 
-@app.route('/teacher/reject_leave/<int:request_id>')
+@app.route('/teacher/reject_leave/<int:request_id>', methods=['POST'])
 @login_required
 def reject_leave(request_id):
-    if current_user.role != 'teacher':
+    return process_leave_request_page(request_id, 'reject')
+
+def process_leave_request_page(request_id, action):
+    if current_user.role != 'teacher' or not current_user.teacher_profile:
         flash('权限不足！', 'error')
         return redirect(url_for('index'))
     
     try:
-        leave_request = LeaveRequest.query.get_or_404(request_id)
-        leave_request.status = 'rejected'
-        leave_request.processed_date = datetime.utcnow()
+        updated = process_leave_requests([request_id], action, teacher_id=current_user.teacher_profile.id)
         db.session.commit()
-        flash('请假申请已拒绝！', 'success')
     except Exception as e:
-        print(f"拒绝请假错误: {e}")
+        db.session.rollback()
+        print(f"审批请假错误: {e}")
         flash('操作失败！', 'error')
+        return redirect(url_for('teacher_leave_approval'))
     
+    if updated:
+        flash('请假申请已批准！' if action == 'approve' else '请假申请已拒绝！', 'success')
+    else:
+        flash('申请不存在或已处理！', 'error')
     return redirect(url_for('teacher_leave_approval'))
 
 # 管理员路由
 @app.route('/admin/dashboard')
 @login_required
+@query_limit(4)
 def admin_dashboard():
     if current_user.role != 'admin':
         flash('权限不足！', 'error')
         return redirect(url_for('index'))
     
     try:
-        total_students = User.query.filter_by(role='student').count()
-        total_teachers = User.query.filter_by(role='teacher').count()
-        total_courses = Course.query.count()
-        active_courses = Course.query.filter_by(status='active').count()
+        # 统计表增量维护，一次查询读出全部总数
+        counters = stats.read_counters(db.session.connection())
     except Exception as e:
         print(f"管理员仪表盘错误: {e}")
-        total_students = 0
-        total_teachers = 0
-        total_courses = 0
-        active_courses = 0
+        counters = {}
     
     return render_template('admin/dashboard.html',
-                         total_students=total_students,
-                         total_teachers=total_teachers,
-                         total_courses=total_courses,
-                         active_courses=active_courses)
+                         total_students=counters.get('users.student', 0),
+                         total_teachers=counters.get('users.teacher', 0),
+                         total_courses=counters.get('courses.total', 0),
+                         active_courses=counters.get('courses.active', 0))
+
+@app.route('/api/admin/stats')
+@login_required
+def api_admin_stats():
+    if current_user.role != 'admin':
+        return jsonify({'error': '权限不足'}), 403
+    
+    days = max(1, min(request.args.get('days', 30, type=int), 366))
+    try:
+        connection = db.session.connection()
+        return jsonify({
+            'counters': stats.read_counters(connection),
+            'daily': stats.read_daily(connection, days)
+        })
+    except Exception as e:
+        print(f"统计数据错误: {e}")
+        return jsonify({'error': '获取统计数据失败'}), 500
+
+@app.route('/admin/profiles')
+@login_required
+def admin_profiles():
+    if current_user.role != 'admin':
+        flash('权限不足！', 'error')
+        return redirect(url_for('index'))
+    
+    profiles = request_profiler.store.list()
+    endpoints = sorted({profile['endpoint'] for profile in profiles})
+    endpoint = request.args.get('endpoint', '')
+    if endpoint:
+        profiles = [profile for profile in profiles if profile['endpoint'] == endpoint]
+    sort = request.args.get('sort', 'time')
+    if sort == 'duration':
+        profiles.sort(key=lambda profile: profile['duration_ms'], reverse=True)
+    
+    targets = request_profiler.store.targets()
+    target_users = User.query.filter(User.id.in_(targets)).all() if targets else []
+    return render_template('admin/profiles.html',
+                         profiles=profiles,
+                         endpoints=endpoints,
+                         endpoint=endpoint,
+                         sort=sort,
+                         targets=[(user, datetime.fromtimestamp(targets[user.id])) for user in target_users])
+
+@app.route('/admin/profiles/<profile_id>')
+@login_required
+def admin_profile_summary(profile_id):
+    if current_user.role != 'admin':
+        return jsonify({'error': '权限不足'}), 403
+    
+    meta = request_profiler.store.get(profile_id)
+    if meta is None:
+        return jsonify({'error': '分析记录不存在'}), 404
+    return jsonify(dict(meta, summary=request_profiler.store.summary(meta)))
+
+@app.route('/admin/profiles/<profile_id>/download')
+@login_required
+def admin_profile_download(profile_id):
+    if current_user.role != 'admin':
+        abort(403)
+    
+    meta = request_profiler.store.get(profile_id)
+    if meta is None or not os.path.isfile(request_profiler.store.file_path(meta)):
+        abort(404)
+    return send_file(request_profiler.store.file_path(meta), as_attachment=True,
+                     download_name=f"{meta['endpoint']}-{meta['file']}")
+
+@app.route('/api/admin/profile-targets', methods=['POST'])
+@login_required
+def api_admin_profile_targets():
+    """为用户开启一段时间的请求分析（minutes为0时关闭）"""
+    if current_user.role != 'admin':
+        return jsonify({'error': '权限不足'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    user = User.query.filter_by(username=(data.get('username') or '').strip()).first()
+    if user is None:
+        return jsonify({'error': '用户不存在'}), 404
+    try:
+        minutes = int(data.get('minutes', 10))
+    except (TypeError, ValueError):
+        return jsonify({'error': '无效的时长'}), 400
+    if not 0 <= minutes <= 24 * 60:
+        return jsonify({'error': '时长应在0到1440分钟之间'}), 400
+    
+    request_profiler.set_target(user.id, minutes)
+    return jsonify({'user_id': user.id, 'username': user.username, 'minutes': minutes})
 
 @app.route('/admin/users')
 @login_required
+@query_limit(4)
 def admin_users():
     if current_user.role != 'admin':
         flash('权限不足！', 'error')
         return redirect(url_for('index'))
     
+    # 列表由页面通过 /api/users 分页加载，这里只读取统计总数
     try:
-        users = User.query.all()
+        counters = stats.read_counters(db.session.connection())
     except Exception as e:
         print(f"用户管理页面错误: {e}")
-        users = []
+        counters = {}
     
-    return render_template('admin/users.html', users=users)
+    user_counts = {role: counters.get(f'users.{role}', 0) for role in USER_ROLES}
+    courses = db.session.query(Course.id, Course.name).order_by(Course.id).all()
+    return render_template('admin/users.html', user_counts=user_counts, total_users=sum(user_counts.values()),
+                           courses=courses)
+
+# 口语评测任务：评分在后台线程完成，结果写入练习记录
+def save_speech_record(job, result):
+    with app.app_context():
+        record = SpeechPracticeRecord(
+            student_id=job.submission['student_id'],
+            topic=job.submission['topic'],
+            text_content=job.submission['text'],
+            audio_file=os.path.basename(job.submission['audio_path']),
+            score=result['score'],
+            pronunciation_score=result['pronunciation_score'],
+            fluency_score=result['fluency_score'],
+            feedback=result['feedback']
+        )
+        db.session.add(record)
+        db.session.commit()
+        result['record_id'] = record.id
+
+def discard_speech_audio(job):
+    """评测失败的录音不会被任何记录引用，直接删除"""
+    remove_file(job.submission['audio_path'])
+
+def make_speech_scorer():
+    """本地评分需要 ffmpeg 解码浏览器录音（webm/ogg），未安装时改用模拟评分并记录警告"""
+    if app.config['SPEECH_SCORER'] == 'random':
+        return RandomScorer()
+    if not ffmpeg_available():
+        app.logger.warning('未安装ffmpeg，无法解码浏览器录音，口语评测改用模拟评分')
+        return RandomScorer()
+    return ToneScorer()
+
+speech_jobs = SpeechJobQueue(
+    make_speech_scorer(),
+    workers=app.config['SPEECH_WORKERS'],
+    maxsize=app.config['SPEECH_QUEUE_SIZE'],
+    on_complete=save_speech_record,
+    on_failure=discard_speech_audio,
+    directory=app.config['SPEECH_JOB_DIR']
+)
+
+# 学生批量导入：后台线程分批写入，统计数据由导入器同步
+@contextmanager
+def import_transaction():
+    with app.app_context(), db.engine.begin() as connection:
+        yield connection
+
+student_importer = StudentImporter(
+    import_transaction,
+    db.metadata,
+    workers=app.config['IMPORT_WORKERS'] or None,
+    chunk_size=app.config['IMPORT_CHUNK_SIZE'],
+    password_method=app.config['IMPORT_PASSWORD_METHOD']
+)
+
+# 运行指标：连接池、缓存和口语评测队列在采集时读取当前值
+@metrics.registry.collector
+def collect_db_pool():
+    with app.app_context():
+        pool = db.engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return []
+    return [
+        ('db_pool_size', 'gauge', '连接池大小', {}, pool.size()),
+        ('db_pool_connections', 'gauge', '连接池中的连接数', {'state': 'checked_out'}, pool.checkedout()),
+        ('db_pool_connections', 'gauge', '连接池中的连接数', {'state': 'checked_in'}, pool.checkedin()),
+        ('db_pool_connections', 'gauge', '连接池中的连接数', {'state': 'overflow'}, max(pool.overflow(), 0))
+    ]
+
+@metrics.registry.collector
+def collect_caches():
+    rows = []
+    for name, cache in (('user', user_cache), ('page', page_cache), ('data', data_cache)):
+        cache_stats = cache.stats()
+        rows.append(('cache_hits_total', 'counter', '缓存命中次数', {'cache': name}, cache_stats['hits']))
+        rows.append(('cache_misses_total', 'counter', '缓存未命中次数', {'cache': name}, cache_stats['misses']))
+    return rows
+
+@metrics.registry.collector
+def collect_speech_jobs():
+    job_stats = speech_jobs.stats()
+    rows = [
+        ('speech_jobs_total', 'counter', '口语评测任务数', {'result': result}, job_stats[result])
+        for result in ('submitted', 'completed', 'failed', 'rejected')
+    ]
+    rows += [
+        ('speech_job_seconds_total', 'counter', '口语评测累计耗时（秒）', {'phase': 'queue'}, job_stats['queue_seconds']),
+        ('speech_job_seconds_total', 'counter', '口语评测累计耗时（秒）', {'phase': 'score'}, job_stats['score_seconds']),
+        ('speech_queue_depth', 'gauge', '排队中的口语评测任务数', {}, job_stats['queue_depth']),
+        ('speech_workers', 'gauge', '口语评测线程数', {}, job_stats['workers'])
+    ]
+    return rows
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """运行指标：管理员登录后可以访问，设置 METRICS_TOKEN 后也可以用令牌抓取"""
+    if not (current_user.is_authenticated and current_user.role == 'admin'):
+        token = app.config['METRICS_TOKEN']
+        supplied = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {token}'.encode('utf-8')):
+            abort(401)
+    return app.response_class(metrics.registry.render(), content_type=Metrics.content_type)
 
 # API路由
+@app.route('/api/materials')
+@login_required
+def api_materials():
+    if current_user.role != 'student':
+        return jsonify({'error': '权限不足'}), 403
+    
+    if not current_user.student_profile:
+        return jsonify({'error': '学生资料不完整'}), 400
+    
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+    try:
+        materials, next_cursor = get_student_materials_page(
+            current_user.student_profile.id,
+            file_type=request.args.get('file_type') or None,
+            course_id=request.args.get('course_id', type=int),
+            cursor=request.args.get('cursor') or None,
+            per_page=per_page,
+            oldest_first=request.args.get('order') == 'oldest'
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return json_response_with_etag({
+        'materials': [material_to_dict(material) for material in materials],
+        'next_cursor': next_cursor
+    })
+
+SPEECH_AUDIO_TYPES = {
+    'audio/webm': '.webm',
+    'audio/ogg': '.ogg',
+    'audio/wav': '.wav',
+    'audio/wave': '.wav',
+    'audio/x-wav': '.wav',
+    'audio/mpeg': '.mp3',
+    'audio/mp4': '.m4a',
+    'application/octet-stream': '.bin'
+}
+
+def save_speech_audio(stream, mimetype, student_id):
+    """把录音按块写入 SPEECH_UPLOAD_FOLDER，返回文件路径"""
+    extension = SPEECH_AUDIO_TYPES.get(mimetype, '.bin')
+    filename = f"{student_id}_{uuid.uuid4().hex}{extension}"
+    path = os.path.join(app.config['SPEECH_UPLOAD_FOLDER'], filename)
+    try:
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(stream, f, 64 * 1024)
+        if os.path.getsize(path) == 0:
+            raise ValueError('录音为空')
+    except BaseException:
+        remove_file(path)
+        raise
+    return path
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def read_speech_submission():
+    """解析评测请求，返回 (text, topic, 录音流, 录音类型)
+
+    支持三种格式：
+    - 原始请求体：Content-Type 为音频类型，text/topic 放在查询参数中
+    - multipart/form-data：text、topic 字段和 audio 文件
+    - JSON：{"text", "topic", "audio": base64}，仅作兼容
+    """
+    if request.mimetype in SPEECH_AUDIO_TYPES:
+        return request.args.get('text', ''), request.args.get('topic', ''), request.stream, request.mimetype
+    if request.mimetype == 'multipart/form-data':
+        audio = request.files.get('audio')
+        if audio is None:
+            return request.form.get('text', ''), request.form.get('topic', ''), None, None
+        return request.form.get('text', ''), request.form.get('topic', ''), audio.stream, audio.mimetype
+
+    data = request.get_json(silent=True) or {}
+    audio = None
+    if data.get('audio'):
+        try:
+            audio = io.BytesIO(base64.b64decode(data['audio']))
+        except ValueError:
+            audio = None
+    return data.get('text', ''), data.get('topic', ''), audio, data.get('mimetype') or 'application/octet-stream'
+
 @app.route('/api/speech_evaluate', methods=['POST'])
 @login_required
 def api_speech_evaluate():
@@ -835,41 +2037,806 @@ def api_speech_evaluate():
     if not current_user.student_profile:
         return jsonify({'error': '学生资料不完整'}), 400
     
-    data = request.get_json()
-    text = data.get('text', '')
-    topic = data.get('topic', '')
+    # 队列已满时在读取录音之前拒绝
+    if speech_jobs.full():
+        response = jsonify({'error': '评测繁忙，请稍后重试'})
+        response.headers['Retry-After'] = str(speech_jobs.retry_after())
+        return response, 503
     
-    # 模拟AI评分
-    score = random.randint(70, 95)
-    pronunciation_score = random.randint(65, 95)
-    fluency_score = random.randint(70, 90)
+    text, topic, audio, mimetype = read_speech_submission()
+    if not text:
+        return jsonify({'error': '请先输入要练习的文本'}), 400
+    if audio is None:
+        return jsonify({'error': '未收到录音'}), 400
     
-    feedback = f"总体表现良好。发音准确度：{pronunciation_score}分，流利度：{fluency_score}分。"
+    try:
+        audio_path = save_speech_audio(audio, mimetype, current_user.student_profile.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OSError as e:
+        print(f"保存录音失败: {e}")
+        return jsonify({'error': '保存录音失败，请重试'}), 500
     
     try:
-        record = SpeechPracticeRecord(
-            student_id=current_user.student_profile.id,
-            topic=topic,
-            text_content=text,
-            score=score,
-            pronunciation_score=pronunciation_score,
-            fluency_score=fluency_score,
-            feedback=feedback
+        job = speech_jobs.submit(current_user.id, {
+            'student_id': current_user.student_profile.id,
+            'text': text,
+            'topic': topic,
+            'audio_path': audio_path
+        })
+    except QueueFull:
+        remove_file(audio_path)
+        response = jsonify({'error': '评测繁忙，请稍后重试'})
+        response.headers['Retry-After'] = str(speech_jobs.retry_after())
+        return response, 503
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('api_speech_job', job_id=job.id),
+        'events_url': url_for('api_speech_job_events', job_id=job.id)
+    }), 202
+
+def get_own_speech_job(job_id):
+    job = speech_jobs.get(job_id)
+    if job is None or job.owner_id != current_user.id:
+        return None
+    return job
+
+@app.route('/api/speech_evaluate/<job_id>')
+@login_required
+def api_speech_job(job_id):
+    job = get_own_speech_job(job_id)
+    if job is None:
+        return jsonify({'error': '评测任务不存在'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/speech/audio/<int:record_id>')
+@login_required
+def speech_audio(record_id):
+    """练习录音，只有本人和管理员可以访问"""
+    record = db.session.get(SpeechPracticeRecord, record_id)
+    if record is None or not record.audio_file:
+        abort(404)
+    profile = current_user.student_profile
+    if current_user.role != 'admin' and (profile is None or profile.id != record.student_id):
+        abort(403)
+    path = safe_join(app.config['SPEECH_UPLOAD_FOLDER'], record.audio_file)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return send_file(path, conditional=True)
+
+SPEECH_EVENTS_WAIT = 5
+
+@app.route('/api/speech_evaluate/<job_id>/events')
+@login_required
+def api_speech_job_events(job_id):
+    """Server-Sent Events：任务完成时推送结果"""
+    job = get_own_speech_job(job_id)
+    if job is None:
+        return jsonify({'error': '评测任务不存在'}), 404
+    
+    def stream():
+        # 最多等待几秒就结束连接，浏览器按 retry 间隔自动重连，不长时间占用工作线程
+        yield 'retry: 1000\n\n'
+        finished = speech_jobs.wait(job, SPEECH_EVENTS_WAIT)
+        if finished is not None:
+            yield f"event: result\ndata: {json.dumps(finished.to_dict(), ensure_ascii=False)}\n\n"
+    
+    return app.response_class(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# 旧版本保存在static下的资料和评测录音，迁移前也不允许直接作为静态文件读取
+PROTECTED_STATIC_DIRS = [
+    os.path.realpath(os.path.join(app.static_folder, 'uploads', name)) for name in ('materials', 'speech')
+]
+
+@app.before_request
+def protect_material_files():
+    """按解析后的实际路径判断（// 、./ 、符号链接等写法都指向同一文件）"""
+    if request.endpoint != 'static':
+        return
+    path = safe_join(app.static_folder, (request.view_args or {}).get('filename', ''))
+    if path is None:
+        return
+    path = os.path.realpath(path)
+    if any(path == directory or path.startswith(directory + os.sep) for directory in PROTECTED_STATIC_DIRS):
+        abort(404)
+
+def material_file_path(material):
+    """资料在磁盘上的路径，文件不存在时返回None"""
+    if material.file_path.startswith('/static/'):
+        # 尚未执行 flask move-material-files 的旧数据
+        path = safe_join(app.static_folder, material.file_path[len('/static/'):])
+    else:
+        path = material_store.resolve(material.file_path)
+    if path is None or not os.path.isfile(path):
+        return None
+    return path
+
+def can_access_material(material):
+    """管理员、任课老师，或在读且资料公开的学生可以访问"""
+    if current_user.role in ('admin', 'teacher'):
+        return can_manage_course(material.course)
+    if current_user.role != 'student' or not current_user.student_profile or not material.is_public:
+        return False
+    return db.session.query(CourseEnrollment.query.filter_by(
+        student_id=current_user.student_profile.id,
+        course_id=material.course_id,
+        status='active'
+    ).exists()).scalar()
+
+@app.route('/materials/<int:material_id>/file')
+@login_required
+def material_file(material_id):
+    """授权下载资料，支持 Range（音视频拖动）、ETag 和 Last-Modified
+
+    配置 MATERIAL_SENDFILE 后只返回响应头，由前端服务器直接发送文件并处理 Range。
+    """
+    material = db.get_or_404(CourseMaterial, material_id)
+    if not can_access_material(material):
+        abort(403)
+    path = material_file_path(material)
+    if path is None:
+        abort(404)
+    
+    download_name = material.original_filename or material.title + os.path.splitext(path)[1]
+    # 按内容寻址的文件以哈希作为强ETag，其他文件使用修改时间和大小
+    etag = material.content_hash or True
+    offload = app.config['MATERIAL_SENDFILE']
+    if offload == 'x-accel' and material.file_path.startswith('/static/'):
+        # X-Accel 前缀对应资料存储目录，static下的旧文件由应用发送
+        offload = ''
+    if offload in ('x-sendfile', 'x-accel'):
+        response = send_file_offload(
+            path, request.environ,
+            as_attachment=request.args.get('download') == '1',
+            download_name=download_name,
+            conditional=False,
+            etag=etag,
+            use_x_sendfile=True,
+            response_class=app.response_class
         )
-        
-        db.session.add(record)
+        # 只在应用中处理ETag/Last-Modified的304，Range由前端服务器处理
+        response.make_conditional(request.environ)
+        sendfile_path = response.headers.pop('X-Sendfile')
+        if response.status_code != 304:
+            if offload == 'x-accel':
+                response.headers['X-Accel-Redirect'] = (
+                    app.config['MATERIAL_ACCEL_PREFIX'].rstrip('/') + '/' + quote(material.file_path)
+                )
+            else:
+                response.headers['X-Sendfile'] = sendfile_path
+    else:
+        # 通过 wsgi.file_wrapper 发送，gunicorn 等服务器会使用 sendfile()
+        response = send_file(
+            path,
+            as_attachment=request.args.get('download') == '1',
+            download_name=download_name,
+            conditional=True,
+            etag=etag,
+            max_age=None
+        )
+        response.accept_ranges = 'bytes'
+    
+    response.cache_control.private = True
+    if material.content_hash:
+        # 内容不变的文件允许浏览器缓存，其他文件每次重新验证
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = 86400
+    return response
+
+def read_material_form(values):
+    """校验上传资料的课程、标题和文件名，返回 (course, error)"""
+    course = db.session.get(Course, values.get('class_id', type=int) or 0)
+    if course is None:
+        return None, '课程不存在'
+    if not can_manage_course(course):
+        return None, '权限不足'
+    if not (values.get('title') or '').strip():
+        return None, '请填写资料标题'
+    if material_extension(values.get('filename')) is None:
+        return None, '不支持的文件类型'
+    return course, None
+
+@app.route('/api/materials/upload', methods=['POST'])
+@login_required
+def api_material_upload():
+    """一次性上传（multipart表单），大文件请使用 /api/materials/uploads 分片上传"""
+    if current_user.role not in ('teacher', 'admin'):
+        return jsonify({'error': '权限不足'}), 403
+    
+    file = request.files.get('file')
+    if file is None or not file.filename:
+        return jsonify({'error': '请选择文件'}), 400
+    values = request.form.copy()
+    values['filename'] = file.filename
+    course, error = read_material_form(values)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    try:
+        digest, path, size = material_store.save(file.stream, material_extension(file.filename))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    material = create_material(course.id, values['title'].strip(), values.get('description', ''),
+                               file.filename, digest, path, size)
+    return jsonify({'success': True, 'material': material_to_dict(material)}), 201
+
+@app.route('/api/materials/uploads', methods=['POST'])
+@login_required
+def api_material_upload_create():
+    """登记分片上传：{class_id, title, description, filename, size}"""
+    if current_user.role not in ('teacher', 'admin'):
+        return jsonify({'error': '权限不足'}), 403
+    
+    data = request.get_json(silent=True)
+    values = MultiDict(data if isinstance(data, dict) else {})
+    course, error = read_material_form(values)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    try:
+        upload_id = material_store.create(values.get('size', 0, type=int), {
+            'owner_id': current_user.id,
+            'course_id': course.id,
+            'title': values['title'].strip(),
+            'description': values.get('description', ''),
+            'filename': values['filename']
+        })
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'upload_id': upload_id,
+        'offset': 0,
+        'size': values.get('size', type=int),
+        'chunk_size': app.config['MATERIAL_CHUNK_SIZE'],
+        'upload_url': url_for('api_material_upload_chunk', upload_id=upload_id)
+    }), 201
+
+@app.route('/api/materials/uploads/<upload_id>', methods=['GET', 'PATCH', 'DELETE'])
+@login_required
+def api_material_upload_chunk(upload_id):
+    """GET 查询已接收的字节数；PATCH 追加分片（请求头 Upload-Offset）；DELETE 取消上传"""
+    try:
+        info = material_store.status(upload_id)
+    except UploadNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    metadata = info['metadata']
+    if metadata['owner_id'] != current_user.id:
+        return jsonify({'error': '上传不存在或已过期'}), 404
+    
+    if request.method == 'GET':
+        return jsonify({'offset': info['offset'], 'size': info['size']})
+    if request.method == 'DELETE':
+        material_store.discard(upload_id)
+        return jsonify({'success': True})
+    
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'error': '缺少 Upload-Offset 请求头'}), 400
+    try:
+        received = material_store.append(upload_id, offset, request.stream)
+        if received < info['size']:
+            return jsonify({'offset': received, 'size': info['size']})
+        # 上传可能持续很久，完成时重新检查课程是否存在、是否仍有权限
+        course = db.session.get(Course, metadata['course_id'])
+        if course is None or not can_manage_course(course):
+            material_store.discard(upload_id)
+            return jsonify({'error': '课程不存在或权限不足'}), 403
+        digest, path, size = material_store.finish(upload_id, material_extension(metadata['filename']))
+    except OffsetMismatch as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), 409
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    material = create_material(metadata['course_id'], metadata['title'], metadata['description'],
+                               metadata['filename'], digest, path, size)
+    return jsonify({
+        'success': True,
+        'offset': size,
+        'size': size,
+        'material': material_to_dict(material)
+    }), 201
+
+@app.route('/api/classes/<int:course_id>/students')
+@login_required
+def api_class_students(course_id):
+    if current_user.role not in ('teacher', 'admin'):
+        return jsonify({'error': '权限不足'}), 403
+    
+    course = db.session.get(Course, course_id)
+    if course is None:
+        return jsonify({'error': '课程不存在'}), 404
+    if not can_manage_course(course):
+        return jsonify({'error': '权限不足'}), 403
+    
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+    try:
+        students, next_cursor = get_class_roster_page(
+            course_id,
+            status=request.args.get('status') or None,
+            cursor=request.args.get('cursor') or None,
+            per_page=per_page
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'students': students, 'next_cursor': next_cursor})
+
+def read_user_form(data, user=None):
+    """校验新增/编辑用户的字段，返回 (字段, 错误信息)"""
+    fields = {}
+    for name in ('username', 'email', 'full_name', 'role', 'password'):
+        value = data.get(name)
+        if value is not None:
+            fields[name] = str(value).strip()
+    
+    if user is None:
+        for name, label in (('username', '用户名'), ('email', '邮箱'), ('role', '角色'), ('password', '密码')):
+            if not fields.get(name):
+                return None, f'{label}不能为空'
+    elif 'username' in fields and fields['username'] != user.username:
+        return None, '用户名不能修改'
+    
+    if 'role' in fields and fields['role'] not in USER_ROLES:
+        return None, '无效的角色'
+    if 'email' in fields:
+        if not fields['email']:
+            return None, '邮箱不能为空'
+        if email_taken(fields['email'], exclude=user):
+            return None, '邮箱已被注册'
+    if user is None and username_taken(fields['username']):
+        return None, '用户名已存在'
+    return fields, None
+
+def apply_user_profile(user, full_name=None):
+    """按角色创建学生/教师资料（已有则更新姓名）"""
+    profile_model = {'student': StudentProfile, 'teacher': TeacherProfile}.get(user.role)
+    if profile_model is None:
+        return
+    profile = user.student_profile if user.role == 'student' else user.teacher_profile
+    if profile is None:
+        profile = profile_model(full_name=full_name or user.username)
+        if user.role == 'student':
+            user.student_profile = profile
+        else:
+            user.teacher_profile = profile
+    elif full_name:
+        profile.full_name = full_name
+
+def get_user_dict(user_id):
+    row = user_list_query().filter(User.id == user_id).first()
+    return user_row_to_dict(row) if row else None
+
+@app.route('/api/users', methods=['GET', 'POST'])
+@login_required
+@query_limit(10)
+def api_users():
+    if current_user.role != 'admin':
+        return jsonify({'error': '权限不足'}), 403
+    
+    if request.method == 'GET':
+        per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+        try:
+            users, next_cursor = get_users_page(
+                role=request.args.get('role') or None,
+                status=request.args.get('status') or None,
+                q=(request.args.get('q') or '').strip() or None,
+                sort=request.args.get('sort') or '-created_at',
+                cursor=request.args.get('cursor') or None,
+                per_page=per_page
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'users': users, 'next_cursor': next_cursor})
+    
+    fields, error = read_user_form(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        user = User(
+            username=fields['username'],
+            email=fields['email'],
+            password_hash=generate_password_hash(fields['password']),
+            role=fields['role']
+        )
+        apply_user_profile(user, fields.get('full_name'))
+        db.session.add(user)
         db.session.commit()
     except Exception as e:
-        print(f"保存口语练习记录错误: {e}")
+        db.session.rollback()
+        print(f"创建用户错误: {e}")
+        return jsonify({'error': '创建用户失败'}), 500
+    return jsonify({'success': True, 'user': get_user_dict(user.id)}), 201
+
+@app.route('/api/users/<int:user_id>', methods=['GET', 'PUT', 'DELETE'])
+@login_required
+def api_user(user_id):
+    if current_user.role != 'admin':
+        return jsonify({'error': '权限不足'}), 403
+    
+    user = db.session.get(User, user_id)
+    if user is None:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    if request.method == 'GET':
+        return jsonify(get_user_dict(user_id))
+    
+    if request.method == 'DELETE':
+        if user.id == current_user.id:
+            return jsonify({'error': '不能删除当前登录的账户'}), 400
+        try:
+            db.session.delete(user)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"删除用户错误: {e}")
+            return jsonify({'error': '删除用户失败'}), 500
+        return jsonify({'success': True})
+    
+    fields, error = read_user_form(request.get_json(silent=True) or {}, user)
+    if error:
+        return jsonify({'error': error}), 400
+    if user.id == current_user.id and fields.get('role', user.role) != user.role:
+        return jsonify({'error': '不能修改当前登录账户的角色'}), 400
+    try:
+        if fields.get('email'):
+            user.email = fields['email']
+        if fields.get('role'):
+            user.role = fields['role']
+        if fields.get('password'):
+            user.password_hash = generate_password_hash(fields['password'])
+        apply_user_profile(user, fields.get('full_name'))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"更新用户错误: {e}")
+        return jsonify({'error': '更新用户失败'}), 500
+    return jsonify({'success': True, 'user': get_user_dict(user_id)})
+
+@app.route('/api/users/<int:user_id>/status', methods=['PUT'])
+@login_required
+def api_user_status(user_id):
+    if current_user.role != 'admin':
+        return jsonify({'error': '权限不足'}), 403
+    
+    user = db.session.get(User, user_id)
+    if user is None:
+        return jsonify({'error': '用户不存在'}), 404
+    status = (request.get_json(silent=True) or {}).get('status')
+    if status not in USER_STATUSES:
+        return jsonify({'error': '无效的状态'}), 400
+    if user.id == current_user.id and status != 'active':
+        return jsonify({'error': '不能禁用当前登录的账户'}), 400
+    
+    try:
+        user.status = status
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"更新用户状态错误: {e}")
+        return jsonify({'error': '更新用户状态失败'}), 500
+    return jsonify({'success': True, 'user': get_user_dict(user_id)})
+
+@app.route('/api/leave-requests', methods=['GET'])
+@login_required
+@query_limit(4)
+def api_leave_requests():
+    teacher_id = leave_reviewer_id()
+    if teacher_id is False:
+        return jsonify({'error': '权限不足'}), 403
+    
+    status = request.args.get('status') or None
+    if status is not None and status not in LEAVE_STATUSES:
+        return jsonify({'error': '无效的状态'}), 400
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+    try:
+        leave_requests, next_cursor = get_leave_queue_page(
+            teacher_id, status=status, cursor=request.args.get('cursor') or None, per_page=per_page
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    payload = {'leave_requests': leave_requests, 'next_cursor': next_cursor}
+    if request.args.get('counts'):
+        payload['counts'] = get_leave_status_counts(teacher_id)
+    return jsonify(payload)
+
+@app.route('/api/leave-requests', methods=['POST'])
+@login_required
+def api_create_leave_request():
+    if current_user.role != 'student':
+        return jsonify({'error': '权限不足'}), 403
+    if not current_user.student_profile:
+        return jsonify({'error': '学生资料不完整'}), 400
+    
+    data = request.get_json(silent=True) or request.form
+    reason = (data.get('reason') or '').strip()
+    if not reason:
+        return jsonify({'error': '请填写请假原因'}), 400
+    # 课表页面按课节（schedule_id）提交，也可以直接提交课程和日期
+    try:
+        if data.get('schedule_id'):
+            lesson = db.session.get(Lesson, int(data['schedule_id']))
+            if lesson is None:
+                return jsonify({'error': '课节不存在'}), 400
+            course_id, lesson_date = lesson.course_id, lesson.lesson_date.date()
+        else:
+            course_id = int(data.get('course_id'))
+            lesson_date = date.fromisoformat(data.get('lesson_date') or '')
+    except (TypeError, ValueError):
+        return jsonify({'error': '请选择要请假的课程'}), 400
+    
+    student_id = current_user.student_profile.id
+    if lesson_date < date.today():
+        return jsonify({'error': '不能为已经过去的课程请假'}), 400
+    if not CourseEnrollment.query.filter_by(student_id=student_id, course_id=course_id, status='active').first():
+        return jsonify({'error': '您没有在读这门课程'}), 400
+    if LeaveRequest.query.filter(
+        LeaveRequest.student_id == student_id,
+        LeaveRequest.course_id == course_id,
+        LeaveRequest.lesson_date == lesson_date,
+        LeaveRequest.status.in_(('pending', 'approved'))
+    ).first():
+        return jsonify({'error': '已经提交过这节课的请假申请'}), 400
+    
+    try:
+        leave_request = LeaveRequest(student_id=student_id, course_id=course_id,
+                                     lesson_date=lesson_date, reason=reason)
+        db.session.add(leave_request)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"请假申请错误: {e}")
+        return jsonify({'error': '提交失败，请重试'}), 500
+    return jsonify({'success': True, 'leave_request': leave_request_to_dict(leave_request)}), 201
+
+def leave_reviewer_id():
+    """审批人可处理的课程范围：教师为自己的ID，管理员为None（不限）；无权限时返回False"""
+    if current_user.role == 'admin':
+        return None
+    if current_user.role == 'teacher' and current_user.teacher_profile:
+        return current_user.teacher_profile.id
+    return False
+
+def review_leave_requests(request_ids, action, comment):
+    """审批并提交，返回 (修改的ID, None)，失败时返回 (None, 错误响应)"""
+    teacher_id = leave_reviewer_id()
+    if teacher_id is False:
+        return None, (jsonify({'error': '权限不足'}), 403)
+    if action == 'reject' and not comment:
+        return None, (jsonify({'error': '请填写拒绝原因'}), 400)
+    
+    try:
+        updated_ids = process_leave_requests(request_ids, action, teacher_id=teacher_id, comment=comment)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"审批请假错误: {e}")
+        return None, (jsonify({'error': '操作失败，请重试'}), 500)
+    return updated_ids, None
+
+@app.route('/api/leave-requests/<int:request_id>/<any(approve, reject):action>', methods=['POST'])
+@login_required
+def api_review_leave_request(request_id, action):
+    data = request.get_json(silent=True) or {}
+    comment = (data.get('comment') or data.get('reason') or '').strip() or None
+    updated_ids, error = review_leave_requests([request_id], action, comment)
+    if error:
+        return error
+    if not updated_ids:
+        return jsonify({'error': '申请不存在或已处理'}), 409
+    return jsonify({'success': True, 'status': LEAVE_ACTIONS[action], 'updated_ids': updated_ids})
+
+@app.route('/api/leave-requests/bulk', methods=['POST'])
+@login_required
+def api_bulk_review_leave_requests():
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if action not in LEAVE_ACTIONS:
+        return jsonify({'error': '无效的操作'}), 400
+    try:
+        request_ids = sorted({int(request_id) for request_id in data.get('ids') or []})
+    except (TypeError, ValueError):
+        return jsonify({'error': '无效的申请ID'}), 400
+    if not request_ids:
+        return jsonify({'error': '请选择要处理的申请'}), 400
+    if len(request_ids) > MAX_BULK_LEAVE_REQUESTS:
+        return jsonify({'error': f'一次最多处理 {MAX_BULK_LEAVE_REQUESTS} 条申请'}), 400
     
+    updated_ids, error = review_leave_requests(request_ids, action, (data.get('comment') or '').strip() or None)
+    if error:
+        return error
+    # 已处理、不存在或不属于自己课程的申请不会被修改
     return jsonify({
         'success': True,
-        'score': score,
-        'pronunciation_score': pronunciation_score,
-        'fluency_score': fluency_score,
-        'feedback': feedback
+        'status': LEAVE_ACTIONS[action],
+        'updated_ids': updated_ids,
+        'skipped_ids': sorted(set(request_ids) - set(updated_ids))
+    })
+
+@app.route('/api/admin/imports', methods=['POST'])
+@login_required
+def api_create_import():
+    if current_user.role != 'admin':
+        return jsonify({'error': '权限不足'}), 403
+    
+    file = request.files.get('file')
+    if file is None or not file.filename:
+        return jsonify({'error': '请选择要导入的文件'}), 400
+    extension = os.path.splitext(file.filename)[1].lower()
+    if extension not in ('.csv', '.xlsx'):
+        return jsonify({'error': '只支持 CSV 和 XLSX 文件'}), 400
+    course_id = request.form.get('course_id', type=int)
+    if course_id is not None and db.session.get(Course, course_id) is None:
+        return jsonify({'error': '课程不存在'}), 400
+    
+    # 先保存为临时文件，解析和写入都在后台线程中进行
+    fd, path = tempfile.mkstemp(suffix=extension)
+    with os.fdopen(fd, 'wb') as f:
+        shutil.copyfileobj(file.stream, f)
+    try:
+        job = student_importer.submit(current_user.id, path, file.filename, course_id)
+    except ImportQueueFull:
+        remove_file(path)
+        return jsonify({'error': '导入任务较多，请稍后再试'}), 503
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('api_import_status', job_id=job.id)
+    }), 202
+
+@app.route('/api/admin/imports/<job_id>')
+@login_required
+def api_import_status(job_id):
+    job = student_importer.get(job_id)
+    if job is None or job.owner_id != current_user.id:
+        return jsonify({'error': '导入任务不存在或已过期'}), 404
+    data = job.to_dict()
+    # 生成的密码只返回一次
+    data['credentials'] = student_importer.take_credentials(job)
+    return jsonify(data)
+
+def search_scopes():
+    """当前用户可以搜索到资料的课程：(可见公开资料的课程, 可见非公开资料的课程)
+
+    与 can_access_material 一致：管理员和任课老师可见全部资料，在读学生只可见公开资料。
+    """
+    if not current_user.is_authenticated:
+        return None, None
+    if current_user.role == 'admin':
+        return search.ALL_SCOPES, search.ALL_SCOPES
+    if current_user.role == 'teacher' and current_user.teacher_profile:
+        course_ids = [course_id for (course_id,) in db.session.query(Course.id).filter_by(
+            teacher_id=current_user.teacher_profile.id)]
+        return course_ids, course_ids
+    if current_user.role == 'student' and current_user.student_profile:
+        return [course_id for (course_id,) in db.session.query(CourseEnrollment.course_id).filter_by(
+            student_id=current_user.student_profile.id, status='active')], None
+    return None, None
+
+def search_fallback(query, limit):
+    """非SQLite数据库：按标题模糊匹配（不含资料）"""
+    pattern = contains_pattern(query)
+    results = []
+    for model, kind, column in ((Course, 'course', Course.name),
+                                (StudyAbroadCase, 'case', StudyAbroadCase.target_university),
+                                (CampProgram, 'camp', CampProgram.name)):
+        for obj in model.query.filter(column.ilike(pattern, escape='\\')).limit(limit):
+            values = {attr.key: getattr(obj, attr.key) for attr in db.inspect(model).column_attrs}
+            document = search.document(kind, values)
+            if document is not None:
+                results.append({'kind': kind, 'ref_id': obj.id, 'title': document['title'], 'summary': document['summary']})
+    return results[:limit]
+
+def search_result_url(kind, ref_id):
+    if kind == 'material':
+        return url_for('material_file', material_id=ref_id)
+    if kind == 'case':
+        return url_for('study_abroad_cases') + f'#case-{ref_id}'
+    if kind == 'camp':
+        return url_for('camp') + f'#camp-{ref_id}'
+    return url_for('chinese_courses') + f'#course-{ref_id}'
+
+@app.route('/api/search')
+def api_search():
+    """全站搜索，返回按相关度排序的课程、资料、留学案例和研学项目"""
+    query = request.args.get('q', '').strip()[:100]
+    limit = max(1, min(request.args.get('limit', 10, type=int), 20))
+    if not query:
+        return jsonify([])
+    
+    connection = db.session.connection()
+    if search_index_ready(connection):
+        scopes, private_scopes = search_scopes()
+        results = search.search(connection, query, scopes=scopes, private_scopes=private_scopes, limit=limit)
+    else:
+        results = search_fallback(query, limit)
+    
+    labels = {'course': '课程', 'material': '资料', 'case': '留学案例', 'camp': '研学旅行'}
+    return jsonify([{
+        'type': result['kind'],
+        'type_label': labels[result['kind']],
+        'title': result['title'],
+        'description': result['summary'],
+        'url': search_result_url(result['kind'], result['ref_id'])
+    } for result in results])
+
+@app.route('/api/profile/avatar', methods=['POST'])
+@login_required
+def api_profile_avatar():
+    """上传头像，多尺寸版本在后台生成"""
+    file = request.files.get('avatar')
+    if file is None or not file.filename:
+        return jsonify({'error': '请选择图片'}), 400
+    
+    try:
+        avatar_url = image_pipeline.save(file.stream)
+    except ImageError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    current_user.avatar = avatar_url
+    db.session.commit()
+    return jsonify({'success': True, 'avatar': avatar_url})
+
+@app.route('/api/schedule')
+@login_required
+def api_schedule():
+    if current_user.role != 'student':
+        return jsonify({'error': '权限不足'}), 403
+    
+    if not current_user.student_profile:
+        return jsonify({'error': '学生资料不完整'}), 400
+    
+    today = datetime.combine(date.today(), datetime.min.time())
+    try:
+        start = parse_date_arg(request.args.get('from'), today - timedelta(days=today.weekday()))
+        end = parse_date_arg(request.args.get('to'), start + timedelta(days=7))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if end <= start or end - start > timedelta(days=366):
+        return jsonify({'error': '时间范围无效'}), 400
+    
+    student_id = current_user.student_profile.id
+    lessons = get_student_schedule(student_id, start, end)
+    return json_response_with_etag({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'lessons': [lesson_to_event(lesson) for lesson in lessons],
+        'stats': get_schedule_stats(student_id, start, end)
     })
 
+@app.route('/calendar/<token>.ics')
+def schedule_feed(token):
+    """课程表iCalendar订阅，凭令牌访问，支持条件GET"""
+    user = User.query.filter_by(feed_token=token).first()
+    if user is None or not user.is_active or not user.student_profile:
+        return 'Not Found', 404
+    profile = user.student_profile
+    
+    now = datetime.now()
+    lessons = get_student_schedule(profile.id, now - timedelta(days=30), now + timedelta(days=180))
+    response = app.response_class(render_schedule_ics(lessons), mimetype='text/calendar')
+    response.set_etag(hashlib.md5(response.get_data()).hexdigest())
+    response.headers['Cache-Control'] = 'private, max-age=900'
+    return response.make_conditional(request)
+
+@app.route('/api/calendar/token', methods=['GET', 'POST'])
+@login_required
+def api_feed_token():
+    """日历订阅链接；POST 重置令牌，旧链接立即失效"""
+    if current_user.role != 'student':
+        return jsonify({'error': '权限不足'}), 403
+    
+    token = schedule_feed_token(current_user.id, rotate=request.method == 'POST')
+    return jsonify({'feed_url': url_for('schedule_feed', token=token, _external=True)})
+
 # 错误处理
 @app.errorhandler(404)
 def not_found_error(error):
@@ -880,12 +2847,188 @@ def internal_error(error):
     db.session.rollback()
     return render_template('errors/500.html'), 500
 
+# 查询计划检查
+def hot_queries():
+    """热点路由使用的查询，用于检查是否走索引"""
+    now = datetime.now()
+    return {
+        'student_dashboard.enrollments': CourseEnrollment.query.filter_by(student_id=1, status='active'),
+        'student_dashboard.lessons': Lesson.query.filter(
+            Lesson.course_id.in_([1, 2]), Lesson.lesson_date >= now, Lesson.status == 'scheduled'
+        ).order_by(Lesson.lesson_date),
+        'student_dashboard.pending_requests': LeaveRequest.query.filter_by(student_id=1, status='pending'),
+        'student_materials': student_materials_query(1).order_by(CourseMaterial.upload_date.desc()),
+        'student_schedule': enrolled_lessons_query(1).filter(
+            Lesson.lesson_date >= now, Lesson.lesson_date < now + timedelta(days=7)
+        ),
+        'student_speech_practice': SpeechPracticeRecord.query.filter_by(student_id=1).order_by(
+            SpeechPracticeRecord.practice_date.desc()
+        ),
+        'teacher_dashboard.courses': Course.query.filter_by(teacher_id=1, status='active'),
+        'teacher_classes.roster': CourseEnrollment.query.filter_by(course_id=1, status='active'),
+        'teacher_leave_approval': LeaveRequest.query.filter_by(course_id=1, status='pending'),
+        'teacher_leave_approval.queue': leave_queue_query(1).filter(LeaveRequest.status == 'pending').limit(50),
+        'admin_users.by_role': user_list_query().filter(User.role == 'student').order_by(
+            User.created_at.desc(), User.id.desc()
+        ).limit(50),
+        'student_import.usernames': db.session.query(User.username).filter(
+            db.func.lower(User.username).in_(['student_a', 'student_b'])
+        ),
+        'student_import.emails': db.session.query(User.email).filter(User.email.in_(['a@example.com', 'b@example.com'])),
+    }
+
+def find_full_scans():
+    """对热点查询执行EXPLAIN QUERY PLAN（仅SQLite），返回 {查询名: 全表扫描的计划行}"""
+    if db.engine.dialect.name != 'sqlite':
+        return {}
+    
+    table_names = set(db.metadata.tables)
+    scans = {}
+    for name, query in hot_queries().items():
+        compiled = query.statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True}
+        )
+        params = tuple(compiled.params[key] for key in compiled.positiontup)
+        plan = db.session.connection().exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + str(compiled), params
+        ).all()
+        details = [row[-1] for row in plan]
+        bad = [detail for detail in details
+               if detail.startswith('SCAN ') and detail.split()[1] in table_names]
+        if bad:
+            scans[name] = bad
+    return scans
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """检查热点查询是否出现全表扫描，有则以非零状态退出"""
+    scans = find_full_scans()
+    for name, details in scans.items():
+        print(f"{name}: {'; '.join(details)}")
+    if scans:
+        raise SystemExit(1)
+    print("热点查询均使用索引")
+
+@app.cli.command('gc-materials')
+@click.option('--dry-run', is_flag=True, help='只统计，不删除')
+@click.option('--grace', default=3600, show_default=True, help='只删除修改时间早于此秒数之前的文件')
+def gc_materials_command(dry_run, grace):
+    """删除没有资料记录引用的上传文件和过期的未完成上传"""
+    referenced = {digest for (digest,) in db.session.query(CourseMaterial.content_hash).filter(
+        CourseMaterial.content_hash.isnot(None)
+    ).distinct()}
+    result = material_store.collect_garbage(referenced, grace=grace, dry_run=dry_run)
+    action = '可删除' if dry_run else '已删除'
+    print(f"{action} {result['blobs_removed']} 个文件（{result['bytes_freed']} 字节），"
+          f"{result['uploads_expired']} 个过期上传")
+
+@app.cli.command('move-material-files')
+def move_material_files_command():
+    """把保存在 static/uploads/materials 下的旧资料文件移入资料存储目录"""
+    prefix = '/static/uploads/materials/'
+    moved, skipped, stored = 0, 0, {}
+    for material in CourseMaterial.query.filter(CourseMaterial.file_path.startswith(prefix)).all():
+        old_path = material_file_path(material)
+        if old_path is not None and old_path not in stored:
+            try:
+                with open(old_path, 'rb') as f:
+                    digest, path, size = material_store.save(f, os.path.splitext(old_path)[1].lower())
+            except UploadError as e:
+                print(f"{material.file_path}: {e}")
+                old_path = None
+            else:
+                stored[old_path] = (digest, material_store.blob_name(path), size)
+        if old_path is None:
+            skipped += 1
+            continue
+        digest, name, size = stored[old_path]
+        material.file_path = name
+        material.content_hash = digest
+        material.file_size = size
+        moved += 1
+    db.session.commit()
+    # 数据库更新后再删除旧文件
+    for old_path in stored:
+        remove_file(old_path)
+    print(f"已移动 {moved} 条资料的文件，{skipped} 条资料的文件不存在或为空")
+
+@app.cli.command('build-image-variants')
+def build_image_variants_command():
+    """为头像、留学案例和夏令营图片生成多尺寸版本，static下的旧图片先导入图片存储"""
+    columns = [(User, 'avatar'), (StudyAbroadCase, 'student_photo'), (CampProgram, 'featured_image')]
+    futures = []
+    imported = 0
+    for model, column in columns:
+        for obj in model.query.filter(getattr(model, column).isnot(None)):
+            url = getattr(obj, column)
+            parsed = image_pipeline.parse_url(url)
+            if parsed is not None:
+                futures.append(image_pipeline.submit(*parsed))
+                continue
+            path = safe_join(app.static_folder, url[len('/static/'):]) if url.startswith('/static/') else None
+            if path is None or not os.path.isfile(path):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    setattr(obj, column, image_pipeline.save(f))
+            except ImageError as e:
+                print(f"{url}: {e}")
+                continue
+            imported += 1
+            futures.append(image_pipeline.submit(*image_pipeline.parse_url(getattr(obj, column))))
+    db.session.commit()
+    
+    failed = 0
+    for future in futures:
+        if future is not None and future.exception() is not None:
+            failed += 1
+    print(f"导入 {imported} 张图片，生成 {sum(1 for future in futures if future is not None) - failed} 组版本，失败 {failed} 组")
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """根据数据表重建全文搜索索引"""
+    with db.engine.begin() as connection:
+        if not search.supported(connection):
+            print("全文搜索索引仅支持SQLite，其他数据库使用标题模糊匹配")
+            return
+        count = search.rebuild(connection, db.metadata)
+    print(f"已索引 {count} 条记录")
+
+@app.cli.command('reconcile-stats')
+def reconcile_stats_command():
+    """根据数据表重新计算统计数据，并列出与增量维护结果不一致的项"""
+    with db.engine.begin() as connection:
+        drift = stats.reconcile(connection, db.metadata)
+    for name, (previous, actual) in sorted(drift.items()):
+        print(f"{name}: {previous} -> {actual}")
+    print(f"统计数据已重新计算，{len(drift)} 项不一致" if drift else "统计数据已重新计算，与增量结果一致")
+
+@app.cli.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--course-id', type=int, help='导入的学生加入此课程（文件中的课程编号列优先）')
+def import_students_command(path, course_id):
+    """从 CSV/XLSX 文件批量导入学生"""
+    job = ImportJob(None, path, path, course_id)
+    job.started_at = time.time()
+    try:
+        student_importer.run_import(job)
+    except ImportFileError as e:
+        raise click.ClickException(str(e))
+    job.finished_at = time.time()
+    for error in job.errors:
+        print(f"第 {error['line']} 行 {error['username'] or ''}: {error['error']}")
+    for credential in job.credentials:
+        print(f"生成密码 {credential['username']}: {credential['password']}")
+    print(f"共 {job.rows} 行，导入 {job.created} 名学生，选课 {job.enrolled} 条，"
+          f"{job.error_count} 行失败，耗时 {job.to_dict()['elapsed_ms']} 毫秒")
+
 # 数据库初始化
 def init_db():
     """初始化数据库"""
     with app.app_context():
         try:
             db.create_all()
+            run_migrations(db.engine, db.metadata)
             print("数据库表创建成功！")
             
             # 创建管理员账户
@@ -0,0 +1,337 @@
+# 启梦教育平台缓存
+"""
+缓存
+
+TTLCache 是带过期时间的进程内LRU缓存，线程安全，并记录命中/未命中次数。
+ResponseCache 缓存整页响应（带ETag），后端可选内存或文件系统；
+缓存键带有共享目录中的版本号，clear() 递增版本号，使用内存后端的
+多个工作进程也会同时失效。
+DataCache 缓存查询结果（分离的轻量记录，不是ORM对象），缓存键带有
+按命名空间（表名）记录的版本号，版本号保存在共享目录的文件中，
+数据变更时递增版本号，所有进程随即读到新版本。
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from types import SimpleNamespace
+
+from flask import make_response, request, session
+from sqlalchemy import inspect
+
+_MISSING = object()
+
+
+class TTLCache:
+    """带过期时间的LRU缓存"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                expires_at, value = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0
+            }
+
+
+class MemoryBackend:
+    """进程内缓存后端"""
+
+    def __init__(self, maxsize=512):
+        self._cache = TTLCache(maxsize=maxsize)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl):
+        self._cache.set(key, value, ttl)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class FileSystemBackend:
+    """文件系统缓存后端，每个键一个文件，写入采用临时文件+原子替换"""
+
+    suffix = '.cache'
+
+    def __init__(self, directory, threshold=2000):
+        self.directory = directory
+        self.threshold = threshold
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + self.suffix)
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith(self.suffix)]
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires_at <= time.time():
+            self._remove(path)
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        self._prune()
+        data = pickle.dumps((time.time() + ttl, value), pickle.HIGHEST_PROTOCOL)
+        try:
+            atomic_write(self._path(key), data)
+        except OSError:
+            pass
+
+    def clear(self):
+        for entry in self._entries():
+            self._remove(entry.path)
+
+    def _prune(self):
+        """文件数超过阈值时按修改时间删除较旧的一半"""
+        entries = self._entries()
+        if len(entries) < self.threshold:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) // 2]:
+            self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def make_backend(kind, directory):
+    """按配置创建缓存后端：memory / filesystem，其他值表示不缓存"""
+    if kind == 'filesystem':
+        return FileSystemBackend(directory)
+    if kind == 'memory':
+        return MemoryBackend()
+    return None
+
+
+def atomic_write(path, data):
+    """写入临时文件后原子替换，读者不会看到写了一半的内容"""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        FileSystemBackend._remove(tmp_path)
+        raise
+
+
+class ResponseCache:
+    """整页响应缓存
+
+    只缓存GET请求的200响应；会话中有待显示的flash消息时不读写缓存。
+    命中时直接返回缓存内容，客户端带If-None-Match且未变化时返回304。
+    """
+
+    namespace = 'pages'
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.versions = None
+        self.ttl = 300
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PAGE_CACHE_BACKEND', 'memory')
+        app.config.setdefault('PAGE_CACHE_TTL', 300)
+        app.config.setdefault('PAGE_CACHE_DIR', os.path.join(app.instance_path, 'page_cache'))
+        self.ttl = int(app.config['PAGE_CACHE_TTL'])
+        self.backend = make_backend(app.config['PAGE_CACHE_BACKEND'], app.config['PAGE_CACHE_DIR'])
+        if self.backend is not None:
+            self.versions = VersionStore(os.path.join(app.config['PAGE_CACHE_DIR'], 'versions'))
+
+    def clear(self):
+        """所有进程的缓存失效（递增共享版本号），并释放本进程的缓存"""
+        if self.backend is not None:
+            self.versions.bump(self.namespace)
+            self.backend.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0
+        }
+
+    def cached(self, key_func):
+        """视图装饰器，key_func() 返回缓存键"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or request.method != 'GET' or session.get('_flashes'):
+                    return view(*args, **kwargs)
+
+                key = f'{self.versions.get(self.namespace)}:{key_func()}'
+                entry = self.backend.get(key)
+                if entry is None:
+                    self.misses += 1
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.direct_passthrough:
+                        return response
+                    body = response.get_data()
+                    entry = {
+                        'body': body,
+                        'mimetype': response.mimetype,
+                        'etag': hashlib.md5(body).hexdigest()
+                    }
+                    self.backend.set(key, entry, self.ttl)
+                else:
+                    self.hits += 1
+                    response = make_response(entry['body'])
+                    response.mimetype = entry['mimetype']
+
+                response.set_etag(entry['etag'])
+                response.headers['Cache-Control'] = 'private, no-cache'
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+
+def to_record(obj, **extra):
+    """把ORM对象转换为只含列值的轻量记录，可安全地跨请求、跨进程缓存"""
+    values = {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+    values.update(extra)
+    return SimpleNamespace(**values)
+
+
+class VersionStore:
+    """命名空间版本号，每个命名空间一个文件，多进程共享"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, namespace):
+        return os.path.join(self.directory, namespace + '.version')
+
+    def get(self, namespace):
+        try:
+            with open(self._path(namespace), 'r') as f:
+                return f.read() or '0'
+        except OSError:
+            return '0'
+
+    def bump(self, namespace):
+        atomic_write(self._path(namespace), uuid.uuid4().hex.encode('ascii'))
+
+
+class DataCache:
+    """查询结果缓存
+
+    用 memoize(命名空间...) 装饰加载函数，加载函数应返回 to_record() 生成的记录。
+    缓存键包含各命名空间的当前版本号，bump(命名空间) 后旧缓存不会再被命中。
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.versions = None
+        self.ttl = 3600
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DATA_CACHE_BACKEND', 'memory')
+        app.config.setdefault('DATA_CACHE_TTL', 3600)
+        app.config.setdefault('DATA_CACHE_DIR', os.path.join(app.instance_path, 'data_cache'))
+        self.ttl = int(app.config['DATA_CACHE_TTL'])
+        self.backend = make_backend(app.config['DATA_CACHE_BACKEND'], app.config['DATA_CACHE_DIR'])
+        self.versions = VersionStore(os.path.join(app.config['DATA_CACHE_DIR'], 'versions'))
+
+    def bump(self, namespace):
+        if self.versions is not None:
+            self.versions.bump(namespace)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0
+        }
+
+    def memoize(self, *namespaces, ttl=None):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if self.backend is None:
+                    return func(*args, **kwargs)
+
+                versions = ','.join(self.versions.get(namespace) for namespace in namespaces)
+                key = f"data:{func.__module__}.{func.__qualname__}:{args!r}:{sorted(kwargs.items())!r}|{versions}"
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry[0]
+
+                self.misses += 1
+                value = func(*args, **kwargs)
+                self.backend.set(key, (value,), self.ttl if ttl is None else ttl)
+                return value
+            return wrapper
+        return decorator
@@ -0,0 +1,213 @@
+# 启梦教育平台图片处理
+"""
+图片多尺寸处理
+
+上传的原图按内容哈希保存为 <目录>/<哈希前两位>/<哈希>/original<扩展名>，
+由后台进程池生成 thumb、card、hero 三种宽度的 WebP 和 JPEG 版本，
+全部生成后写入 variants.json。相同内容的图片只处理一次。
+
+模板通过 variants() 读取已生成的版本拼出 srcset；版本还没生成完时只使用原图。
+生成函数 build_variants() 在子进程中执行，只依赖 Pillow，不导入应用。
+应用进程中有多个线程，子进程用 spawn 方式启动（不 fork 正在运行的线程持有的锁）。
+超过 MAX_PIXELS 像素的图片直接拒绝。
+"""
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+# 版本名称 -> 最大宽度（保持宽高比，不放大）
+VARIANTS = {
+    'thumb': 160,
+    'card': 480,
+    'hero': 1280,
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+ALLOWED_FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif'}
+MANIFEST = 'variants.json'
+MAX_PIXELS = 40 * 1000 * 1000
+MANIFEST_CACHE_SIZE = 4096
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ImageError(Exception):
+    """图片无法识别或不支持，异常信息可以直接返回给客户端"""
+
+
+def _atomic_save(directory, filename, write):
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temp_path, os.path.join(directory, filename))
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def check_size(image):
+    """Pillow 在 MAX_IMAGE_PIXELS 的1到2倍之间只发出警告，这里超过即拒绝"""
+    if image.width * image.height > MAX_PIXELS:
+        raise ImageError('图片尺寸过大')
+
+
+def build_variants(source, directory):
+    """生成全部版本并写入 variants.json，返回清单 {版本: {'width', 'height'}}"""
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    with Image.open(source) as original:
+        check_size(original)
+        image = ImageOps.exif_transpose(original)
+        image.load()
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    flattened = image
+    if has_alpha:
+        # JPEG不支持透明，铺白色背景
+        flattened = Image.new('RGB', image.size, (255, 255, 255))
+        flattened.paste(image, mask=image.getchannel('A'))
+
+    manifest = {}
+    for name, max_width in VARIANTS.items():
+        width = min(max_width, image.width)
+        height = max(1, round(image.height * width / image.width))
+        for extension, options in FORMATS.items():
+            source_image = image if extension == 'webp' else flattened
+            resized = source_image.resize((width, height), Image.LANCZOS) if width != image.width else source_image
+            _atomic_save(directory, f'{name}.{extension}', lambda f: resized.save(f, **options))
+        manifest[name] = {'width': width, 'height': height}
+
+    data = json.dumps(manifest).encode('utf-8')
+    _atomic_save(directory, MANIFEST, lambda f: f.write(data))
+    return manifest
+
+
+class ImagePipeline:
+    """原图存储 + 后台进程池生成多尺寸版本"""
+
+    def __init__(self, root, url_prefix, workers=2):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+        self.workers = workers
+        self._executor = None
+        self._pending = {}
+        self._manifests = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _directory(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _pool(self):
+        # 首次使用时才创建进程池，避免在导入模块或调试重载的父进程中启动
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def save(self, stream):
+        """校验并保存原图，提交后台生成版本，返回原图地址"""
+        data = stream.read()
+        try:
+            Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+            with Image.open(io.BytesIO(data)) as image:
+                image_format = image.format
+                check_size(image)
+                image.verify()
+        except (OSError, SyntaxError):
+            raise ImageError('无法识别的图片')
+        except Image.DecompressionBombError:
+            raise ImageError('图片尺寸过大')
+        if image_format not in ALLOWED_FORMATS:
+            raise ImageError('只支持 JPEG、PNG、WebP、GIF 图片')
+
+        digest = hashlib.sha256(data).hexdigest()
+        directory = self._directory(digest)
+        filename = 'original' + ALLOWED_FORMATS[image_format]
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(os.path.join(directory, filename)):
+            _atomic_save(directory, filename, lambda f: f.write(data))
+        self.submit(digest, filename)
+        return f'{self.url_prefix}/{digest[:2]}/{digest}/{filename}'
+
+    def submit(self, digest, filename):
+        """提交生成任务，已生成或正在生成时不重复提交"""
+        directory = self._directory(digest)
+        if os.path.exists(os.path.join(directory, MANIFEST)):
+            return None
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is not None:
+                return future
+        future = self._pool().submit(build_variants, os.path.join(directory, filename), directory)
+        with self._lock:
+            self._pending[digest] = future
+        future.add_done_callback(lambda done: self._finished(digest, done))
+        return future
+
+    def _finished(self, digest, future):
+        with self._lock:
+            self._pending.pop(digest, None)
+        if future.exception() is not None:
+            print(f"图片处理失败 {digest}: {future.exception()}")
+
+    def parse_url(self, url):
+        """原图地址 -> (哈希, 文件名)，不是本流水线的图片返回None"""
+        prefix = self.url_prefix + '/'
+        if not url or not url.startswith(prefix):
+            return None
+        parts = url[len(prefix):].split('/')
+        if (len(parts) != 3 or not DIGEST_PATTERN.match(parts[1]) or parts[0] != parts[1][:2]
+                or parts[2] not in ('original' + extension for extension in ALLOWED_FORMATS.values())):
+            return None
+        return parts[1], parts[2]
+
+    def variants(self, url):
+        """已生成的版本 {版本: {'width', 'height', 'webp', 'jpg'}}，未生成完时返回空字典"""
+        parsed = self.parse_url(url)
+        if parsed is None:
+            return {}
+        digest = parsed[0]
+        with self._lock:
+            manifest = self._manifests.get(digest)
+            if manifest is not None:
+                self._manifests.move_to_end(digest)
+        if manifest is None:
+            try:
+                with open(os.path.join(self._directory(digest), MANIFEST), 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                return {}
+            # 按内容寻址，生成后不会再变化；最多缓存 MANIFEST_CACHE_SIZE 个，超出时淘汰最久未用的
+            with self._lock:
+                self._manifests[digest] = manifest
+                while len(self._manifests) > MANIFEST_CACHE_SIZE:
+                    self._manifests.popitem(last=False)
+        base = f'{self.url_prefix}/{digest[:2]}/{digest}'
+        return {
+            name: dict(info, **{extension: f'{base}/{name}.{extension}' for extension in FORMATS})
+            for name, info in manifest.items()
+        }
+
+    def srcset(self, url, extension):
+        """按宽度去重后的 srcset 字符串"""
+        entries = {}
+        for info in self.variants(url).values():
+            entries.setdefault(info['width'], info[extension])
+        return ', '.join(f'{src} {width}w' for width, src in sorted(entries.items()))
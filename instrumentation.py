@@ -0,0 +1,156 @@
+# 启梦教育平台请求计时
+"""
+请求级SQL统计
+
+通过SQLAlchemy的 before/after_cursor_execute 事件统计每个请求执行的
+查询数和数据库耗时，请求结束时：
+- 在响应中加入 Server-Timing 头（db、app 两项，浏览器开发者工具可直接查看），
+  默认只在调试模式或 allow_timing() 返回True（如管理员）时加入，SERVER_TIMING 为True时对所有请求加入；
+- 同一条SQL（参数不同）在一个请求中执行次数达到 N_PLUS_ONE_THRESHOLD 时
+  记录疑似N+1的警告，通常是循环中访问了延迟加载的关联；
+- 超过 SLOW_QUERY_MS 的查询和超过 SLOW_REQUEST_MS 的请求记录警告，带路由名。
+
+视图可以用 query_limit(n) 声明查询数上限：超出时默认记录警告，
+测试模式（app.testing 或 QUERY_LIMIT_ENFORCE）下抛出 QueryLimitExceeded，
+测试客户端请求该页面即可断言查询数。只统计传入的引擎上、处理请求的线程中执行的查询。
+"""
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+
+class QueryLimitExceeded(AssertionError):
+    """请求的查询数超过视图声明的上限（测试模式）"""
+
+
+def query_limit(max_queries):
+    """视图装饰器：声明一次请求最多执行的查询数（放在 login_required 等装饰器下面）"""
+    def decorator(view):
+        view.max_queries = max_queries
+        return view
+    return decorator
+
+
+def shorten(statement, length=300):
+    """日志中的SQL压缩为一行并截断"""
+    statement = ' '.join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + '...'
+
+
+class RequestTimings:
+    """一个请求的查询统计"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, elapsed):
+        self.queries += 1
+        self.db_time += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        """执行次数达到 threshold 的语句 [(SQL, 次数)]，次数多的在前"""
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class QueryInstrumentation:
+    """按请求统计SQL查询，输出 Server-Timing 并记录慢请求、慢查询和疑似N+1"""
+
+    def __init__(self, app=None, engine=None, allow_timing=None):
+        self.app = None
+        self.enabled = False
+        self.allow_timing = allow_timing
+        if app is not None:
+            self.init_app(app, engine)
+
+    def init_app(self, app, engine):
+        """engine 为要统计的引擎（Flask-SQLAlchemy 的 db.engine，需在应用上下文中获取）"""
+        app.config.setdefault('SQL_INSTRUMENTATION', True)
+        app.config.setdefault('SERVER_TIMING', False)
+        app.config.setdefault('SLOW_REQUEST_MS', 500)
+        app.config.setdefault('SLOW_QUERY_MS', 100)
+        app.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+        app.config.setdefault('QUERY_LIMIT_ENFORCE', app.testing)
+        self.app = app
+        self.enabled = bool(app.config['SQL_INSTRUMENTATION'])
+        if not self.enabled:
+            return
+
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def current(self):
+        """当前请求的统计，不在请求中或未启用时为None"""
+        if not has_request_context():
+            return None
+        return g.get('_request_timings')
+
+    def server_timing_allowed(self):
+        """是否在响应中加入 Server-Timing（包含查询数和耗时，不对所有访客公开）"""
+        if self.app.config['SERVER_TIMING'] or self.app.debug:
+            return True
+        return self.allow_timing is not None and bool(self.allow_timing())
+
+    def _before_request(self):
+        g._request_timings = RequestTimings()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        timings = self.current()
+        if timings is None:
+            return
+        timings.record(statement, elapsed)
+        if elapsed * 1000 >= self.app.config['SLOW_QUERY_MS']:
+            self.app.logger.warning(
+                '慢查询 [%s] %.1fms: %s', request.endpoint, elapsed * 1000, shorten(statement)
+            )
+
+    def _handle_error(self, context):
+        started = context.connection.info.get('query_started') if context.connection is not None else None
+        if started:
+            started.pop()
+
+    def _after_request(self, response):
+        timings = g.pop('_request_timings', None)
+        if timings is None:
+            return response
+        config = self.app.config
+        endpoint = request.endpoint
+        total_ms = timings.elapsed() * 1000
+        db_ms = timings.db_time * 1000
+
+        if self.server_timing_allowed():
+            response.headers.add('Server-Timing', f'db;dur={db_ms:.1f};desc="{timings.queries} queries"')
+            response.headers.add('Server-Timing', f'app;dur={total_ms:.1f}')
+
+        for statement, count in timings.repeated(config['N_PLUS_ONE_THRESHOLD']):
+            self.app.logger.warning('疑似N+1 [%s] 同一语句执行%d次: %s', endpoint, count, shorten(statement))
+
+        if total_ms >= config['SLOW_REQUEST_MS']:
+            self.app.logger.warning(
+                '慢请求 [%s] %s %s %.1fms，%d条查询 %.1fms',
+                endpoint, request.method, request.path, total_ms, timings.queries, db_ms
+            )
+
+        view = self.app.view_functions.get(endpoint)
+        limit = getattr(view, 'max_queries', None)
+        if limit is not None and timings.queries > limit:
+            message = f'[{endpoint}] 执行了{timings.queries}条查询，上限为{limit}'
+            if config['QUERY_LIMIT_ENFORCE']:
+                raise QueryLimitExceeded(message)
+            self.app.logger.warning(message)
+        return response
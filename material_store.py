@@ -0,0 +1,277 @@
+# 启梦教育平台教学资料存储
+"""
+教学资料文件存储（按内容寻址，支持断点续传）
+
+文件按 SHA-256 保存为 <目录>/<哈希前两位>/<哈希><扩展名>，内容相同的文件只保存一份，
+多条 CourseMaterial 记录可以引用同一个文件。记录中保存 blob_name() 返回的相对名称，
+用 resolve() 还原为路径。目录不应位于 static 下，文件只能经授权的下载路由发送。
+
+断点续传流程：create() 登记上传（总大小和元数据），客户端按顺序调用 append()
+追加分片，请求中断后用 status() 查询已接收的字节数再继续；收齐后 finish()
+计算出哈希并把文件移入存储目录。哈希在写入时增量计算，进程重启或请求落到
+其他工作进程时，会从已接收的部分文件重新计算。同一个上传的分片需要串行发送。
+
+collect_garbage() 删除没有被引用的文件和过期未完成的上传。
+"""
+import errno
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    """上传失败，异常信息可以直接返回给客户端"""
+
+
+class UploadNotFound(UploadError):
+    """上传不存在或已过期"""
+
+
+class OffsetMismatch(UploadError):
+    """分片起始位置与已接收的字节数不一致"""
+
+    def __init__(self, offset):
+        super().__init__(f'分片位置不一致，已接收 {offset} 字节')
+        self.offset = offset
+
+
+class UploadTooLarge(UploadError):
+    """超过登记的文件大小或允许的最大大小"""
+
+
+class MaterialStore:
+    """按内容寻址的资料存储"""
+
+    def __init__(self, blob_dir, upload_dir, max_size=500 * 1024 * 1024):
+        self.blob_dir = blob_dir
+        self.upload_dir = upload_dir
+        self.max_size = max_size
+        self._hashers = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(blob_dir, exist_ok=True)
+        os.makedirs(upload_dir, exist_ok=True)
+
+    # 存储文件
+
+    def blob_path(self, digest, extension=''):
+        return os.path.join(self.blob_dir, digest[:2], digest + extension)
+
+    def blob_name(self, path):
+        """文件在存储中的相对名称：<哈希前两位>/<哈希><扩展名>"""
+        return os.path.relpath(path, self.blob_dir).replace(os.sep, '/')
+
+    def resolve(self, name):
+        """blob_name() 返回的名称对应的文件路径，名称不合法时返回None"""
+        prefix, _, filename = (name or '').partition('/')
+        digest = filename.split('.', 1)[0]
+        if not DIGEST_PATTERN.match(digest) or prefix != digest[:2] or '/' in filename or os.sep in filename:
+            return None
+        return os.path.join(self.blob_dir, prefix, filename)
+
+    def find_blob(self, digest):
+        """已存储的同内容文件路径，不存在时返回None"""
+        directory = os.path.join(self.blob_dir, digest[:2])
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            return None
+        with entries:
+            for entry in entries:
+                if entry.name == digest or entry.name.startswith(digest + '.'):
+                    return entry.path
+        return None
+
+    def _commit(self, digest, source_path, extension):
+        """把已写完的临时文件移入存储目录，内容已存在时直接复用"""
+        existing = self.find_blob(digest)
+        if existing is not None:
+            _remove(source_path)
+            # 刷新修改时间，避免垃圾回收在新记录提交前删除被复用的文件
+            os.utime(existing)
+            return existing
+        target = self.blob_path(digest, extension)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(source_path, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # 上传目录与存储目录不在同一文件系统时，先复制到存储目录再原子替换
+            temp_target = f'{target}.{uuid.uuid4().hex}.tmp'
+            shutil.copyfile(source_path, temp_target)
+            os.replace(temp_target, target)
+            _remove(source_path)
+        return target
+
+    def save(self, stream, extension=''):
+        """一次性保存整个文件流，返回 (哈希, 文件路径, 大小)；空文件不保存，抛出 UploadError"""
+        temp_path = os.path.join(self.upload_dir, f'{uuid.uuid4().hex}.tmp')
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise UploadTooLarge('文件超过允许的大小')
+                    f.write(chunk)
+                    hasher.update(chunk)
+            if size == 0:
+                raise UploadError('文件为空')
+            digest = hasher.hexdigest()
+            return digest, self._commit(digest, temp_path, extension), size
+        except BaseException:
+            _remove(temp_path)
+            raise
+
+    # 断点续传
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.upload_dir, upload_id + '.json')
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.upload_dir, upload_id + '.part')
+
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def create(self, size, metadata):
+        """登记一个上传，返回上传ID"""
+        if size <= 0:
+            raise UploadError('文件为空')
+        if size > self.max_size:
+            raise UploadTooLarge('文件超过允许的大小')
+        upload_id = uuid.uuid4().hex
+        open(self._part_path(upload_id), 'wb').close()
+        with open(self._meta_path(upload_id), 'w', encoding='utf-8') as f:
+            json.dump({'size': size, 'created_at': time.time(), 'metadata': metadata}, f, ensure_ascii=False)
+        return upload_id
+
+    def status(self, upload_id):
+        """返回 {'size', 'offset', 'metadata'}"""
+        if not re.match(r'^[0-9a-f]{32}$', upload_id or ''):
+            raise UploadNotFound('上传不存在或已过期')
+        try:
+            with open(self._meta_path(upload_id), 'r', encoding='utf-8') as f:
+                info = json.load(f)
+            info['offset'] = os.path.getsize(self._part_path(upload_id))
+        except (OSError, ValueError):
+            raise UploadNotFound('上传不存在或已过期')
+        return info
+
+    def _hasher(self, upload_id, offset):
+        """已接收部分的哈希状态，缓存失效时从部分文件重新计算"""
+        cached = self._hashers.get(upload_id)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        hasher = hashlib.sha256()
+        with open(self._part_path(upload_id), 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+        return hasher
+
+    def append(self, upload_id, offset, stream):
+        """从 offset 处追加一个分片，返回已接收的字节数"""
+        with self._upload_lock(upload_id):
+            info = self.status(upload_id)
+            received = info['offset']
+            if offset != received:
+                raise OffsetMismatch(received)
+            hasher = self._hasher(upload_id, received)
+            try:
+                with open(self._part_path(upload_id), 'ab') as f:
+                    while True:
+                        chunk = stream.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        if received + len(chunk) > info['size']:
+                            raise UploadTooLarge('分片超出登记的文件大小')
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        received += len(chunk)
+            finally:
+                # 请求中途断开时已写入的部分仍然有效，下次从这里继续
+                self._hashers[upload_id] = (received, hasher)
+            return received
+
+    def finish(self, upload_id, extension=''):
+        """全部分片收齐后把文件移入存储目录，返回 (哈希, 文件路径, 大小)"""
+        with self._upload_lock(upload_id):
+            info = self.status(upload_id)
+            if info['offset'] != info['size']:
+                raise UploadError('文件尚未上传完整')
+            digest = self._hasher(upload_id, info['offset']).hexdigest()
+            path = self._commit(digest, self._part_path(upload_id), extension)
+            self._forget(upload_id)
+            return digest, path, info['size']
+
+    def discard(self, upload_id):
+        with self._upload_lock(upload_id):
+            _remove(self._part_path(upload_id))
+            self._forget(upload_id)
+
+    def _forget(self, upload_id):
+        _remove(self._meta_path(upload_id))
+        self._hashers.pop(upload_id, None)
+        with self._lock:
+            self._locks.pop(upload_id, None)
+
+    # 垃圾回收
+
+    def collect_garbage(self, referenced, grace=3600, upload_ttl=86400, dry_run=False):
+        """删除未被引用的文件（修改时间早于 grace 秒前）和超过 upload_ttl 秒没有进展的未完成上传
+
+        referenced 为仍被引用的哈希集合，返回统计信息。
+        """
+        now = time.time()
+        result = {'blobs_removed': 0, 'bytes_freed': 0, 'uploads_expired': 0}
+        for directory in os.scandir(self.blob_dir):
+            if not directory.is_dir() or len(directory.name) != 2:
+                continue
+            for entry in os.scandir(directory.path):
+                digest = entry.name.split('.', 1)[0]
+                if not DIGEST_PATTERN.match(digest) or digest in referenced:
+                    continue
+                stat = entry.stat()
+                if stat.st_mtime > now - grace:
+                    continue
+                result['blobs_removed'] += 1
+                result['bytes_freed'] += stat.st_size
+                if not dry_run:
+                    _remove(entry.path)
+
+        for entry in os.scandir(self.upload_dir):
+            name, extension = os.path.splitext(entry.name)
+            # 以部分文件的修改时间（最后一次收到分片）判断是否过期
+            if extension not in ('.part', '.tmp') or entry.stat().st_mtime > now - upload_ttl:
+                continue
+            result['uploads_expired'] += 1
+            if not dry_run:
+                _remove(entry.path)
+                if extension == '.part':
+                    _remove(self._meta_path(name))
+                    self._hashers.pop(name, None)
+        return result
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
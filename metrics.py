@@ -0,0 +1,388 @@
+# 启梦教育平台运行指标
+"""
+运行指标（Prometheus文本格式）
+
+MetricsRegistry 提供 Counter、Gauge、Histogram 三种指标。每个线程写自己的一份数据，
+inc/observe 不加锁（只在线程第一次写入时登记一次），读取时合并各线程的数据。
+线程结束时它的数据并入累计值，每个请求一个线程的服务器上分片数不会一直增长。
+直方图每次写入替换整个列表，读取时不会看到区间数量和总和只更新了一半的数据。
+还可以注册采集函数，在读取时返回连接池、缓存、队列等组件当前的数值。
+
+多进程部署（gunicorn等）时设置共享目录 METRICS_DIR：各进程每隔 METRICS_FLUSH_INTERVAL
+秒把本进程的全部指标写入目录中的一个文件（先写临时文件再替换），/metrics 合并所有文件。
+计数器和直方图保留已退出进程的数值；Gauge 只统计仍在运行的进程。其他进程的数据
+最多延迟一个写入周期。目录需在每次部署（所有进程重启）时清空，否则会累计上次部署的数值。
+
+Metrics 是Flask扩展，统计各路由的请求数（按状态码）、耗时直方图和正在处理的请求数。
+"""
+import atexit
+import bisect
+import itertools
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+from flask import g, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Shard:
+    """线程局部变量中保存的分片，线程结束时被释放"""
+    __slots__ = ('data', '__weakref__')
+
+    def __init__(self):
+        self.data = {}
+
+
+class _Shards:
+    """每个线程一份 {标签值: 数值}，只有所属线程写入；线程结束后用 combine 并入累计值"""
+
+    def __init__(self, combine):
+        self._combine = combine
+        self._local = threading.local()
+        self._live = {}
+        self._retired = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def get(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = _Shard()
+            shard_id = next(self._ids)
+            with self._lock:
+                self._live[shard_id] = shard.data
+            # 回调只引用分片ID，不引用分片本身，否则分片永远不会被释放
+            weakref.finalize(shard, self._retire, shard_id)
+            self._local.shard = shard
+        return shard.data
+
+    def _retire(self, shard_id):
+        with self._lock:
+            data = self._live.pop(shard_id, None)
+            if data:
+                self._combine(self._retired, data)
+
+    def snapshots(self):
+        with self._lock:
+            return [data.copy() for data in self._live.values()] + [self._retired.copy()]
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = _Shards(self._combine)
+
+    def reset(self):
+        self._shards = _Shards(self._combine)
+
+    def _labels(self, labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f'{self.name} 需要标签 {self.labelnames}')
+        return tuple(str(value) for value in labelvalues)
+
+    @staticmethod
+    def _combine(totals, shard):
+        """把一个分片的数值加到 totals 中"""
+        for key, value in shard.items():
+            totals[key] = totals.get(key, 0) + value
+
+    def _merged(self):
+        totals = {}
+        for shard in self._shards.snapshots():
+            self._combine(totals, shard)
+        return totals
+
+    def samples(self):
+        """[(样本名, ((标签名, 值), ...), 数值)]"""
+        return [
+            (self.name, tuple(zip(self.labelnames, key)), value)
+            for key, value in self._merged().items()
+        ]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        key = self._labels(labelvalues)
+        shard = self._shards.get()
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """只支持增减（各线程的增量相加）；当前值类的数据用采集函数提供"""
+    kind = 'gauge'
+
+    def inc(self, *labelvalues, amount=1):
+        key = self._labels(labelvalues)
+        shard = self._shards.get()
+        shard[key] = shard.get(key, 0) + amount
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bucket) for bucket in buckets))
+
+    def observe(self, value, *labelvalues):
+        key = self._labels(labelvalues)
+        shard = self._shards.get()
+        # 各区间（含+Inf）的数量，最后一项是总和；复制后整体替换，读取方拿到的列表不会再被修改
+        counts = list(shard.get(key) or [0] * (len(self.buckets) + 2))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+        shard[key] = counts
+
+    @staticmethod
+    def _combine(totals, shard):
+        for key, counts in shard.items():
+            merged = totals.get(key)
+            totals[key] = list(counts) if merged is None else [a + b for a, b in zip(merged, counts)]
+
+    def samples(self):
+        samples = []
+        for key, counts in self._merged().items():
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', labels + (('le', _format_value(bound)),), cumulative))
+            samples.append((f'{self.name}_sum', labels, counts[-1]))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _pid_alive(pid):
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self.directory = None
+        self.interval = 5.0
+        self._token = None
+        self._flusher_pid = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, func):
+        """注册采集函数（可作装饰器），返回 [(名称, 类型, 说明, {标签名: 值}, 数值)]"""
+        self._collectors.append(func)
+        return func
+
+    def families(self):
+        """本进程的全部指标 {名称: {'type', 'help', 'samples': {(样本名, 标签): 数值}}}"""
+        families = {}
+        for metric in self._metrics:
+            family = families.setdefault(metric.name, {
+                'type': metric.kind, 'help': metric.documentation, 'samples': {}
+            })
+            for sample_name, labels, value in metric.samples():
+                family['samples'][(sample_name, labels)] = value
+        for collect in self._collectors:
+            try:
+                rows = collect()
+            except Exception as e:
+                print(f"指标采集错误: {e}")
+                continue
+            for name, kind, documentation, labels, value in rows:
+                family = families.setdefault(name, {'type': kind, 'help': documentation, 'samples': {}})
+                key = (name, tuple(labels.items()))
+                family['samples'][key] = family['samples'].get(key, 0) + value
+        return families
+
+    # 多进程
+
+    def enable_multiprocess(self, directory, interval=5.0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.interval = interval
+
+    def _after_fork(self):
+        # 子进程不继承父进程的数值和快照文件
+        for metric in self._metrics:
+            metric.reset()
+        self._token = None
+        self._flusher_pid = None
+        self._lock = threading.Lock()
+
+    def _snapshot_path(self):
+        if self._token is None:
+            self._token = uuid.uuid4().hex[:8]
+        return os.path.join(self.directory, f'metrics-{os.getpid()}-{self._token}.json')
+
+    def ensure_flusher(self):
+        """多进程模式下启动本进程的定期写入线程（每个进程第一次调用时启动）"""
+        if self.directory is None or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            thread = threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True)
+            thread.start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """把本进程的指标写入共享目录"""
+        if self.directory is None:
+            return
+        families = self.families()
+        payload = {
+            'pid': os.getpid(),
+            'families': {
+                name: {
+                    'type': family['type'],
+                    'help': family['help'],
+                    'samples': [[sample, list(labels), value] for (sample, labels), value in family['samples'].items()]
+                }
+                for name, family in families.items()
+            }
+        }
+        path = self._snapshot_path()
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(payload, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"写入指标文件错误: {e}")
+
+    def collect(self):
+        """合并本进程和（多进程模式下）其他进程的指标"""
+        families = self.families()
+        if self.directory is None:
+            return families
+        own = os.path.basename(self._snapshot_path())
+        for filename in os.listdir(self.directory):
+            if filename == own or not filename.startswith('metrics-') or not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    payload = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _pid_alive(payload['pid'])
+            for name, data in payload['families'].items():
+                if data['type'] == 'gauge' and not alive:
+                    continue
+                family = families.setdefault(name, {'type': data['type'], 'help': data['help'], 'samples': {}})
+                for sample, labels, value in data['samples']:
+                    key = (sample, tuple(tuple(pair) for pair in labels))
+                    family['samples'][key] = family['samples'].get(key, 0) + value
+        return families
+
+    def render(self):
+        """Prometheus文本格式"""
+        lines = []
+        for name, family in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {_escape(family['help'])}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for (sample, labels), value in family['samples'].items():
+                if labels:
+                    label_text = ','.join(f'{key}="{_escape(str(val))}"' for key, val in labels)
+                    lines.append(f'{sample}{{{label_text}}} {_format_value(value)}')
+                else:
+                    lines.append(f'{sample} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Flask扩展：按路由统计请求数、状态码、耗时和正在处理的请求数"""
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, app=None, registry=None):
+        self.registry = registry or MetricsRegistry()
+        self.requests = self.registry.counter(
+            'http_requests_total', '请求数', ('endpoint', 'method', 'status')
+        )
+        self.latency = self.registry.histogram(
+            'http_request_duration_seconds', '请求耗时（秒）', ('endpoint', 'method')
+        )
+        self.in_flight = self.registry.gauge('http_requests_in_flight', '正在处理的请求数')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_DIR', '')
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5.0)
+        if app.config['METRICS_DIR']:
+            self.registry.enable_multiprocess(app.config['METRICS_DIR'], float(app.config['METRICS_FLUSH_INTERVAL']))
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        self.registry.ensure_flusher()
+        g._metrics_started = time.perf_counter()
+        self.in_flight.inc()
+
+    def _after_request(self, response):
+        started = g.get('_metrics_started')
+        if started is not None:
+            endpoint = request.endpoint or 'none'
+            self.latency.observe(time.perf_counter() - started, endpoint, request.method)
+            self.requests.inc(endpoint, request.method, response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        if g.pop('_metrics_started', None) is not None:
+            self.in_flight.dec()
@@ -0,0 +1,178 @@
+# 启梦教育平台数据库迁移
+"""
+版本化的数据库结构迁移
+
+db.create_all() 只会创建缺失的表，不会修改已存在的表（包括索引），
+已上线的数据库需要通过这里的迁移步骤升级。每个步骤只执行一次，
+已执行的版本记录在 schema_version 表中。
+
+新增步骤：在 MIGRATIONS 末尾追加 (版本号, 说明, 函数)，版本号递增，
+函数接收 (connection, metadata)，metadata 为应用模型的元数据。
+"""
+from datetime import datetime
+
+import search
+import stats
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+
+version_metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', version_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+
+def index_exists(connection, index):
+    """按名称检查索引是否存在（反射会跳过表达式索引，不能用 checkfirst）"""
+    if connection.dialect.name == 'sqlite':
+        query = text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name")
+        params = {'name': index.name}
+    else:
+        query = text(
+            'SELECT 1 FROM information_schema.statistics '
+            'WHERE table_schema = DATABASE() AND table_name = :table AND index_name = :name'
+        )
+        params = {'table': index.table.name, 'name': index.name}
+    return connection.execute(query, params).first() is not None
+
+
+def create_indexes(*index_names):
+    """生成迁移步骤：按名称创建模型中声明的索引（已存在则跳过）
+
+    按名称列出而不是创建整张表的索引，以免早期步骤用到之后才添加的列。
+    """
+    def upgrade(connection, metadata):
+        indexes = {index.name: index for table in metadata.tables.values() for index in table.indexes}
+        for index_name in index_names:
+            if not index_exists(connection, indexes[index_name]):
+                indexes[index_name].create(connection)
+    return upgrade
+
+
+def add_model_columns(table_name, *column_names):
+    """生成迁移步骤：为已存在的表添加模型中新增的列（已存在则跳过），新列必须可为空"""
+    def upgrade(connection, metadata):
+        table = metadata.tables[table_name]
+        existing = {column['name'] for column in inspect(connection).get_columns(table_name)}
+        preparer = connection.dialect.identifier_preparer
+        for column_name in column_names:
+            if column_name in existing:
+                continue
+            column = table.columns[column_name]
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(
+                f'ALTER TABLE {preparer.format_table(table)} '
+                f'ADD COLUMN {preparer.format_column(column)} {column_type}'
+            ))
+    return upgrade
+
+
+def fill_column(table_name, column_name, value):
+    """生成迁移步骤：把新增列中为空的值设为 value"""
+    def upgrade(connection, metadata):
+        column = metadata.tables[table_name].columns[column_name]
+        connection.execute(column.table.update().where(column.is_(None)).values({column_name: value}))
+    return upgrade
+
+
+def build_search_index(connection, metadata):
+    """创建并填充全文搜索索引（仅SQLite）"""
+    if search.supported(connection):
+        search.rebuild(connection, metadata)
+
+
+def build_stats(connection, metadata):
+    """创建统计表并根据现有数据计算"""
+    stats.reconcile(connection, metadata)
+
+
+def lowercase_emails(connection, metadata):
+    """邮箱统一转为小写；与其他账户只有大小写不同的邮箱保持不变，需要手动处理"""
+    users = metadata.tables['user']
+    rows = connection.execute(select(users.c.id, users.c.email)).all()
+    taken = {email for _, email in rows}
+    for user_id, email in rows:
+        lowered = email.strip().lower()
+        if lowered == email:
+            continue
+        if lowered in taken:
+            print(f"邮箱 {email} 与其他账户只有大小写不同，未转为小写")
+            continue
+        connection.execute(users.update().where(users.c.id == user_id).values(email=lowered))
+        taken.add(lowered)
+
+
+def run_steps(*steps):
+    """把多个迁移函数组合为一个步骤"""
+    def upgrade(connection, metadata):
+        for step in steps:
+            step(connection, metadata)
+    return upgrade
+
+
+MIGRATIONS = [
+    (1, '热点查询复合索引', create_indexes(
+        'ix_course_teacher_status',
+        'ix_course_enrollment_student_status', 'ix_course_enrollment_course_status',
+        'ix_lesson_course_date_status',
+        'ix_course_material_course_upload',
+        'ix_leave_request_student_status', 'ix_leave_request_course_status',
+        'ix_speech_record_student_date'
+    )),
+    (2, '教学资料内容哈希', run_steps(
+        add_model_columns('course_material', 'content_hash', 'file_size', 'original_filename'),
+        create_indexes('ix_course_material_content_hash')
+    )),
+    (3, '全文搜索索引', build_search_index),
+    (4, '统计数据表', build_stats),
+    (5, '用户状态和用户列表索引', run_steps(
+        add_model_columns('user', 'status'),
+        fill_column('user', 'status', 'active'),
+        create_indexes(
+            'ix_user_created', 'ix_user_role_created', 'ix_user_role_username', 'ix_user_status_created',
+            'ix_student_profile_user', 'ix_teacher_profile_user'
+        )
+    )),
+    (6, '日历订阅令牌', run_steps(
+        add_model_columns('user', 'feed_token'),
+        create_indexes('ix_user_feed_token')
+    )),
+    (7, '全文搜索索引包含非公开资料', build_search_index),
+    (8, '邮箱转为小写，用户名不区分大小写查重的索引', run_steps(
+        lowercase_emails,
+        create_indexes('ix_user_username_lower')
+    )),
+]
+
+
+def current_version(connection):
+    """当前数据库结构版本，未执行过迁移时为0"""
+    version_metadata.create_all(connection, checkfirst=True)
+    latest = connection.execute(
+        select(schema_version.c.version).order_by(schema_version.c.version.desc()).limit(1)
+    ).scalar()
+    return latest or 0
+
+
+def run_migrations(engine, metadata):
+    """按版本顺序执行未应用的迁移，每个步骤单独一个事务，返回执行过的版本号"""
+    applied = []
+    with engine.begin() as connection:
+        version = current_version(connection)
+
+    for step_version, description, upgrade in MIGRATIONS:
+        if step_version <= version:
+            continue
+        with engine.begin() as connection:
+            upgrade(connection, metadata)
+            connection.execute(schema_version.insert().values(
+                version=step_version,
+                description=description,
+                applied_at=datetime.utcnow()
+            ))
+        applied.append(step_version)
+        print(f"数据库迁移 {step_version}: {description}")
+    return applied
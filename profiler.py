@@ -0,0 +1,284 @@
+# 启梦教育平台请求分析
+"""
+按需分析单个请求
+
+触发方式（任一即可）：
+- 管理员请求时带 X-Profile 头或 _profile 查询参数（值为 sampler 时使用采样，其他值使用cProfile）；
+- 管理员为某个用户开启一段时间的分析，该用户在此期间的请求都会被分析（用于只有某个账户慢的页面）；
+- PROFILE_SAMPLE_RATE 大于0时按比例随机分析请求。
+
+两种方式：cProfile 统计每个函数的调用次数和耗时，保存为 pstats 文件（.prof，可用 snakeviz 等工具查看）；
+采样（sampler）每隔 PROFILE_SAMPLER_INTERVAL 秒记录一次请求线程的调用栈，开销与函数调用次数无关，
+保存为折叠栈格式（.folded，每行 "调用栈 次数"，可直接用 flamegraph.pl 或 speedscope 生成火焰图）。
+
+结果保存在 PROFILE_DIR，每次分析一个 .json 记录（路由、耗时、状态码等）加一个结果文件，
+最多保留 PROFILE_KEEP 个，超出时删除最早的。用户开启记录保存在同一目录的 targets.json，
+多个工作进程共享。
+"""
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request, session
+
+PROFILE_ID_LENGTH = 26
+MODES = ('cprofile', 'sampler')
+
+
+class StackSampler:
+    """后台线程定时记录目标线程的调用栈"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """分析结果目录，最多保留 keep 个"""
+
+    def __init__(self, directory, keep=100):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write(self, name, data):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, self._path(name))
+
+    def save(self, meta, extension, data):
+        """保存一次分析，返回记录ID"""
+        # ID以时间开头，按文件名排序即按时间排序
+        profile_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:5]}"
+        meta = dict(meta, id=profile_id, file=f'{profile_id}{extension}')
+        self._write(meta['file'], data)
+        self._write(f'{profile_id}.json', json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        self._trim()
+        return profile_id
+
+    def _ids(self):
+        return sorted(
+            name[:-5] for name in os.listdir(self.directory)
+            if name.endswith('.json') and len(name) == PROFILE_ID_LENGTH + 5
+        )
+
+    def _trim(self):
+        for profile_id in self._ids()[:-self.keep]:
+            self.delete(profile_id)
+
+    def delete(self, profile_id):
+        meta = self.get(profile_id)
+        names = [f'{profile_id}.json'] + ([meta['file']] if meta else [])
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def get(self, profile_id):
+        if len(profile_id) != PROFILE_ID_LENGTH or not profile_id.replace('-', '').isalnum():
+            return None
+        try:
+            with open(self._path(f'{profile_id}.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def list(self):
+        """全部记录，最新的在前"""
+        profiles = []
+        for profile_id in reversed(self._ids()):
+            meta = self.get(profile_id)
+            if meta:
+                profiles.append(meta)
+        return profiles
+
+    def file_path(self, meta):
+        return self._path(meta['file'])
+
+    def summary(self, meta, limit=40):
+        """结果摘要：cProfile为按累计耗时排序的函数表，采样为出现次数最多的调用栈"""
+        path = self.file_path(meta)
+        if meta['mode'] == 'cprofile':
+            output = io.StringIO()
+            stats = pstats.Stats(path, stream=output)
+            stats.strip_dirs().sort_stats('cumulative').print_stats(limit)
+            return output.getvalue()
+        with open(path, encoding='utf-8') as f:
+            return ''.join(f.readline() for _ in range(limit))
+
+    # 按用户开启分析
+
+    def targets(self):
+        """{用户ID: 截止时间戳}，已过期的不返回"""
+        try:
+            with open(self._path('targets.json'), encoding='utf-8') as f:
+                targets = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return {int(user_id): until for user_id, until in targets.items() if until > now}
+
+    def set_target(self, user_id, until):
+        targets = self.targets()
+        if until:
+            targets[user_id] = until
+        else:
+            targets.pop(user_id, None)
+        self._write('targets.json', json.dumps({str(key): value for key, value in targets.items()}).encode('utf-8'))
+
+
+class RequestProfiler:
+    """Flask扩展：按需分析请求
+
+    allow() 返回当前用户能否通过请求头/参数触发分析（管理员）；
+    describe() 返回附加到分析记录中的信息（用户名、查询数等）。
+    """
+
+    def __init__(self, app=None, allow=None, describe=None):
+        self.allow = allow or (lambda: False)
+        self.describe = describe or (lambda: {})
+        self.app = None
+        self.store = None
+        self._targets = {}
+        self._targets_checked = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('PROFILE_KEEP', 100)
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILE_MODE', 'cprofile')
+        app.config.setdefault('PROFILE_SAMPLER_INTERVAL', 0.005)
+        self.app = app
+        self.store = ProfileStore(app.config['PROFILE_DIR'], keep=int(app.config['PROFILE_KEEP']))
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def targets(self):
+        """按用户开启的分析，每秒最多读一次文件"""
+        now = time.monotonic()
+        if now - self._targets_checked > 1:
+            self._targets = self.store.targets()
+            self._targets_checked = now
+        return self._targets
+
+    def set_target(self, user_id, minutes):
+        """为用户开启 minutes 分钟的分析，minutes 为0时关闭"""
+        self.store.set_target(user_id, time.time() + minutes * 60 if minutes else None)
+        self._targets_checked = 0.0
+
+    def _requested_mode(self):
+        """本次请求的分析方式，不分析时返回None"""
+        flag = request.headers.get('X-Profile') or request.args.get('_profile')
+        if flag and self.allow():
+            return flag if flag in MODES else self.app.config['PROFILE_MODE']
+
+        targets = self.targets()
+        if targets:
+            user_id = session.get('_user_id')
+            if user_id is not None and targets.get(int(user_id), 0) > time.time():
+                return self.app.config['PROFILE_MODE']
+
+        rate = self.app.config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            return self.app.config['PROFILE_MODE']
+        return None
+
+    def _before_request(self):
+        if request.endpoint == 'static':
+            return
+        mode = self._requested_mode()
+        if mode is None:
+            return
+        if mode == 'sampler':
+            profiler = StackSampler(threading.get_ident(), float(self.app.config['PROFILE_SAMPLER_INTERVAL']))
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # 已有其他分析器在运行
+                return
+        g._profile = (mode, profiler, time.perf_counter())
+
+    def _stop(self):
+        mode, profiler, started = g.pop('_profile')
+        if mode == 'sampler':
+            profiler.stop()
+        else:
+            profiler.disable()
+        return mode, profiler, time.perf_counter() - started
+
+    def _after_request(self, response):
+        if g.get('_profile') is None:
+            return response
+        mode, profiler, elapsed = self._stop()
+        meta = {
+            'endpoint': request.endpoint or 'none',
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 1),
+            'mode': mode,
+            'created_at': datetime.now().isoformat(timespec='seconds')
+        }
+        try:
+            meta.update(self.describe())
+            if mode == 'sampler':
+                profile_id = self.store.save(meta, '.folded', profiler.folded().encode('utf-8'))
+            else:
+                profiler.create_stats()
+                profile_id = self.store.save(meta, '.prof', marshal.dumps(profiler.stats))
+            response.headers['X-Profile-Id'] = profile_id
+        except Exception as e:
+            print(f"保存请求分析错误: {e}")
+        return response
+
+    def _teardown_request(self, exc):
+        # 未经过 after_request（请求中途出错）时停止分析，不保存
+        if g.get('_profile') is not None:
+            self._stop()
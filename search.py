@@ -0,0 +1,373 @@
+# 启梦教育平台全文搜索
+"""
+全文搜索索引（SQLite FTS5）
+
+FTS5 自带的分词器不能切分中文，这里在写入和查询前先做分词：连续的汉字切成
+相邻两字的二元组（“汉语课” -> “汉语 语课”），拉丁字母（英文、越南语）按单词切分，
+再交给 unicode61 分词器去掉声调符号，所以 “tieng viet” 也能搜到 “Tiếng Việt”。
+查询中的汉字二元组按短语匹配，最后一个单词按前缀匹配（边输入边搜索）。
+资料只对能访问该课程的用户可见，非公开资料只有任课老师和管理员可见。
+可见范围作为 access 列的词条参与匹配，不需要在匹配后逐行读取内容过滤。按相关度排序超过时间上限时，改为返回未排序的匹配结果。
+
+索引表 search_index 的 rowid 由 (类型, 记录ID) 计算得出，更新和删除不需要扫描。
+应用通过 ORM 事件在同一事务中调用 upsert()/delete() 保持同步，
+批量 UPDATE 等绕过 ORM 的修改需要执行 rebuild()（flask rebuild-search-index）。
+
+测试索引和查询速度：python search.py --bench
+"""
+import re
+import sqlite3
+import time
+import unicodedata
+
+from sqlalchemy import exc, select, text
+
+TABLE = 'search_index'
+KINDS = ('course', 'material', 'case', 'camp')
+
+# 每种类型：来源表、标题列、正文列、摘要列、权限范围列、公开标记列、只索引满足条件的记录
+SOURCES = {
+    'course': {
+        'table': 'course',
+        'title': ('name',),
+        'body': ('description', 'level'),
+        'summary': 'description',
+        'scope': None,
+        'public': None,
+        'where': ('status', 'active'),
+    },
+    'material': {
+        'table': 'course_material',
+        'title': ('title',),
+        'body': ('description', 'original_filename'),
+        'summary': 'description',
+        'scope': 'course_id',
+        'public': 'is_public',
+        'where': None,
+    },
+    'case': {
+        'table': 'study_abroad_case',
+        'title': ('student_name', 'target_university'),
+        'body': ('student_country', 'target_major', 'original_background', 'success_story', 'testimonial'),
+        'summary': 'success_story',
+        'scope': None,
+        'public': None,
+        'where': None,
+    },
+    'camp': {
+        'table': 'camp_program',
+        'title': ('name',),
+        'body': ('theme', 'description', 'itinerary', 'includes'),
+        'summary': 'description',
+        'scope': None,
+        'public': None,
+        'where': ('status', 'active'),
+    },
+}
+
+CJK = '㐀-䶿一-鿿豈-﫿'
+TOKEN_PATTERN = re.compile(rf'[{CJK}]+|[^\W_{CJK}]+')
+CJK_PATTERN = re.compile(rf'[{CJK}]')
+SUMMARY_LENGTH = 120
+ALL_SCOPES = object()
+
+
+def normalize(value):
+    text_value = unicodedata.normalize('NFKC', str(value or '')).lower()
+    # unicode61 不会把越南语的 đ 当作 d 的变体
+    return text_value.replace('đ', 'd')
+
+
+def tokenize(value):
+    """分词：汉字切成二元组，其他文字按单词"""
+    tokens = []
+    for run in TOKEN_PATTERN.findall(normalize(value)):
+        if CJK_PATTERN.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def build_match(query):
+    """把用户输入转换为 FTS5 查询，没有可搜索的内容时返回None"""
+    runs = TOKEN_PATTERN.findall(normalize(query))
+    if not runs:
+        return None
+    terms = []
+    for index, run in enumerate(runs):
+        last = index == len(runs) - 1 and not query[-1:].isspace()
+        if CJK_PATTERN.match(run):
+            if len(run) == 1:
+                # 单个汉字匹配以它开头的二元组
+                terms.append(f'"{run}"*')
+            else:
+                terms.append('"' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+        elif last and len(run) == 1:
+            # 正在输入的单个字母前缀匹配范围太大，等输入更多再匹配
+            continue
+        elif last:
+            terms.append(f'"{run}"*')
+        else:
+            terms.append(f'"{run}"')
+    return ' '.join(terms) or None
+
+
+def rowid_for(kind, ref_id):
+    return ref_id * len(KINDS) + KINDS.index(kind)
+
+
+def access_token(scope, private=False):
+    if scope is None:
+        return 'public'
+    return f'staff{scope}' if private else f'course{scope}'
+
+
+def _summary(value):
+    value = ' '.join(str(value or '').split())
+    return value if len(value) <= SUMMARY_LENGTH else value[:SUMMARY_LENGTH] + '…'
+
+
+def document(kind, values):
+    """根据记录的列值生成索引行，不应被索引时返回None"""
+    source = SOURCES[kind]
+    where = source['where']
+    if where is not None and values.get(where[0]) != where[1]:
+        return None
+    title = ' '.join(str(values[column]) for column in source['title'] if values.get(column))
+    body = ' '.join(str(values[column]) for column in source['body'] if values.get(column))
+    return {
+        'rowid': rowid_for(kind, values['id']),
+        'kind': kind,
+        'ref_id': values['id'],
+        'title': title,
+        'summary': _summary(values.get(source['summary'])),
+        'access': access_token(
+            values[source['scope']] if source['scope'] else None,
+            private=bool(source['public']) and not values.get(source['public'])
+        ),
+        'title_tokens': ' '.join(tokenize(title)),
+        'body_tokens': ' '.join(tokenize(body)),
+    }
+
+
+INSERT = text(
+    f'INSERT INTO {TABLE} (rowid, kind, ref_id, title, summary, access, title_tokens, body_tokens) '
+    f'VALUES (:rowid, :kind, :ref_id, :title, :summary, :access, :title_tokens, :body_tokens)'
+)
+DELETE = text(f'DELETE FROM {TABLE} WHERE rowid = :rowid')
+
+
+def supported(connection):
+    return connection.dialect.name == 'sqlite'
+
+
+def create(connection):
+    """创建索引表（已存在则跳过）"""
+    connection.execute(text(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5('
+        'kind UNINDEXED, ref_id UNINDEXED, title UNINDEXED, summary UNINDEXED, '
+        'access, title_tokens, body_tokens, '
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    ))
+
+
+def exists(connection):
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': TABLE}
+    ).first() is not None
+
+
+def upsert(connection, kind, values):
+    """写入或更新一条记录的索引"""
+    connection.execute(DELETE, {'rowid': rowid_for(kind, values['id'])})
+    row = document(kind, values)
+    if row is not None:
+        connection.execute(INSERT, row)
+
+
+def delete(connection, kind, ref_id):
+    connection.execute(DELETE, {'rowid': rowid_for(kind, ref_id)})
+
+
+def rebuild(connection, metadata, batch_size=1000):
+    """根据数据表重建全部索引，返回写入的行数"""
+    create(connection)
+    connection.execute(text(f'DELETE FROM {TABLE}'))
+    count = 0
+    for kind, source in SOURCES.items():
+        table = metadata.tables[source['table']]
+        batch = []
+        for values in connection.execute(select(table)).mappings():
+            row = document(kind, values)
+            if row is None:
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                connection.execute(INSERT, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            connection.execute(INSERT, batch)
+            count += len(batch)
+    connection.execute(text(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')"))
+    return count
+
+
+def access_match(scopes, private_scopes):
+    """可见范围对应的 access 列查询，不限制时返回None"""
+    if scopes is ALL_SCOPES and private_scopes is ALL_SCOPES:
+        return None
+    if scopes is ALL_SCOPES:
+        terms = ['public', 'course*']
+    else:
+        terms = ['public'] + [access_token(scope) for scope in sorted(set(scopes or ()))]
+    if private_scopes is ALL_SCOPES:
+        terms.append('staff*')
+    else:
+        terms += [access_token(scope, private=True) for scope in sorted(set(private_scopes or ()))]
+    return ' OR '.join(terms)
+
+
+def search(connection, query, scopes=None, private_scopes=None, limit=10, timeout_ms=100):
+    """按相关度返回 [{'kind', 'ref_id', 'title', 'summary'}]
+
+    scopes 为可以看到公开资料的课程ID，private_scopes 为还可以看到非公开资料的课程ID；
+    None 表示不返回这类资料，ALL_SCOPES 表示返回全部。
+    排序超过 timeout_ms 毫秒时中断，改为返回未排序的前 limit 条匹配。
+    """
+    match = build_match(query)
+    if match is None:
+        return []
+    match = f'{{title_tokens body_tokens}} : ({match})'
+    access = access_match(scopes, private_scopes)
+    if access is not None:
+        match += f' AND access : ({access})'
+    params = {'match': match, 'limit': limit}
+    ranked = text(
+        f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH :match '
+        f'ORDER BY bm25({TABLE}, 0, 0, 0, 0, 0, 5.0, 1.0) LIMIT :limit'
+    )
+    unranked = text(f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH :match LIMIT :limit')
+
+    raw = connection.connection.driver_connection
+    deadline = time.perf_counter() + timeout_ms / 1000
+    raw.set_progress_handler(lambda: time.perf_counter() > deadline, 1000)
+    try:
+        rowids = connection.execute(ranked, params).scalars().all()
+    except exc.OperationalError as e:
+        if not (isinstance(e.orig, sqlite3.OperationalError) and 'interrupted' in str(e.orig)):
+            raise
+        rowids = None
+    finally:
+        raw.set_progress_handler(None, 0)
+    if rowids is None:
+        rowids = connection.execute(unranked, params).scalars().all()
+    if not rowids:
+        return []
+
+    # 只读取最终结果的内容列
+    placeholders = ', '.join(f':row{i}' for i in range(len(rowids)))
+    rows = connection.execute(
+        text(f'SELECT rowid, kind, ref_id, title, summary FROM {TABLE} WHERE rowid IN ({placeholders})'),
+        {f'row{i}': rowid for i, rowid in enumerate(rowids)}
+    ).mappings().all()
+    by_rowid = {row['rowid']: row for row in rows}
+    return [
+        {'kind': row['kind'], 'ref_id': row['ref_id'], 'title': row['title'], 'summary': row['summary']}
+        for row in (by_rowid[rowid] for rowid in rowids)
+    ]
+
+
+# 性能测试
+
+BENCH_WORDS = {
+    'zh': '汉语 中文 课程 老师 学生 留学 大学 奖学金 研学 旅行 北京 上海 文化 历史 口语 听力 语法 词汇 考试 基础 提高 '
+          '暑期 夏令营 书法 美食 长城 故宫 发音 声调 阅读 写作 商务 少儿 成人 周末 晚班'.split(),
+    'vi': 'tiếng trung khóa học giáo viên học sinh du học đại học học bổng văn hóa lịch sử ngữ pháp từ vựng '
+          'phát âm thanh điệu trại hè bắc kinh thượng hải'.split(),
+    'en': 'chinese course teacher student study abroad university scholarship culture history grammar '
+          'vocabulary pronunciation summer camp beijing shanghai business beginner intermediate advanced'.split(),
+}
+
+
+def synthesize_corpus(rows, seed=7):
+    """生成中文、越南语、英文混合的测试数据（按 SOURCES 的表结构）"""
+    import random
+    rng = random.Random(seed)
+
+    def phrase(language, count):
+        words = rng.choices(BENCH_WORDS[language], k=count)
+        return ''.join(words) if language == 'zh' else ' '.join(words)
+
+    tables = {kind: [] for kind in KINDS}
+    for index in range(1, rows + 1):
+        kind = KINDS[index % len(KINDS)]
+        language = ('zh', 'vi', 'en')[index % 3]
+        title, body = phrase(language, 3), phrase(language, 40)
+        if kind == 'course':
+            values = {'name': title, 'description': body, 'level': f'HSK{index % 6 + 1}', 'status': 'active'}
+        elif kind == 'material':
+            values = {'title': title, 'description': body, 'original_filename': None,
+                      'course_id': index % 50, 'is_public': True}
+        elif kind == 'case':
+            values = {'student_name': title, 'target_university': phrase(language, 1),
+                      'student_country': 'Vietnam', 'target_major': phrase(language, 2),
+                      'original_background': body, 'success_story': body, 'testimonial': None}
+        else:
+            values = {'name': title, 'theme': phrase(language, 1), 'description': body,
+                      'itinerary': None, 'includes': None, 'status': 'active'}
+        values['id'] = index
+        tables[kind].append(values)
+    return tables
+
+
+def benchmark(rows=100000, runs=200):
+    """在内存数据库中建立 rows 条记录的索引，测试查询延迟"""
+    from sqlalchemy import create_engine
+
+    engine = create_engine('sqlite://')
+    corpus = synthesize_corpus(rows)
+    with engine.begin() as connection:
+        create(connection)
+        started = time.perf_counter()
+        for kind, records in corpus.items():
+            connection.execute(INSERT, [row for row in (document(kind, values) for values in records) if row])
+        connection.execute(text(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')"))
+        build_seconds = time.perf_counter() - started
+
+    queries = ['汉语', '奖学金', '夏令营北京', '口', 'tieng trung', 'học bổng', 'du h',
+               'scholarship', 'summer ca', 'pr', 'chinese university', '汉语 grammar']
+    print(f"索引 {rows} 条记录：{build_seconds:.1f} 秒（{rows / build_seconds:.0f} 条/秒）")
+    with engine.connect() as connection:
+        for query in queries:
+            timings = []
+            for _ in range(max(1, runs // len(queries))):
+                started = time.perf_counter()
+                # 学生一般只选几门课，资料可见范围按3门课测试
+                results = search(connection, query, scopes=range(3), limit=10)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p50 = timings[len(timings) // 2]
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(f"{query!r:>22}: {len(results):>2} 条结果  p50 {p50:.2f} ms  p95 {p95:.2f} ms")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='全文搜索')
+    parser.add_argument('--bench', action='store_true', help='运行性能测试')
+    parser.add_argument('--rows', type=int, default=100000, help='性能测试的记录数')
+    parser.add_argument('query', nargs='?', help='显示查询的分词结果')
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.rows)
+    elif args.query:
+        print('分词：', tokenize(args.query))
+        print('FTS5：', build_match(args.query))
+    else:
+        parser.print_help()
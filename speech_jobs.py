@@ -0,0 +1,308 @@
+# 启梦教育平台口语评测任务队列
+"""
+口语评测异步任务
+
+评测请求提交到有界队列后立即返回任务ID，由固定数量的后台线程调用评分器，
+完成后通过 on_complete 回调保存结果，失败时调用 on_failure（如删除录音文件）。队列已满时 submit() 抛出 QueueFull，
+调用方应返回 503 并带上 retry_after() 给出的 Retry-After。
+
+任务状态同时写入共享目录（每个任务一个JSON文件，先写临时文件再替换），
+多进程部署时查询请求落到其他进程也能读到状态；评分仍由提交任务的进程完成。
+
+评分器只需实现 Scorer.score()，可以替换为真实的语音评测引擎。
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from cache import atomic_write
+
+FINISHED = ('done', 'failed')
+
+
+class QueueFull(Exception):
+    """评测队列已满"""
+
+
+class ScoringError(Exception):
+    """评分失败，异常信息可以直接展示给学生（如录音无法解码）"""
+
+
+class Scorer:
+    """评分器接口"""
+
+    name = 'base'
+
+    def score(self, submission):
+        """submission 为提交的数据（text、topic、audio_path等），
+        返回包含 score、pronunciation_score、fluency_score、feedback 的字典"""
+        raise NotImplementedError
+
+
+class RandomScorer(Scorer):
+    """模拟评分"""
+
+    name = 'random'
+
+    def score(self, submission):
+        score = random.randint(70, 95)
+        pronunciation_score = random.randint(65, 95)
+        fluency_score = random.randint(70, 90)
+        return {
+            'score': score,
+            'pronunciation_score': pronunciation_score,
+            'fluency_score': fluency_score,
+            'feedback': f"总体表现良好。发音准确度：{pronunciation_score}分，流利度：{fluency_score}分。"
+        }
+
+
+class Job:
+    """一次评测任务"""
+
+    def __init__(self, owner_id, submission):
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.submission = submission
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def timings(self):
+        """排队、评分和总耗时（毫秒）"""
+        def ms(start, end):
+            return round((end - start) * 1000, 1) if start and end else None
+        return {
+            'queue_ms': ms(self.submitted_at, self.started_at),
+            'score_ms': ms(self.started_at, self.finished_at),
+            'total_ms': ms(self.submitted_at, self.finished_at)
+        }
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'timings': self.timings()
+        }
+
+    def to_state(self):
+        """写入状态文件的内容（不含提交数据）"""
+        return {
+            'id': self.id,
+            'owner_id': self.owner_id,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """由状态文件还原（其他进程提交的任务，只用于查询）"""
+        job = cls(state['owner_id'], None)
+        for key, value in state.items():
+            setattr(job, key, value)
+        if job.status in FINISHED:
+            job.done.set()
+        return job
+
+
+class JobStore:
+    """任务状态目录，每个任务一个文件，多进程共享"""
+
+    suffix = '.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, job_id + self.suffix)
+
+    def save(self, job):
+        try:
+            atomic_write(self._path(job.id), json.dumps(job.to_state(), ensure_ascii=False).encode('utf-8'))
+        except OSError as e:
+            print(f"保存评测任务状态失败: {e}")
+
+    def load(self, job_id):
+        if len(job_id) != 32 or not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id), encoding='utf-8') as f:
+                return Job.from_state(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def expire(self, deadline):
+        """删除修改时间早于 deadline 的状态文件"""
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith(self.suffix) and entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class SpeechJobQueue:
+    """有界评测队列 + 固定线程池"""
+
+    def __init__(self, scorer, workers=2, maxsize=32, on_complete=None, on_failure=None, result_ttl=600,
+                 directory=None):
+        self.scorer = scorer
+        self.workers = workers
+        self.on_complete = on_complete
+        self.on_failure = on_failure
+        self.result_ttl = result_ttl
+        self.store = JobStore(directory) if directory else None
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._counters = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'queue_seconds': 0.0,
+            'score_seconds': 0.0
+        }
+
+    def _ensure_started(self):
+        # 首次提交时才启动线程，避免在导入模块或调试重载的父进程中启动
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'speech-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, owner_id, submission):
+        """提交评测，返回Job；队列满时抛出QueueFull"""
+        self._ensure_started()
+        self._expire_jobs()
+        job = Job(owner_id, submission)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._counters['rejected'] += 1
+            raise QueueFull()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._counters['submitted'] += 1
+        self._save(job)
+        return job
+
+    def _save(self, job):
+        if self.store is not None:
+            self.store.save(job)
+
+    def full(self):
+        """队列是否已满，可在接收上传前提前拒绝"""
+        return self._queue.full()
+
+    def get(self, job_id):
+        """本进程的任务，或其他进程写入共享目录的任务状态"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.load(job_id)
+        return job
+
+    def wait(self, job, timeout, interval=0.5):
+        """等待任务完成，返回最新的任务状态，超时未完成时返回None
+
+        本进程的任务等待完成事件，其他进程的任务每隔 interval 秒读取一次状态文件。
+        """
+        with self._lock:
+            local = self._jobs.get(job.id) is job
+        if local or self.store is None:
+            return job if job.done.wait(timeout) else None
+        deadline = time.monotonic() + timeout
+        while True:
+            latest = self.store.load(job.id)
+            if latest is not None and latest.status in FINISHED:
+                return latest
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(interval, remaining))
+
+    def retry_after(self):
+        """按平均评分耗时估算队列腾出位置所需的秒数"""
+        with self._lock:
+            finished = self._counters['completed'] + self._counters['failed']
+            average = self._counters['score_seconds'] / finished if finished else 1.0
+        return max(1, int(average * self._queue.qsize() / max(self.workers, 1)) + 1)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        finished = counters['completed'] + counters['failed']
+        counters.update({
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'workers': self.workers,
+            'scorer': self.scorer.name,
+            'avg_queue_ms': round(counters['queue_seconds'] * 1000 / finished, 1) if finished else 0.0,
+            'avg_score_ms': round(counters['score_seconds'] * 1000 / finished, 1) if finished else 0.0
+        })
+        return counters
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.started_at = time.time()
+            job.status = 'running'
+            self._save(job)
+            try:
+                result = self.scorer.score(job.submission)
+                if self.on_complete is not None:
+                    self.on_complete(job, result)
+                job.result = result
+                job.status = 'done'
+            except ScoringError as e:
+                job.error = str(e)
+                job.status = 'failed'
+            except Exception as e:
+                print(f"口语评测任务失败: {e}")
+                job.error = '评测失败，请重试'
+                job.status = 'failed'
+            finally:
+                if job.status == 'failed' and self.on_failure is not None:
+                    try:
+                        self.on_failure(job)
+                    except Exception as e:
+                        print(f"口语评测失败处理出错: {e}")
+                job.finished_at = time.time()
+                with self._lock:
+                    self._counters['completed' if job.status == 'done' else 'failed'] += 1
+                    self._counters['queue_seconds'] += job.started_at - job.submitted_at
+                    self._counters['score_seconds'] += job.finished_at - job.started_at
+                self._save(job)
+                job.done.set()
+                self._queue.task_done()
+
+    def _expire_jobs(self):
+        """清理超过保留时间的已完成任务"""
+        deadline = time.time() - self.result_ttl
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.finished_at and job.finished_at < deadline:
+                    del self._jobs[job_id]
+        if self.store is not None:
+            self.store.expire(deadline)
@@ -337,7 +337,7 @@ function initSpeechPractice() {
             };
             
             mediaRecorder.onstop = function() {
-                const audioBlob = new Blob(audioChunks, { type: 'audio/wav' });
+                const audioBlob = new Blob(audioChunks, { type: mediaRecorder.mimeType || 'audio/webm' });
                 processRecording(audioBlob);
             };
             
@@ -382,34 +382,17 @@ function initSpeechPractice() {
         }
         
         try {
-            // 转换音频为base64
-            const audioBase64 = await blobToBase64(audioBlob);
+            // 录音作为原始请求体上传，提交到后端评测队列，等待结果推送
+            const result = await submitSpeechEvaluation(audioBlob, {
+                'Content-Type': audioBlob.type || 'application/octet-stream'
+            }, { text: text, topic: topic });
             
-            // 发送到后端进行AI分析
-            const response = await fetch('/api/speech_evaluate', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    audio: audioBase64,
-                    text: text,
-                    topic: topic
-                })
-            });
-            
-            const result = await response.json();
-            
-            if (result.success) {
-                displayScore(result);
-                showNotification('语音分析完成！', 'success');
-            } else {
-                showNotification('语音分析失败，请重试', 'error');
-            }
+            displayScore(result);
+            showNotification('语音分析完成！', 'success');
             
         } catch (error) {
             console.error('处理录音失败:', error);
-            showNotification('处理录音失败，请重试', 'error');
+            showNotification(error.message || '处理录音失败，请重试', 'error');
         }
     }
     
@@ -443,15 +426,69 @@ function initSpeechPractice() {
         // 添加动画效果
         scoreDisplay.classList.add('fade-in-up');
     }
+}
+
+// 提交口语评测：接口返回任务ID后，通过SSE等待结果，不支持时改为轮询
+// body 可以是录音Blob（params 传 text/topic）、FormData 或 JSON 字符串
+async function submitSpeechEvaluation(body, headers = {}, params = null) {
+    const url = params ? `/api/speech_evaluate?${new URLSearchParams(params)}` : '/api/speech_evaluate';
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: headers,
+        body: body
+    });
+    const data = await response.json().catch(() => ({}));
+    
+    if (response.status === 503) {
+        const retryAfter = response.headers.get('Retry-After') || '几';
+        throw new Error(`评测繁忙，请${retryAfter}秒后重试`);
+    }
+    if (!response.ok || !data.job_id) {
+        throw new Error(data.error || '语音分析失败，请重试');
+    }
     
-    function blobToBase64(blob) {
-        return new Promise((resolve, reject) => {
-            const reader = new FileReader();
-            reader.onload = () => resolve(reader.result.split(',')[1]);
-            reader.onerror = reject;
-            reader.readAsDataURL(blob);
-        });
+    const job = await waitForSpeechJob(data);
+    if (job.status !== 'done') {
+        throw new Error(job.error || '语音分析失败，请重试');
     }
+    return job.result;
+}
+
+function waitForSpeechJob(submitted) {
+    return new Promise((resolve, reject) => {
+        const poll = async () => {
+            try {
+                const response = await fetch(submitted.status_url);
+                const job = await response.json();
+                if (!response.ok) {
+                    reject(new Error(job.error || '语音分析失败，请重试'));
+                } else if (job.status === 'done' || job.status === 'failed') {
+                    resolve(job);
+                } else {
+                    setTimeout(poll, 1000);
+                }
+            } catch (error) {
+                reject(error);
+            }
+        };
+        
+        if (!window.EventSource) {
+            poll();
+            return;
+        }
+        
+        // 服务器每次只等待几秒就结束连接，浏览器会自动重连；连接无法恢复时改为轮询
+        const source = new EventSource(submitted.events_url);
+        source.addEventListener('result', event => {
+            source.close();
+            resolve(JSON.parse(event.data));
+        });
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) {
+                poll();
+            }
+        };
+    });
 }
 
 // 通知系统
@@ -585,10 +622,11 @@ function initSearch() {
         if (results.length === 0) {
             searchResults.innerHTML = '<div class="search-no-results">未找到相关结果</div>';
         } else {
+            const esc = utils.escapeHtml;
             const resultsHtml = results.map(result => `
                 <div class="search-result-item">
-                    <h6><a href="${result.url}">${result.title}</a></h6>
-                    <p>${result.description}</p>
+                    <h6><a href="${esc(result.url)}">${esc(result.title)}</a> <span class="badge bg-light text-muted">${esc(result.type_label || '')}</span></h6>
+                    <p>${esc(result.description || '')}</p>
                 </div>
             `).join('');
             
@@ -802,6 +840,16 @@ const utils = {
             .replace('DD', day);
     },
     
+    // 转义HTML，用于拼接接口返回的数据
+    escapeHtml: function(text) {
+        return String(text == null ? '' : text)
+            .replace(/&/g, '&amp;')
+            .replace(/</g, '&lt;')
+            .replace(/>/g, '&gt;')
+            .replace(/"/g, '&quot;')
+            .replace(/'/g, '&#39;');
+    },
+    
     // 复制到剪贴板
     copyToClipboard: function(text) {
         if (navigator.clipboard) {
@@ -823,4 +871,5 @@ const utils = {
 
 // 导出工具函数到全局
 window.utils = utils;
-window.showNotification = showNotification;
\ No newline at end of file
+window.showNotification = showNotification;
+window.submitSpeechEvaluation = submitSpeechEvaluation;
\ No newline at end of file
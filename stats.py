@@ -0,0 +1,170 @@
+# 启梦教育平台统计
+"""
+增量维护的统计数据
+
+stat_counter 保存当前总数（各角色用户数、课程数、在读人数、各状态请假数等），
+stat_daily 按天保存新增数量（注册、选课、请假、口语练习），仪表盘只需读取少量行。
+
+RULES 定义每张表的一行对统计的贡献。应用在 ORM 事件中用 deltas() 计算
+新旧值的差，在同一事务中调用 apply() 累加；绕过 ORM 的批量修改需要自行
+调用 apply()，或执行 reconcile()（flask reconcile-stats）从数据表重新计算。
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, Date, Integer, MetaData, String, Table, select
+from sqlalchemy.dialects import mysql, sqlite
+
+metadata = MetaData()
+
+stat_counter = Table(
+    'stat_counter', metadata,
+    Column('name', String(50), primary_key=True),
+    Column('value', Integer, nullable=False, default=0)
+)
+
+stat_daily = Table(
+    'stat_daily', metadata,
+    Column('day', Date, primary_key=True),
+    Column('name', String(50), primary_key=True),
+    Column('value', Integer, nullable=False, default=0)
+)
+
+
+def _day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _user(row):
+    return {f"users.{row['role']}": 1}, {(f"registered.{row['role']}", _day(row['created_at'])): 1}
+
+
+def _course(row):
+    return {'courses.total': 1, 'courses.active': int(row['status'] == 'active')}, {}
+
+
+def _enrollment(row):
+    return {f"enrollments.{row['status']}": 1}, {('enrollments', _day(row['enrollment_date'])): 1}
+
+
+def _leave_request(row):
+    return {f"leave_requests.{row['status']}": 1}, {('leave_requests', _day(row['request_date'])): 1}
+
+
+def _speech_record(row):
+    day = _day(row['practice_date'])
+    return {'speech_records': 1}, {('speech_records', day): 1, ('speech_score_sum', day): row['score'] or 0}
+
+
+# 表名 -> (用到的列, 一行的贡献 -> (总数, {(名称, 日期): 数量}))
+RULES = {
+    'user': (('role', 'created_at'), _user),
+    'course': (('status',), _course),
+    'course_enrollment': (('status', 'enrollment_date'), _enrollment),
+    'leave_request': (('status', 'request_date'), _leave_request),
+    'speech_practice_record': (('score', 'practice_date'), _speech_record),
+}
+
+
+def deltas(table_name, old=None, new=None):
+    """一行从 old 变为 new 时统计的变化量，新增时 old 为None，删除时 new 为None"""
+    rule = RULES[table_name][1]
+    counters, daily = Counter(), Counter()
+    for row, sign in ((old, -1), (new, 1)):
+        if row is None:
+            continue
+        row_counters, row_daily = rule(row)
+        for name, value in row_counters.items():
+            counters[name] += sign * value
+        for key, value in row_daily.items():
+            if key[1] is not None:
+                daily[key] += sign * value
+    return counters, daily
+
+
+def _increment(connection, table, keys, delta):
+    """value += delta，行不存在时插入"""
+    values = dict(keys, value=delta)
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        statement = sqlite.insert(table).values(values)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys), set_={'value': table.c.value + statement.excluded.value}
+        )
+    elif dialect == 'mysql':
+        statement = mysql.insert(table).values(values)
+        statement = statement.on_duplicate_key_update(value=table.c.value + statement.inserted.value)
+    else:
+        condition = [table.c[key] == value for key, value in keys.items()]
+        updated = connection.execute(table.update().where(*condition).values(value=table.c.value + delta))
+        if updated.rowcount:
+            return
+        statement = table.insert().values(values)
+    connection.execute(statement)
+
+
+def apply(connection, counters, daily):
+    """累加变化量（按键排序，避免并发事务互相等待）"""
+    for name in sorted(counters):
+        if counters[name]:
+            _increment(connection, stat_counter, {'name': name}, counters[name])
+    for name, day in sorted(daily, key=lambda key: (key[1], key[0])):
+        if daily[(name, day)]:
+            _increment(connection, stat_daily, {'day': day, 'name': name}, daily[(name, day)])
+
+
+def read_counters(connection):
+    """全部当前总数 {名称: 数值}"""
+    return dict(connection.execute(select(stat_counter.c.name, stat_counter.c.value)).all())
+
+
+def read_daily(connection, days=30, today=None):
+    """最近 days 天的每日数据：{'labels': [日期...], 'series': {名称: [数值...]}}"""
+    today = today or datetime.utcnow().date()
+    start = today - timedelta(days=days - 1)
+    labels = [start + timedelta(days=offset) for offset in range(days)]
+    series = {}
+    rows = connection.execute(
+        select(stat_daily.c.day, stat_daily.c.name, stat_daily.c.value).where(stat_daily.c.day >= start)
+    )
+    for day, name, value in rows:
+        if day <= today:
+            series.setdefault(name, [0] * days)[(day - start).days] = value
+    return {'labels': [label.isoformat() for label in labels], 'series': series}
+
+
+def compute(connection, app_metadata):
+    """从数据表重新计算全部统计，返回 (总数, 每日数据)"""
+    counters, daily = Counter(), Counter()
+    for table_name, (columns, _) in RULES.items():
+        table = app_metadata.tables[table_name]
+        query = select(*(table.c[column] for column in columns))
+        for row in connection.execute(query).mappings():
+            row_counters, row_daily = deltas(table_name, new=row)
+            counters.update(row_counters)
+            daily.update(row_daily)
+    return counters, daily
+
+
+def reconcile(connection, app_metadata):
+    """重新计算并覆盖统计表，返回与原有总数不一致的项 {名称: (原值, 新值)}"""
+    metadata.create_all(connection, checkfirst=True)
+    previous = read_counters(connection)
+    counters, daily = compute(connection, app_metadata)
+
+    connection.execute(stat_counter.delete())
+    connection.execute(stat_daily.delete())
+    counter_rows = [{'name': name, 'value': value} for name, value in counters.items() if value]
+    daily_rows = [{'day': day, 'name': name, 'value': value} for (name, day), value in daily.items() if value]
+    if counter_rows:
+        connection.execute(stat_counter.insert(), counter_rows)
+    if daily_rows:
+        connection.execute(stat_daily.insert(), daily_rows)
+
+    return {
+        name: (previous.get(name, 0), counters.get(name, 0))
+        for name in set(previous) | set(counters)
+        if previous.get(name, 0) != counters.get(name, 0)
+    }
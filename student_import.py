@@ -0,0 +1,473 @@
+# 启梦教育平台学生批量导入
+"""
+学生批量导入（CSV / XLSX）
+
+上传的文件保存为临时文件后交给后台线程处理，接口立即返回任务ID，
+管理员轮询任务状态查看进度和逐行错误。文件按行流式读取，每 chunk_size
+行为一批：校验字段、查重，在进程池中计算密码哈希，然后在一个事务中
+批量插入 User、StudentProfile 和 CourseEnrollment，并同步统计数据。
+某一批写入失败只影响这一批，错误逐行报告。
+
+XLSX 直接解析 zip 中的工作表 XML（只读第一个工作表），不依赖第三方库。
+没有填写密码的行生成随机密码，任务结束后只在第一次查询结果时返回给管理员，随后从内存中删除。
+哈希计算在用 spawn 方式启动的进程池中进行（应用进程中有多个线程，不 fork）。
+
+任务状态保存在当前进程内，多进程部署时与口语评测任务一样需要粘性会话。
+"""
+import csv
+import io
+import multiprocessing
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import uuid
+import zipfile
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from xml.etree.ElementTree import iterparse
+
+from sqlalchemy import func, select
+from werkzeug.security import generate_password_hash
+
+import stats
+
+# 规范字段 -> 可接受的表头（不区分大小写）
+COLUMNS = {
+    'username': ('username', '用户名', '账号'),
+    'email': ('email', '邮箱', '电子邮箱'),
+    'full_name': ('full_name', '姓名', 'name'),
+    'password': ('password', '密码'),
+    'phone': ('phone', '电话', '手机'),
+    'native_language': ('native_language', '母语'),
+    'chinese_level': ('chinese_level', 'hsk', '中文水平'),
+    'course_id': ('course_id', '课程id', '课程编号'),
+}
+HEADER_NAMES = {alias.lower(): name for name, aliases in COLUMNS.items() for alias in aliases}
+CHINESE_LEVELS = ('HSK1', 'HSK2', 'HSK3', 'HSK4', 'HSK5', 'HSK6')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+$')
+USERNAME_PATTERN = re.compile(r'^[\w.\-]{3,80}$')
+MAX_ERRORS = 500
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+class ImportFileError(Exception):
+    """文件无法读取，异常信息可以直接返回给客户端"""
+
+
+class ImportQueueFull(Exception):
+    """等待中的导入任务过多"""
+
+
+def hash_password(args):
+    """在子进程中计算密码哈希，method 为空时使用默认算法"""
+    password, method = args
+    if method:
+        return generate_password_hash(password, method=method)
+    return generate_password_hash(password)
+
+
+# 读取文件
+
+def _column_index(reference):
+    """单元格引用（如 C12）-> 从0开始的列号"""
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - ord('A') + 1
+    return index - 1
+
+
+def _xlsx_rows(path):
+    """逐行读取第一个工作表，返回 (行号, 单元格文本列表)"""
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise ImportFileError('无法识别的 XLSX 文件')
+    with archive:
+        names = archive.namelist()
+        sheets = sorted(name for name in names if re.match(r'^xl/worksheets/sheet\d+\.xml$', name))
+        if not sheets:
+            raise ImportFileError('XLSX 文件中没有工作表')
+        shared = []
+        if 'xl/sharedStrings.xml' in names:
+            with archive.open('xl/sharedStrings.xml') as f:
+                for _, element in iterparse(f):
+                    if element.tag == SHEET_NS + 'si':
+                        shared.append(''.join(text.text or '' for text in element.iter(SHEET_NS + 't')))
+                        element.clear()
+
+        sheet = min(sheets, key=lambda name: int(re.search(r'\d+', name).group()))
+        line = 0
+        with archive.open(sheet) as f:
+            for _, element in iterparse(f):
+                if element.tag != SHEET_NS + 'row':
+                    continue
+                values = []
+                for cell in element.iter(SHEET_NS + 'c'):
+                    cell_type = cell.get('t')
+                    if cell_type == 'inlineStr':
+                        value = ''.join(text.text or '' for text in cell.iter(SHEET_NS + 't'))
+                    else:
+                        raw = cell.find(SHEET_NS + 'v')
+                        value = raw.text or '' if raw is not None else ''
+                        if cell_type == 's' and value:
+                            value = shared[int(value)]
+                        elif cell_type is None and value.endswith('.0'):
+                            # 整数单元格（如手机号、课程编号）可能被保存为浮点数
+                            value = value[:-2]
+                    index = _column_index(cell.get('r', '')) if cell.get('r') else len(values)
+                    values.extend([''] * (index + 1 - len(values)))
+                    values[index] = value
+                line = int(element.get('r') or line + 1)
+                element.clear()
+                yield line, values
+
+
+def _csv_rows(path):
+    with open(path, 'rb') as raw:
+        try:
+            text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+            yield from enumerate(csv.reader(text), start=1)
+        except UnicodeDecodeError:
+            raise ImportFileError('CSV 文件需要使用 UTF-8 编码')
+
+
+def read_rows(path, filename):
+    """按行读取导入文件，返回 (行号, {规范字段: 文本}) 的迭代器，跳过空行"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.xlsx':
+        rows = _xlsx_rows(path)
+    elif extension == '.csv':
+        rows = _csv_rows(path)
+    else:
+        raise ImportFileError('只支持 CSV 和 XLSX 文件')
+
+    first = next(rows, None)
+    if first is None:
+        raise ImportFileError('文件为空')
+    fields = [HEADER_NAMES.get(str(name).strip().lower()) for name in first[1]]
+    missing = [name for name in ('username', 'email', 'full_name') if name not in fields]
+    if missing:
+        labels = '、'.join(COLUMNS[name][1] for name in missing)
+        raise ImportFileError(f'缺少必需的列：{labels}')
+
+    for line, values in rows:
+        record = {}
+        for field, value in zip(fields, values):
+            if field is not None:
+                record[field] = str(value).strip()
+        if any(record.values()):
+            yield line, record
+
+
+def validate(record, default_course_id=None):
+    """校验一行，返回 (规范化后的记录, 错误信息)"""
+    for name in ('username', 'email', 'full_name'):
+        if not record.get(name):
+            return None, f'{COLUMNS[name][1]}不能为空'
+    if not USERNAME_PATTERN.match(record['username']):
+        return None, '用户名只能包含字母、数字、下划线、点和连字符，长度3-80'
+    if not EMAIL_PATTERN.match(record['email']) or len(record['email']) > 120:
+        return None, '邮箱格式不正确'
+    if len(record['full_name']) > 100:
+        return None, '姓名过长'
+    password = record.get('password') or ''
+    if password and len(password) < 6:
+        return None, '密码至少6位'
+    level = (record.get('chinese_level') or 'HSK1').upper().replace(' ', '')
+    if level not in CHINESE_LEVELS:
+        return None, f'中文水平应为 {"/".join(CHINESE_LEVELS)}'
+
+    course_id = default_course_id
+    if record.get('course_id'):
+        try:
+            course_id = int(record['course_id'])
+        except ValueError:
+            return None, '课程编号必须是数字'
+
+    return {
+        'username': record['username'],
+        'email': record['email'].lower(),
+        'full_name': record['full_name'],
+        'password': password,
+        'generated_password': not password,
+        'phone': (record.get('phone') or '')[:20] or None,
+        'native_language': record.get('native_language') or 'Vietnamese',
+        'chinese_level': level,
+        'course_id': course_id,
+    }, None
+
+
+# 导入任务
+
+class ImportJob:
+    """一次导入任务"""
+
+    def __init__(self, owner_id, path, filename, course_id):
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.path = path
+        self.filename = filename
+        self.course_id = course_id
+        self.status = 'queued'
+        self.error = None
+        self.rows = 0
+        self.created = 0
+        self.enrolled = 0
+        self.error_count = 0
+        self.errors = []
+        self.credentials = []
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def add_error(self, line, record, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line, 'username': (record or {}).get('username'), 'error': message})
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'filename': self.filename,
+            'rows': self.rows,
+            'created': self.created,
+            'enrolled': self.enrolled,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'elapsed_ms': round(((self.finished_at or time.time()) - self.started_at) * 1000)
+            if self.started_at else None,
+        }
+
+
+class StudentImporter:
+    """后台导入线程 + 密码哈希进程池
+
+    connect 为无参函数，返回一个上下文管理器，进入时得到已开始事务的数据库连接
+    （退出时提交，异常时回滚），metadata 为应用模型的元数据。
+    """
+
+    def __init__(self, connect, metadata, workers=None, chunk_size=500, password_method=None,
+                 maxsize=8, result_ttl=3600):
+        self.connect = connect
+        self.metadata = metadata
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.password_method = password_method or None
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._executor = None
+
+    def _ensure_started(self):
+        # 首次提交时才启动线程，避免在导入模块或调试重载的父进程中启动
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='student-import', daemon=True)
+                self._thread.start()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def submit(self, owner_id, path, filename, course_id=None):
+        """提交导入任务，返回ImportJob；队列满时抛出ImportQueueFull"""
+        self._ensure_started()
+        self._expire_jobs()
+        job = ImportJob(owner_id, path, filename, course_id)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise ImportQueueFull()
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def take_credentials(self, job):
+        """取出已结束任务生成的密码，只返回一次；任务未结束时返回空列表"""
+        if job.status not in ('done', 'failed'):
+            return []
+        with self._lock:
+            credentials, job.credentials = job.credentials, []
+        return credentials
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.started_at = time.time()
+            job.status = 'running'
+            try:
+                self.run_import(job)
+                job.status = 'done'
+            except ImportFileError as e:
+                job.error = str(e)
+                job.status = 'failed'
+            except Exception as e:
+                print(f"学生导入任务失败: {e}")
+                job.error = '导入失败，请重试'
+                job.status = 'failed'
+            finally:
+                job.finished_at = time.time()
+                try:
+                    os.remove(job.path)
+                except OSError:
+                    pass
+                self._queue.task_done()
+
+    def run_import(self, job):
+        """读取整个文件并分批写入，也可以在当前线程直接调用（如命令行导入）"""
+        seen_usernames = set()
+        seen_emails = set()
+        chunk = []
+        for line, record in read_rows(job.path, job.filename):
+            job.rows += 1
+            valid, error = validate(record, job.course_id)
+            if error is None and valid['username'].lower() in seen_usernames:
+                error = '文件中用户名重复'
+            if error is None and valid['email'] in seen_emails:
+                error = '文件中邮箱重复'
+            if error is not None:
+                job.add_error(line, record, error)
+                continue
+            seen_usernames.add(valid['username'].lower())
+            seen_emails.add(valid['email'])
+            chunk.append((line, valid))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(job, chunk)
+                chunk = []
+        if chunk:
+            self._import_chunk(job, chunk)
+
+    def _import_chunk(self, job, chunk):
+        try:
+            with self.connect() as connection:
+                chunk = self._check_existing(connection, job, chunk)
+            if not chunk:
+                return
+            # 哈希计算耗时较长，在事务之外进行；期间被抢先注册的用户名由唯一约束拦下
+            for _, record in chunk:
+                if record['generated_password']:
+                    record['password'] = secrets.token_urlsafe(9)
+            hashes = list(self._pool().map(
+                hash_password,
+                [(record['password'], self.password_method) for _, record in chunk],
+                chunksize=max(1, len(chunk) // (self.workers * 4))
+            ))
+            with self.connect() as connection:
+                enrolled = self._insert(connection, [record for _, record in chunk], hashes)
+        except Exception as e:
+            print(f"学生导入写入失败: {e}")
+            for line, record in chunk:
+                job.add_error(line, record, '写入数据库失败，请重新导入这一行')
+            return
+
+        job.created += len(chunk)
+        job.enrolled += enrolled
+        job.credentials.extend(
+            {'username': record['username'], 'password': record['password']}
+            for _, record in chunk if record['generated_password']
+        )
+
+    def _check_existing(self, connection, job, chunk):
+        """去掉用户名/邮箱已存在或课程不存在的行"""
+        users = self.metadata.tables['user']
+        courses = self.metadata.tables['course']
+        # 用户名和邮箱都不区分大小写：邮箱保存为小写，可以直接用唯一索引；用户名用 lower(username) 索引
+        usernames = {record['username'].lower() for _, record in chunk}
+        emails = {record['email'] for _, record in chunk}
+        course_ids = {record['course_id'] for _, record in chunk if record['course_id'] is not None}
+
+        taken_usernames = {username.lower() for username in connection.execute(
+            select(users.c.username).where(func.lower(users.c.username).in_(usernames))).scalars()}
+        taken_emails = set(connection.execute(
+            select(users.c.email).where(users.c.email.in_(emails))).scalars())
+        existing_courses = set(connection.execute(
+            select(courses.c.id).where(courses.c.id.in_(course_ids))).scalars()) if course_ids else set()
+
+        remaining = []
+        for line, record in chunk:
+            if record['username'].lower() in taken_usernames:
+                job.add_error(line, record, '用户名已存在')
+            elif record['email'] in taken_emails:
+                job.add_error(line, record, '邮箱已被注册')
+            elif record['course_id'] is not None and record['course_id'] not in existing_courses:
+                job.add_error(line, record, f"课程 {record['course_id']} 不存在")
+            else:
+                remaining.append((line, record))
+        return remaining
+
+    def _insert(self, connection, records, hashes):
+        """批量插入用户、学生资料和选课记录，返回选课数"""
+        users = self.metadata.tables['user']
+        profiles = self.metadata.tables['student_profile']
+        enrollments = self.metadata.tables['course_enrollment']
+        now = datetime.utcnow()
+
+        connection.execute(users.insert(), [{
+            'username': record['username'],
+            'email': record['email'],
+            'password_hash': password_hash,
+            'role': 'student',
+            'created_at': now,
+            'avatar': 'default-avatar.png',
+            'status': 'active',
+        } for record, password_hash in zip(records, hashes)])
+        # 不依赖 RETURNING（MySQL不支持），按用户名取回ID
+        user_ids = dict(connection.execute(select(users.c.username, users.c.id).where(
+            users.c.username.in_([record['username'] for record in records]))).all())
+
+        connection.execute(profiles.insert(), [{
+            'user_id': user_ids[record['username']],
+            'full_name': record['full_name'],
+            'phone': record['phone'],
+            'native_language': record['native_language'],
+            'chinese_level': record['chinese_level'],
+        } for record in records])
+        profile_ids = dict(connection.execute(select(profiles.c.user_id, profiles.c.id).where(
+            profiles.c.user_id.in_(list(user_ids.values())))).all())
+
+        enrollment_rows = [{
+            'student_id': profile_ids[user_ids[record['username']]],
+            'course_id': record['course_id'],
+            'enrollment_date': now,
+            'status': 'active',
+            'progress': 0,
+        } for record in records if record['course_id'] is not None]
+        if enrollment_rows:
+            connection.execute(enrollments.insert(), enrollment_rows)
+
+        # 批量插入不经过ORM事件，统计数据在同一事务中累加
+        counters, daily = Counter(), Counter()
+        for table_name, rows in (('user', [{'role': 'student', 'created_at': now}] * len(records)),
+                                 ('course_enrollment', enrollment_rows)):
+            for row in rows:
+                row_counters, row_daily = stats.deltas(table_name, new=row)
+                counters.update(row_counters)
+                daily.update(row_daily)
+        stats.apply(connection, counters, daily)
+        return len(enrollment_rows)
+
+    def _expire_jobs(self):
+        """清理超过保留时间的已完成任务（包括没有被取走的生成密码）"""
+        deadline = time.time() - self.result_ttl
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.finished_at and job.finished_at < deadline:
+                    del self._jobs[job_id]
@@ -0,0 +1,11 @@
+def test_class_students_returns_json_errors(login, make_course):
+    course_id = make_course(lessons=1)
+    client = login('teacher1', 'teacher123')
+
+    response = client.get(f'/api/classes/{course_id}/students')
+    assert response.status_code == 200
+    assert [row['username'] for row in response.get_json()['students']] == ['student1']
+
+    response = client.get('/api/classes/999999/students')
+    assert response.status_code == 404
+    assert response.get_json() == {'error': '课程不存在'}
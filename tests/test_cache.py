@@ -0,0 +1,32 @@
+from flask import Flask
+
+from cache import ResponseCache
+
+
+def make_worker(directory, counter):
+    """模拟一个工作进程：独立的应用和内存缓存，共用版本目录"""
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test', PAGE_CACHE_BACKEND='memory', PAGE_CACHE_DIR=str(directory))
+    cache = ResponseCache(app)
+
+    @app.route('/')
+    @cache.cached(lambda: 'index')
+    def index():
+        counter.append(1)
+        return str(len(counter))
+
+    return app.test_client(), cache
+
+
+def test_clear_invalidates_other_processes(tmp_path):
+    counter = []
+    first, first_cache = make_worker(tmp_path, counter)
+    second, second_cache = make_worker(tmp_path, counter)
+
+    assert first.get('/').data == b'1'
+    assert second.get('/').data == b'2'
+    assert second.get('/').data == b'2'
+
+    first_cache.clear()
+    assert second.get('/').data == b'3'
+    assert second.get('/').data == b'3'
@@ -0,0 +1,40 @@
+from urllib.parse import urlsplit
+
+
+def feed_path(url):
+    return urlsplit(url).path
+
+
+def test_schedule_feed_is_folded_and_token_rotates(application, app, login, make_course):
+    make_course(lessons=2, name='很长的课程名称' * 6)
+    client = login('student1', 'student123')
+    url = client.get('/api/calendar/token').get_json()['feed_url']
+    assert client.get('/api/calendar/token').get_json()['feed_url'] == url
+
+    anon = app.test_client()
+    response = anon.get(feed_path(url))
+    assert response.status_code == 200
+    lines = response.get_data().split(b'\r\n')
+    assert all(len(line) <= 75 for line in lines)
+    assert any(line.startswith(b'DTSTAMP:') and line.endswith(b'Z') for line in lines)
+
+    # 重置后旧链接失效
+    new_url = client.post('/api/calendar/token').get_json()['feed_url']
+    assert anon.get(feed_path(url)).status_code == 404
+    assert anon.get(feed_path(new_url)).status_code == 200
+
+
+def test_schedule_feed_rejects_inactive_user(application, app, login):
+    client = login('student1', 'student123')
+    path = feed_path(client.get('/api/calendar/token').get_json()['feed_url'])
+    with app.app_context():
+        user = application.User.query.filter_by(username='student1').one()
+        user.status = 'inactive'
+        application.db.session.commit()
+    try:
+        assert app.test_client().get(path).status_code == 404
+    finally:
+        with app.app_context():
+            user = application.User.query.filter_by(username='student1').one()
+            user.status = 'active'
+            application.db.session.commit()
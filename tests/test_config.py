@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_missing_secret_key_fails_outside_debug(tmp_path):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'config.db'}", SECRET_KEY='', FLASK_DEBUG='0')
+    result = subprocess.run(
+        [sys.executable, '-c', 'import app'], cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    assert result.returncode != 0
+    assert 'SECRET_KEY' in result.stderr
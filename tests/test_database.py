@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+
+
+def sqlite_only(application):
+    if application.db.engine.dialect.name != 'sqlite':
+        pytest.skip('仅SQLite')
+
+
+def test_sqlite_pragmas_apply_to_app_engine_only(application, db_session):
+    sqlite_only(application)
+    connection = db_session.connection()
+    assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+    assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == 15000
+    assert connection.exec_driver_sql('PRAGMA cache_size').scalar() == -32000
+    assert connection.exec_driver_sql('PRAGMA foreign_keys').scalar() == 0
+
+    # 其他引擎不受应用配置影响
+    other = create_engine('sqlite://')
+    with other.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA cache_size').scalar() != -32000
+    other.dispose()
+
+
+def test_concurrent_writes(application, app):
+    """多个线程同时写入不出现 database is locked"""
+    db = application.db
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(text('CREATE TABLE concurrency_test (worker INTEGER, n INTEGER)'))
+
+    errors = []
+    start = threading.Barrier(8)
+
+    def worker(number):
+        try:
+            with app.app_context():
+                start.wait()
+                for n in range(25):
+                    db.session.execute(
+                        text('INSERT INTO concurrency_test (worker, n) VALUES (:worker, :n)'),
+                        {'worker': number, 'n': n}
+                    )
+                    db.session.commit()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    try:
+        assert errors == []
+        with app.app_context():
+            assert db.session.execute(text('SELECT COUNT(*) FROM concurrency_test')).scalar() == 200
+    finally:
+        with app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(text('DROP TABLE concurrency_test'))
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('sqlite:///qimeng_education.db', 'sqlite:///qimeng_education.db'),
+    ('mysql://qimeng:pw@db/qimeng', 'mysql+pymysql://qimeng:pw@db/qimeng?charset=utf8mb4'),
+    ('mysql+mysqldb://qimeng:pw@db/qimeng?charset=utf8', 'mysql+pymysql://qimeng:pw@db/qimeng?charset=utf8'),
+])
+def test_database_url(url, expected):
+    from database import database_url
+    assert database_url(url) == expected
+
+
+@pytest.mark.parametrize('url, keys', [
+    ('sqlite://', set()),
+    ('sqlite:///qimeng_education.db', {'pool_size', 'max_overflow', 'pool_timeout', 'connect_args'}),
+    ('mysql+pymysql://qimeng:pw@db/qimeng', {'pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle', 'pool_pre_ping'}),
+])
+def test_engine_options(url, keys):
+    from database import DEFAULTS, engine_options
+    assert set(engine_options(url, DEFAULTS)) == keys
@@ -0,0 +1,50 @@
+import io
+
+import pytest
+from PIL import Image
+
+import images
+from images import ImageError, ImagePipeline
+
+
+def png_bytes(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(buffer, 'PNG')
+    return io.BytesIO(buffer.getvalue())
+
+
+def test_variants_are_built_in_spawned_workers(tmp_path):
+    pipeline = ImagePipeline(str(tmp_path), '/static/uploads/images', workers=1)
+    url = pipeline.save(png_bytes(600, 300))
+    digest, filename = pipeline.parse_url(url)
+    future = pipeline.submit(digest, filename)
+    if future is not None:
+        future.result(timeout=60)
+    assert pipeline._executor._mp_context.get_start_method() == 'spawn'
+    assert pipeline.variants(url)['card']['width'] == 480
+
+
+@pytest.mark.filterwarnings('ignore::PIL.Image.DecompressionBombWarning')
+def test_images_over_the_pixel_limit_are_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+    monkeypatch.setattr(images, 'MAX_PIXELS', 100 * 100)
+    pipeline = ImagePipeline(str(tmp_path), '/static/uploads/images')
+    # 在 Pillow 只发出警告的1到2倍之间
+    with pytest.raises(ImageError):
+        pipeline.save(png_bytes(120, 120))
+    assert pipeline._executor is None
+
+
+def test_manifest_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(images, 'MANIFEST_CACHE_SIZE', 2)
+    pipeline = ImagePipeline(str(tmp_path), '/static/uploads/images')
+    urls = []
+    for index in range(3):
+        digest = f'{index:064x}'
+        directory = tmp_path / digest[:2] / digest
+        directory.mkdir(parents=True)
+        (directory / images.MANIFEST).write_text('{"thumb": {"width": 1, "height": 1}}')
+        urls.append(f'/static/uploads/images/{digest[:2]}/{digest}/original.png')
+    for url in urls:
+        assert pipeline.variants(url)
+    assert len(pipeline._manifests) == 2
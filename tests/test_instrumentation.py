@@ -0,0 +1,17 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def test_listeners_are_scoped_to_app_engine(application, app):
+    instrumentation = application.query_instrumentation
+    with app.app_context():
+        engine = application.db.engine
+    assert event.contains(engine, 'before_cursor_execute', instrumentation._before_cursor_execute)
+    assert not event.contains(Engine, 'before_cursor_execute', instrumentation._before_cursor_execute)
+
+
+def test_server_timing_only_for_admins(app, login):
+    assert 'Server-Timing' not in app.test_client().get('/').headers
+    assert 'Server-Timing' not in login('student1', 'student123').get('/').headers
+    timing = login('admin', 'admin123').get('/').headers.getlist('Server-Timing')
+    assert [value.split(';')[0] for value in timing] == ['db', 'app']
@@ -0,0 +1,23 @@
+from datetime import date
+
+
+def test_leave_actions_require_post(application, app, login, make_course):
+    course_id = make_course(lessons=1)
+    with app.app_context():
+        student = application.User.query.filter_by(username='student1').one().student_profile
+        leave = application.LeaveRequest(
+            student_id=student.id, course_id=course_id, lesson_date=date.today(), reason='生病'
+        )
+        application.db.session.add(leave)
+        application.db.session.commit()
+        leave_id = leave.id
+
+    client = login('teacher1', 'teacher123')
+    assert client.get(f'/teacher/approve_leave/{leave_id}').status_code == 405
+    assert client.get(f'/teacher/reject_leave/{leave_id}').status_code == 405
+    with app.app_context():
+        assert application.db.session.get(application.LeaveRequest, leave_id).status == 'pending'
+
+    assert client.post(f'/teacher/approve_leave/{leave_id}').status_code == 302
+    with app.app_context():
+        assert application.db.session.get(application.LeaveRequest, leave_id).status == 'approved'
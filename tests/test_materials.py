@@ -0,0 +1,94 @@
+import io
+import os
+
+
+def blob_files(application):
+    blob_dir = application.material_store.blob_dir
+    return {os.path.join(root, name) for root, _, names in os.walk(blob_dir) for name in names}
+
+
+def test_empty_upload_stores_nothing(application, login, make_course):
+    course_id = make_course(lessons=0, enroll=())
+    client = login('teacher1', 'teacher123')
+    before = blob_files(application)
+    response = client.post('/api/materials/upload', data={
+        'class_id': course_id, 'title': '空文件', 'file': (io.BytesIO(b''), 'empty.txt')
+    })
+    assert response.status_code == 400
+    assert response.get_json() == {'error': '文件为空'}
+    assert blob_files(application) == before
+
+
+def test_chunked_upload_is_reauthorized_at_finish(application, app, login, make_course):
+    course_id = make_course(lessons=0, enroll=())
+    client = login('teacher1', 'teacher123')
+    response = client.post('/api/materials/uploads', json={
+        'class_id': course_id, 'title': '讲义', 'filename': 'notes.txt', 'size': 10
+    })
+    assert response.status_code == 201
+    upload_url = response.get_json()['upload_url']
+    assert client.patch(upload_url, data=b'01234', headers={'Upload-Offset': '0'}).get_json()['offset'] == 5
+
+    # 上传过程中课程改由其他老师任教
+    with app.app_context():
+        course = application.db.session.get(application.Course, course_id)
+        course.teacher_id = 999999
+        application.db.session.commit()
+
+    before = blob_files(application)
+    response = client.patch(upload_url, data=b'56789', headers={'Upload-Offset': '5'})
+    assert response.status_code == 403
+    assert blob_files(application) == before
+    assert client.get(upload_url).status_code == 404
+    with app.app_context():
+        assert application.CourseMaterial.query.filter_by(course_id=course_id).count() == 0
+
+
+def test_legacy_static_files_are_not_served(app):
+    directory = os.path.join(app.static_folder, 'uploads', 'materials')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'legacy-test.txt')
+    with open(path, 'wb') as f:
+        f.write(b'secret')
+    try:
+        client = app.test_client()
+        for url in ('/static/uploads/materials/legacy-test.txt',
+                    '/static/uploads//materials/legacy-test.txt',
+                    '/static/uploads/./materials/legacy-test.txt',
+                    '/static/uploads/avatars/../materials/legacy-test.txt'):
+            assert client.get(url).status_code == 404, url
+    finally:
+        os.remove(path)
+
+
+def test_upload_is_stored_outside_static_and_moved_from_legacy(application, app, login, make_course):
+    course_id = make_course(lessons=0, enroll=())
+    client = login('teacher1', 'teacher123')
+    response = client.post('/api/materials/upload', data={
+        'class_id': course_id, 'title': '讲义', 'file': (io.BytesIO(b'hello'), 'notes.txt')
+    })
+    assert response.status_code == 201
+    material = response.get_json()['material']
+    assert client.get(material['file_url']).data == b'hello'
+    with app.app_context():
+        stored = application.db.session.get(application.CourseMaterial, material['id'])
+        path = application.material_file_path(stored)
+    assert not os.path.realpath(path).startswith(os.path.realpath(app.static_folder))
+
+    # 旧数据：文件在 static/uploads/materials 下
+    directory = os.path.join(app.static_folder, 'uploads', 'materials')
+    os.makedirs(directory, exist_ok=True)
+    legacy_path = os.path.join(directory, 'legacy-move.txt')
+    with open(legacy_path, 'wb') as f:
+        f.write(b'legacy')
+    with app.app_context():
+        stored = application.db.session.get(application.CourseMaterial, material['id'])
+        stored.file_path = '/static/uploads/materials/legacy-move.txt'
+        stored.content_hash = None
+        application.db.session.commit()
+    assert client.get(material['file_url']).data == b'legacy'
+
+    result = app.test_cli_runner().invoke(args=['move-material-files'])
+    assert '已移动 1 条' in result.output
+    assert not os.path.exists(legacy_path)
+    assert client.get(material['file_url']).data == b'legacy'
@@ -0,0 +1,55 @@
+import gc
+import threading
+
+from metrics import MetricsRegistry
+
+
+def run_threads(target, count=20):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gc.collect()
+
+
+def test_finished_threads_are_folded_into_totals():
+    registry = MetricsRegistry()
+    counter = registry.counter('jobs_total', '任务数', ('kind',))
+    histogram = registry.histogram('job_seconds', '任务耗时', buckets=(0.1, 1.0))
+
+    def work():
+        counter.inc('a')
+        histogram.observe(0.5)
+
+    run_threads(work)
+    run_threads(work)
+    assert counter._shards._live == {}
+    assert histogram._shards._live == {}
+
+    samples = {(name, labels): value for name, labels, value in counter.samples() + histogram.samples()}
+    assert samples[('jobs_total', (('kind', 'a'),))] == 40
+    assert samples[('job_seconds_bucket', (('le', '0.1'),))] == 0
+    assert samples[('job_seconds_bucket', (('le', '1.0'),))] == 40
+    assert samples[('job_seconds_count', ())] == 40
+    assert samples[('job_seconds_sum', ())] == 20.0
+
+
+def test_live_thread_values_are_included():
+    registry = MetricsRegistry()
+    counter = registry.counter('jobs_total', '任务数')
+    counter.inc(amount=3)
+    run_threads(lambda: counter.inc(), count=2)
+    assert counter.samples() == [('jobs_total', (), 5)]
+
+
+def test_metrics_endpoint_requires_admin_or_token(app, login, monkeypatch):
+    assert app.test_client().get('/metrics').status_code == 401
+    assert login('student1', 'student123').get('/metrics').status_code == 401
+    assert login('admin', 'admin123').get('/metrics').status_code == 200
+
+    headers = {'Authorization': 'Bearer scrape-token'}
+    assert app.test_client().get('/metrics', headers=headers).status_code == 401
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scrape-token')
+    assert app.test_client().get('/metrics', headers=headers).status_code == 200
+    assert app.test_client().get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
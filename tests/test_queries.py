@@ -0,0 +1,26 @@
+"""页面查询次数不随数据量增长（N+1回归）"""
+
+
+def test_student_dashboard_query_count_is_fixed(login, count_queries, make_course):
+    client = login('student1', 'student123')
+    make_course()
+    client.get('/student/dashboard')
+
+    with count_queries() as before:
+        assert client.get('/student/dashboard').status_code == 200
+
+    for _ in range(5):
+        make_course(lessons=6)
+    with count_queries() as after:
+        assert client.get('/student/dashboard').status_code == 200
+
+    assert after.count == before.count
+
+
+def test_student_pages_stay_within_query_limit(login, make_course):
+    # QUERY_LIMIT_ENFORCE 打开时，超过 @query_limit 会抛出 QueryLimitExceeded
+    client = login('student1', 'student123')
+    for _ in range(3):
+        make_course(lessons=4)
+    for path in ('/student/dashboard', '/student/schedule', '/student/materials', '/api/materials'):
+        assert client.get(path).status_code == 200
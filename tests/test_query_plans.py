@@ -0,0 +1,18 @@
+import pytest
+
+
+def test_hot_queries_use_indexes(application, db_session):
+    if application.db.engine.dialect.name != 'sqlite':
+        pytest.skip('EXPLAIN QUERY PLAN 检查仅支持SQLite')
+    assert application.find_full_scans() == {}
+
+
+def test_full_scan_is_detected(application, db_session, monkeypatch):
+    """没有索引可用的查询应被报告，确保检查本身有效"""
+    if application.db.engine.dialect.name != 'sqlite':
+        pytest.skip('EXPLAIN QUERY PLAN 检查仅支持SQLite')
+    Lesson = application.Lesson
+    monkeypatch.setattr(application, 'hot_queries', lambda: {
+        'unindexed': Lesson.query.filter(Lesson.title == '第1课')
+    })
+    assert list(application.find_full_scans()) == ['unindexed']
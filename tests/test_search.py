@@ -0,0 +1,45 @@
+def add_material(application, app, course_id, title, is_public):
+    with app.app_context():
+        material = application.CourseMaterial(
+            course_id=course_id, title=title, file_path='00/missing', file_type='document', is_public=is_public
+        )
+        application.db.session.add(material)
+        application.db.session.commit()
+        return material.id
+
+
+def titles(client, query):
+    response = client.get('/api/search', query_string={'q': query})
+    assert response.status_code == 200
+    return {result['title'] for result in response.get_json()}
+
+
+def test_private_materials_only_visible_to_staff(application, app, login, make_course):
+    course_id = make_course(lessons=0)
+    add_material(application, app, course_id, '声调练习公开讲义', True)
+    add_material(application, app, course_id, '声调练习教师答案', False)
+
+    assert titles(login('student1', 'student123'), '声调练习') == {'声调练习公开讲义'}
+    assert titles(login('teacher1', 'teacher123'), '声调练习') == {'声调练习公开讲义', '声调练习教师答案'}
+    assert titles(login('admin', 'admin123'), '声调练习') == {'声调练习公开讲义', '声调练习教师答案'}
+    assert titles(app.test_client(), '声调练习') == set()
+
+
+def test_material_visibility_change_updates_index(application, app, login, make_course):
+    course_id = make_course(lessons=0)
+    material_id = add_material(application, app, course_id, '书法作业范例', False)
+    student = login('student1', 'student123')
+    assert titles(student, '书法作业') == set()
+
+    with app.app_context():
+        application.db.session.get(application.CourseMaterial, material_id).is_public = True
+        application.db.session.commit()
+    assert titles(student, '书法作业') == {'书法作业范例'}
+
+
+def test_fallback_matches_wildcards_literally(application, app, make_course):
+    make_course(lessons=0, enroll=(), name='暑期100%通过班')
+    make_course(lessons=0, enroll=(), name='暑期1000人大班')
+    with app.test_request_context():
+        assert [r['title'] for r in application.search_fallback('100%', 10)] == ['暑期100%通过班']
+        assert application.search_fallback('暑期_', 10) == []
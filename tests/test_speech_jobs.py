@@ -0,0 +1,87 @@
+import os
+import threading
+
+from speech_jobs import Scorer, ScoringError, SpeechJobQueue
+
+
+class BlockingScorer(Scorer):
+    name = 'blocking'
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def score(self, submission):
+        self.release.wait(5)
+        return {'score': 80, 'pronunciation_score': 80, 'fluency_score': 80, 'feedback': ''}
+
+
+def test_job_state_is_shared_between_processes(tmp_path):
+    """另一个进程（共用状态目录的另一个队列）可以查询和等待任务"""
+    scorer = BlockingScorer()
+    worker = SpeechJobQueue(scorer, workers=1, directory=str(tmp_path))
+    other = SpeechJobQueue(scorer, workers=1, directory=str(tmp_path))
+
+    job = worker.submit(7, {'text': '你好'})
+    seen = other.get(job.id)
+    assert seen is not None and seen.owner_id == 7
+    assert seen.status in ('queued', 'running')
+    assert other.wait(seen, 0.2, interval=0.05) is None
+
+    scorer.release.set()
+    finished = other.wait(seen, 5, interval=0.05)
+    assert finished.status == 'done'
+    assert finished.result['score'] == 80
+    assert other.get('0' * 32) is None
+    assert other.get('../etc/passwd') is None
+
+
+def test_events_stream_returns_quickly(application, login, monkeypatch):
+    monkeypatch.setattr(application, 'SPEECH_EVENTS_WAIT', 0.1)
+    scorer = BlockingScorer()
+    monkeypatch.setattr(application.speech_jobs, 'scorer', scorer)
+    client = login('student1', 'student123')
+    try:
+        response = client.post('/api/speech_evaluate?text=%E4%BD%A0%E5%A5%BD', data=b'RIFF', content_type='audio/wav')
+        assert response.status_code == 202
+        events = client.get(response.get_json()['events_url']).get_data(as_text=True)
+        assert events == 'retry: 1000\n\n'
+    finally:
+        scorer.release.set()
+
+
+class FailingScorer(Scorer):
+    name = 'failing'
+
+    def score(self, submission):
+        raise ScoringError('录音无法解码')
+
+
+def submit_recording(client, audio=b'RIFF0000WAVE'):
+    response = client.post('/api/speech_evaluate?text=%E4%BD%A0%E5%A5%BD', data=audio, content_type='audio/wav')
+    assert response.status_code == 202
+    return response.get_json()['job_id']
+
+
+def wait_job(application, job_id):
+    job = application.speech_jobs.get(job_id)
+    return application.speech_jobs.wait(job, 5)
+
+
+def test_recording_is_private_and_removed_on_failure(application, app, login, monkeypatch):
+    folder = app.config['SPEECH_UPLOAD_FOLDER']
+    assert not os.path.abspath(folder).startswith(os.path.abspath(app.static_folder))
+    client = login('student1', 'student123')
+
+    job_id = submit_recording(client)
+    finished = wait_job(application, job_id)
+    assert finished.status == 'done'
+    audio_url = f"/speech/audio/{finished.result['record_id']}"
+    assert client.get(audio_url).data == b'RIFF0000WAVE'
+    assert app.test_client().get(audio_url).status_code == 302
+    assert login('teacher1', 'teacher123').get(audio_url).status_code == 403
+
+    before = set(os.listdir(folder))
+    monkeypatch.setattr(application.speech_jobs, 'scorer', FailingScorer())
+    job_id = submit_recording(client)
+    assert wait_job(application, job_id).status == 'failed'
+    assert set(os.listdir(folder)) == before
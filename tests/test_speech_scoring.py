@@ -0,0 +1,51 @@
+import subprocess
+
+import numpy as np
+
+import speech_scoring
+from speech_scoring import reference_syllables, score_batch, synthesize_syllables, to_wav_bytes
+
+
+def test_hanzi_reference_has_tones():
+    # 你好 按变调读作 ni2 hao3，们 为轻声
+    assert reference_syllables('你好，我们') == [2, 3, 3, 5]
+    assert reference_syllables('ma1 mā') == [1, 1]
+
+
+def test_hanzi_reference_is_compared_by_tone():
+    audio = to_wav_bytes(synthesize_syllables([1, 2, 3, 4]))
+    # 妈麻马骂 = ma1 ma2 ma3 ma4
+    right, wrong = score_batch([
+        {'audio_bytes': audio, 'text': '妈麻马骂'},
+        {'audio_bytes': audio, 'text': '骂马麻妈'},
+    ])
+    assert right['pronunciation_score'] > wrong['pronunciation_score']
+    assert '声调需要注意' in wrong['feedback']
+
+
+def test_tone_scorer_falls_back_without_ffmpeg(application, monkeypatch):
+    monkeypatch.setitem(application.app.config, 'SPEECH_SCORER', 'tone')
+    monkeypatch.setattr(application, 'ffmpeg_available', lambda: False)
+    assert application.make_speech_scorer().name == 'random'
+    monkeypatch.setattr(application, 'ffmpeg_available', lambda: True)
+    assert application.make_speech_scorer().name == 'tone'
+
+
+def test_overlong_recording_fails_only_its_item(monkeypatch):
+    monkeypatch.setattr(speech_scoring, 'MAX_SECONDS', 2)
+    short = to_wav_bytes(synthesize_syllables([1, 2, 3, 4]))
+    long = to_wav_bytes(np.zeros(3 * speech_scoring.SAMPLE_RATE, dtype=np.float32))
+    ok, too_long = score_batch([{'audio_bytes': short, 'text': '妈麻马骂'}, {'audio_bytes': long, 'text': '妈'}])
+    assert 'pronunciation_score' in ok
+    assert too_long == {'error': '录音过长，最长2秒'}
+
+
+def test_ffmpeg_timeout_fails_only_its_item(monkeypatch):
+    def hang(data):
+        raise subprocess.TimeoutExpired('ffmpeg', 30)
+
+    monkeypatch.setattr(speech_scoring, '_decode_with_ffmpeg', hang)
+    short = to_wav_bytes(synthesize_syllables([1, 2]))
+    ok, hung = score_batch([{'audio_bytes': short, 'text': '妈麻'}, {'audio_bytes': b'webm', 'text': '妈'}])
+    assert 'pronunciation_score' in ok
+    assert hung == {'error': '录音解码超时'}
@@ -0,0 +1,47 @@
+import io
+import time
+
+
+def run_import(client, content):
+    response = client.post('/api/admin/imports', data={
+        'file': (io.BytesIO(content.encode('utf-8')), 'students.csv')
+    })
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        job = client.get(status_url).get_json()
+        if job['status'] in ('done', 'failed'):
+            return status_url, job
+        assert job['credentials'] == []
+        time.sleep(0.1)
+    raise AssertionError('导入超时')
+
+
+def test_import_checks_case_and_returns_passwords_once(application, app, login):
+    with app.app_context():
+        application.db.session.add(application.User(
+            username='Import_Existing', email='Import.Existing@Example.com', password_hash='x'
+        ))
+        application.db.session.commit()
+
+    client = login('admin', 'admin123')
+    status_url, job = run_import(client, (
+        '用户名,邮箱,姓名\n'
+        'import_taken,import.existing@example.com,重复邮箱\n'
+        'import_existing,import.other@example.com,重复用户名\n'
+        'import_new,import.new@example.com,新学生\n'
+    ))
+    assert job['status'] == 'done'
+    assert job['created'] == 1
+    assert [error['error'] for error in job['errors']] == ['邮箱已被注册', '用户名已存在']
+    [credential] = job['credentials']
+    assert credential['username'] == 'import_new'
+    assert client.get(status_url).get_json()['credentials'] == []
+
+    # 默认使用与注册相同的密码哈希
+    with app.app_context():
+        user = application.User.query.filter_by(username='import_new').one()
+        default_method = application.generate_password_hash('x').split('$')[0]
+        assert user.password_hash.startswith(default_method + '$')
+    login('import_new', credential['password'])
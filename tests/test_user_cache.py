@@ -0,0 +1,33 @@
+from sqlalchemy import text
+
+
+def set_status(application, username, status):
+    with application.app.app_context():
+        user = application.User.query.filter_by(username=username).one()
+        user.status = status
+        application.db.session.commit()
+
+
+def test_disabled_user_is_logged_out(application, login):
+    client = login('student1', 'student123')
+    assert client.get('/student/dashboard').status_code == 200
+    set_status(application, 'student1', 'inactive')
+    try:
+        assert client.get('/student/dashboard').status_code == 302
+    finally:
+        set_status(application, 'student1', 'active')
+
+
+def test_change_from_another_process_invalidates_cache(application, login):
+    """其他进程修改用户后只递增共享版本号，本进程的缓存项随之失效"""
+    client = login('student1', 'student123')
+    assert client.get('/student/dashboard').status_code == 200
+    db = application.db
+    with application.app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(text("UPDATE user SET status = 'inactive' WHERE username = 'student1'"))
+    application.data_cache.bump('user')
+    try:
+        assert client.get('/student/dashboard').status_code == 302
+    finally:
+        set_status(application, 'student1', 'active')
@@ -0,0 +1,25 @@
+def test_duplicate_checks_ignore_case(login):
+    client = login('admin', 'admin123')
+    response = client.post('/api/users', json={
+        'username': 'case_user', 'email': 'Case.User@Example.com', 'role': 'student', 'password': 'secret123'
+    })
+    assert response.status_code == 201
+    assert response.get_json()['user']['email'] == 'case.user@example.com'
+
+    response = client.post('/api/users', json={
+        'username': 'case_user2', 'email': 'case.user@example.COM', 'role': 'student', 'password': 'secret123'
+    })
+    assert response.get_json() == {'error': '邮箱已被注册'}
+    response = client.post('/api/users', json={
+        'username': 'Case_User', 'email': 'other.case@example.com', 'role': 'student', 'password': 'secret123'
+    })
+    assert response.get_json() == {'error': '用户名已存在'}
+
+
+def test_user_search_matches_wildcards_literally(login):
+    client = login('admin', 'admin123')
+    # 未转义时 _ 和 % 会匹配 student1
+    assert client.get('/api/users', query_string={'q': 'stu_ent1'}).get_json()['users'] == []
+    assert client.get('/api/users', query_string={'q': 'stu%1'}).get_json()['users'] == []
+    usernames = [user['username'] for user in client.get('/api/users', query_string={'q': 'student'}).get_json()['users']]
+    assert 'student1' in usernames